@@ -0,0 +1,158 @@
+import os
+import subprocess
+import multiprocessing
+import numpy as np
+import matplotlib
+matplotlib.use('Agg') # Workaround for Tkinter import error
+import matplotlib.pyplot as plt
+import matplotlib.ticker
+import matplotlib.colors
+from matplotlib.collections import LineCollection
+import instrument
+
+# Animation of the commuters on each edge, one frame per time step. The edge
+# network is drawn once as a single LineCollection over a cached background;
+# each frame only sets the alpha of every edge and blits the lines and title.
+# Frames are rendered in contiguous shards by a process pool and either written
+# as numbered PNGs or piped in order into ffmpeg:
+#
+#   animate(commuters, 'minutegif')           # minutegif/frame000000.png, ...
+#   animate(commuters, 'week.mp4', minutes=15, fps=24)
+
+# New York City
+defaultbbox = (-74.03, 40.67, -73.90, 40.90)
+
+# output extensions that are encoded by ffmpeg rather than written as PNGs
+streamformats = ['.mp4', '.gif', '.avi', '.mov', '.mkv', '.webm']
+
+# Draws frames on a figure that is set up once. segments is (nedges x 2 x 2);
+# the alpha of an edge is min(alphascale*count, 1), or background without commuters.
+class FrameRenderer(object):
+
+    def __init__(self, segments, bbox=defaultbbox, figsize=(8, 6), dpi=100, color='b',
+                 linewidth=1.0, alphascale=0.3, background=0.0):
+
+        self.alphascale = alphascale
+        self.background = background
+
+        self.fig = plt.figure(figsize=figsize, dpi=dpi)
+        self.ax = self.fig.add_subplot(111, aspect='equal')
+        self.ax.set_xlabel("Longitude (deg E)")
+        self.ax.set_ylabel("Latitude (deg N)")
+        formatter = matplotlib.ticker.ScalarFormatter(useOffset=False)
+        self.ax.yaxis.set_major_formatter(formatter)
+        self.ax.xaxis.set_major_formatter(formatter)
+        self.ax.set_xlim([bbox[0], bbox[2]])
+        self.ax.set_ylim([bbox[1], bbox[3]])
+
+        self.colors = np.tile(matplotlib.colors.colorConverter.to_rgba(color), (len(segments), 1))
+        self.colors[:, 3] = background
+        self.lines = LineCollection(segments, colors=self.colors, linewidths=linewidth,
+                                    animated=True)
+        self.ax.add_collection(self.lines)
+        self.title = self.ax.set_title('', animated=True)
+
+        # everything but the lines and title, drawn once
+        self.canvas = self.fig.canvas
+        self.canvas.draw()
+        self.cache = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.width, self.height = self.canvas.get_width_height()
+
+    # the (height x width x 4) RGBA image of a frame with counts on edge rows
+    def render(self, rows, counts, title):
+        self.colors[:, 3] = self.background
+        self.colors[rows, 3] = np.minimum(self.alphascale*np.asarray(counts, dtype=float), 1.0)
+        self.lines.set_color(self.colors)
+        self.title.set_text(title)
+
+        self.canvas.restore_region(self.cache)
+        self.ax.draw_artist(self.lines)
+        self.ax.draw_artist(self.title)
+        return np.frombuffer(self.canvas.buffer_rgba(), dtype=np.uint8).reshape(
+            (self.height, self.width, 4))
+
+    def close(self):
+        plt.close(self.fig)
+
+# the frames and renderer held by each worker process
+_workerFrames = None
+_workerRenderer = None
+
+def _initWorker(frames, segments, options):
+    global _workerFrames, _workerRenderer
+    _workerFrames = frames
+    _workerRenderer = FrameRenderer(segments, **options)
+
+# render frames first:first+len(titles); with outdir write them as PNGs and
+# return how many, otherwise return them as raw RGBA bytes
+def _renderShard(args):
+    first, titles, outdir = args
+    images = []
+    for i, title in enumerate(titles, first):
+        start, stop = _workerFrames.indptr[i], _workerFrames.indptr[i+1]
+        image = _workerRenderer.render(_workerFrames.indices[start:stop],
+                                       _workerFrames.data[start:stop], title)
+        if outdir is None: images.append(image.tobytes())
+        else: plt.imsave(os.path.join(outdir, 'frame%06d.png' % i), image)
+    return images if outdir is None else len(titles)
+
+# ffmpeg reading raw RGBA frames from stdin
+def _ffmpeg(output, width, height, fps):
+    command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+               '-s', '%dx%d' % (width, height), '-r', str(fps), '-i', '-']
+    if os.path.splitext(output)[1].lower() != '.gif':
+        command += ['-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2', '-pix_fmt', 'yuv420p']
+    return subprocess.Popen(command + [output], stdin=subprocess.PIPE)
+
+# Animate a CommuterMatrix over the edges inside bbox (lon min, lat min, lon max,
+# lat max), summing the counts over steps of minutes. output is a video or GIF
+# file (written by ffmpeg at fps frames per second) or else a directory for
+# numbered PNGs. Frames are rendered by nprocs processes (all CPUs by default)
+# in shards of chunksize frames; the other options go to FrameRenderer.
+# Returns the number of frames.
+def animate(commuters, output, minutes=1, fps=30, bbox=defaultbbox, nprocs=None,
+            chunksize=25, **options):
+
+    edgestore = commuters.edgestore
+    rows = edgestore.index().bbox(*bbox)[0]
+    segments = np.stack([np.column_stack([edgestore.x1[rows], edgestore.y1[rows]]),
+                         np.column_stack([edgestore.x2[rows], edgestore.y2[rows]])], axis=1)
+    frames = commuters.resample(minutes)[:, rows].tocsr()
+    titles = [str(commuters.timeOf(i, minutes=minutes)) for i in range(frames.shape[0])]
+    options['bbox'] = bbox
+
+    stream = os.path.splitext(output)[1].lower() in streamformats
+    outdir = None if stream else output
+    if outdir is not None and not os.path.exists(outdir): os.makedirs(outdir)
+    shards = [(first, titles[first:first+chunksize], outdir)
+              for first in range(0, len(titles), chunksize)]
+
+    if nprocs is None: nprocs = multiprocessing.cpu_count()
+    nprocs = max(min(nprocs, len(shards)), 1)
+    if nprocs > 1:
+        pool = multiprocessing.Pool(nprocs, initializer=_initWorker,
+                                    initargs=(frames, segments, options))
+        results = pool.imap(_renderShard, shards)
+    else:
+        pool = None
+        _initWorker(frames, segments, options)
+        results = (_renderShard(shard) for shard in shards)
+
+    try:
+        if stream:
+            renderer = FrameRenderer(segments[:0], **options)
+            ffmpeg = _ffmpeg(output, renderer.width, renderer.height, fps)
+            renderer.close()
+            for images in results:
+                for image in images: ffmpeg.stdin.write(image)
+                if instrument.enabled: instrument.count('frames.rendered', len(images))
+            ffmpeg.stdin.close()
+            if ffmpeg.wait() != 0: raise IOError("ffmpeg failed to write " + output)
+        else:
+            for count in results:
+                if instrument.enabled: instrument.count('frames.rendered', count)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return len(titles)
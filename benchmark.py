@@ -0,0 +1,289 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import platform
+import datetime
+import argparse
+import subprocess
+import collections
+import timeit
+import numpy as np
+import synthetic
+from fileio import atomicWrite
+
+# Offline benchmarks of the hot paths of the count fit and the Strava analysis,
+# run on synthetic data (see synthetic.py) at several scales:
+#
+#   python benchmark.py --scale small medium -o before.json
+#   python benchmark.py --scale small medium -o after.json --compare before.json
+#
+# Each result is the best time per call over a few repeats, and the time per
+# item (row, walker, query, frame, ...), written as JSON with the commit and
+# library versions so runs can be compared between versions.
+
+# the size of the synthetic data at each scale
+scales = collections.OrderedDict([
+    ('small', {'locations':10, 'rows':2000, 'walkers':64, 'edges':2000, 'minutes':1440,
+               'density':0.002, 'queries':100, 'frames':10, 'reports':8760}),
+    ('medium', {'locations':50, 'rows':20000, 'walkers':256, 'edges':20000, 'minutes':7*1440,
+                'density':0.002, 'queries':1000, 'frames':30, 'reports':87600}),
+    ('large', {'locations':200, 'rows':200000, 'walkers':1024, 'edges':200000, 'minutes':7*1440,
+               'density':0.002, 'queries':10000, 'frames':100, 'reports':876000}),
+    ])
+
+# Registry of benchmarks, by name. Each is set up with the parameters of a scale
+# and a scratch directory, and returns the function to time and the number of
+# items it processes per call.
+benchmarks = collections.OrderedDict()
+
+def benchmark(name):
+    def register(func):
+        benchmarks[name] = func
+        return func
+    return register
+
+# the synthetic data, shared by the benchmarks of one scale
+_cache = {}
+
+def _counts(scale):
+    key = ('counts', scale['locations'], scale['rows'])
+    if key not in _cache: _cache[key] = synthetic.countTable(scale['locations'], scale['rows'])
+    return _cache[key]
+
+def _edges(scale):
+    key = ('edges', scale['edges'])
+    if key not in _cache: _cache[key] = synthetic.edgeNetwork(scale['edges'])
+    return _cache[key]
+
+def _commuters(scale):
+    key = ('commuters', scale['edges'], scale['minutes'], scale['density'])
+    if key not in _cache:
+        _cache[key] = synthetic.commuterColumns(_edges(scale), scale['minutes'], scale['density'])
+    return _cache[key]
+
+# parameters near the truth for a count table
+def _truePars(data, nwalkers=None):
+    from design import Design
+    design = Design(data)
+    pars = np.ones(design.ndim)
+    pars[design.index('temperature')] = synthetic.truecoeffs['temperature']
+    pars[design.index('humidity')] = synthetic.truecoeffs['humidity']
+    if nwalkers is None: return pars
+    random = np.random.RandomState(0)
+    return pars*(1 + 1e-3*random.standard_normal((nwalkers, len(pars))))
+
+# the scalar likelihood.bikelike, one parameter vector per call
+@benchmark('bikelike')
+def bikelikeCall(scale, workdir):
+    from likelihood import bikelike
+    data = _counts(scale)
+    pars = _truePars(data)
+    return lambda: bikelike(pars, data), 1
+
+# the vectorized likelihood on a block of walkers, as emcee calls it
+@benchmark('bikelike.block')
+def bikelikeBlock(scale, workdir):
+    from likelihood import BikeLike
+    data = _counts(scale)
+    like = BikeLike(data)
+    pars = _truePars(data, scale['walkers'])
+    return lambda: like(pars), scale['walkers']
+
+# parse count.csv without the cache
+@benchmark('readcounts')
+def readCountsParse(scale, workdir):
+    from countdata import readCounts
+    csvname = os.path.join(workdir, 'count.csv')
+    synthetic.writeCounts(csvname, scale['locations'], scale['rows'])
+    return lambda: readCounts(csvname, cache=False), scale['rows']
+
+# load count.csv from its count.csv.npz cache
+@benchmark('readcounts.cached')
+def readCountsCached(scale, workdir):
+    from countdata import readCounts
+    csvname = os.path.join(workdir, 'count.csv')
+    synthetic.writeCounts(csvname, scale['locations'], scale['rows'])
+    readCounts(csvname)
+    return lambda: readCounts(csvname), scale['rows']
+
+# importing an hourly METAR archive into a weatherstore, one archive per call
+@benchmark('weatherstore.import')
+def importWeather(scale, workdir):
+    from weatherstore import importArchives
+    csvname = os.path.join(workdir, 'weather.csv')
+    synthetic.writeWeather(csvname, scale['reports'])
+    outdir = os.path.join(workdir, 'weatherstore')
+    return lambda: importArchives([csvname], outdir), scale['reports']
+
+# joining the memory-mapped weather onto the count table, one table per call
+@benchmark('weatherstore.join')
+def joinStoredWeather(scale, workdir):
+    from weatherstore import importArchives, openStation
+    from weather import joinColumns
+    csvname = os.path.join(workdir, 'weather.csv')
+    synthetic.writeWeather(csvname, scale['reports'], start='2012-07-01')
+    outdir = os.path.join(workdir, 'weatherstore')
+    importArchives([csvname], outdir)
+    data = dict(_counts(scale))
+    return lambda: joinColumns(data, openStation(outdir, 'BED')), scale['rows']
+
+# combine the Date and Time strings into datetime64
+@benchmark('dates')
+def parseDates(scale, workdir):
+    from countdata import parseDateTime
+    data = _counts(scale)
+    return lambda: parseDateTime(data['Date'], data['Time']), scale['rows']
+
+# index the Strava counts by minute and edge
+@benchmark('commuters.build')
+def buildCommuters(scale, workdir):
+    from commuters import CommuterMatrix
+    edgestore = _edges(scale)
+    times, edgeids, commuters = _commuters(scale)
+    return lambda: CommuterMatrix.fromTimes(times, edgeids, commuters, edgestore), len(times)
+
+# hourly, per-edge and hourly-per-edge aggregates
+@benchmark('commuters.aggregate')
+def aggregateCommuters(scale, workdir):
+    from commuters import CommuterMatrix
+    edgestore = _edges(scale)
+    times, edgeids, commuters = _commuters(scale)
+    matrix = CommuterMatrix.fromTimes(times, edgeids, commuters, edgestore)
+    def aggregate():
+        matrix.timeSeries(60)
+        matrix.edgeTotals()
+        matrix.resample(60)
+    return aggregate, len(times)
+
+# getMinDist, one point and edge per call
+@benchmark('getMinDist')
+def minDist(scale, workdir):
+    from spatial import getMinDist
+    edgestore = _edges(scale)
+    n = min(scale['queries'], edgestore.nedges)
+    def distances():
+        for i in range(n):
+            getMinDist(edgestore.x1[i], edgestore.y1[i], edgestore.x2[i], edgestore.y2[i],
+                       -73.97, 40.78)
+    return distances, n
+
+# build the spatial index of the edges
+@benchmark('index.build')
+def buildIndex(scale, workdir):
+    from spatial import EdgeIndex
+    edgestore = _edges(scale)
+    return lambda: EdgeIndex(edgestore.x1, edgestore.y1, edgestore.x2, edgestore.y2),\
+           edgestore.nedges
+
+# the edges within 100m of each of a batch of points
+@benchmark('index.radius')
+def radiusQueries(scale, workdir):
+    edgestore = _edges(scale)
+    index = edgestore.index()
+    random = np.random.RandomState(0)
+    lon = random.uniform(-74.03, -73.90, scale['queries'])
+    lat = random.uniform(40.67, 40.90, scale['queries'])
+    return lambda: index.radius(lon, lat, 100.0), scale['queries']
+
+# render animation frames of the commuters
+@benchmark('frames')
+def renderFrames(scale, workdir):
+    from animate import FrameRenderer
+    from commuters import CommuterMatrix
+    edgestore = _edges(scale)
+    times, edgeids, commuters = _commuters(scale)
+    matrix = CommuterMatrix.fromTimes(times, edgeids, commuters, edgestore)
+    segments = np.stack([np.column_stack([edgestore.x1, edgestore.y1]),
+                         np.column_stack([edgestore.x2, edgestore.y2])], axis=1)
+    renderer = FrameRenderer(segments)
+    frames = [matrix.frame(i) for i in range(scale['frames'])]
+    def render():
+        for i, (rows, counts) in enumerate(frames): renderer.render(rows, counts, str(i))
+    return render, scale['frames']
+
+# The best and median time (s) per call of func over repeat runs of number
+# calls, with number raised until a run takes at least mintime
+def timeCalls(func, repeat=3, mintime=0.2):
+    number = 1
+    while True:
+        elapsed = timeit.timeit(func, number=number)
+        if elapsed >= mintime or number >= 1 << 20: break
+        number *= max(2, min(int(mintime/max(elapsed, 1e-9)), 10))
+    times = [elapsed] + [timeit.timeit(func, number=number) for i in range(repeat - 1)]
+    times = np.array(times)/number
+    return {'best':float(times.min()), 'median':float(np.median(times)), 'number':number,
+            'repeat':repeat}
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Run the named benchmarks (all by default) at each scale. Returns the report:
+# when and where it ran and one result per benchmark and scale.
+def runBenchmarks(names=None, scalenames=('small',), repeat=3, mintime=0.2, verbose=True):
+
+    report = {'created':datetime.datetime.now().isoformat(), 'commit':_commit(),
+              'python':sys.version.split()[0], 'numpy':np.__version__,
+              'platform':platform.platform(), 'results':[]}
+    workdir = tempfile.mkdtemp(prefix='benchmark')
+    try:
+        for scalename in scalenames:
+            scale = scales[scalename]
+            _cache.clear()
+            for name in names or benchmarks:
+                func, items = benchmarks[name](scale, workdir)
+                result = timeCalls(func, repeat=repeat, mintime=mintime)
+                result.update({'name':name, 'scale':scalename, 'params':scale, 'items':items,
+                               'peritem':result['best']/items})
+                report['results'].append(result)
+                if verbose:
+                    print "%-20s %-7s %12.6f s/call %12.3g s/item" % (name, scalename,
+                        result['best'], result['peritem'])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        _cache.clear()
+    return report
+
+# Print the ratio of the times of report to those of baseline (another report)
+# for the benchmarks in both, flagging those slower by more than threshold.
+# Returns the names and scales of the regressions.
+def compareReports(report, baseline, threshold=1.2):
+    before = dict(((result['name'], result['scale']), result) for result in baseline['results'])
+    regressions = []
+    print "Compared with", baseline.get('commit'), "of", baseline.get('created')
+    for result in report['results']:
+        key = (result['name'], result['scale'])
+        if key not in before: continue
+        ratio = result['best']/before[key]['best']
+        flag = ''
+        if ratio > threshold:
+            regressions.append(key)
+            flag = 'SLOWER'
+        elif ratio < 1.0/threshold: flag = 'faster'
+        print "%-20s %-7s %8.2fx %s" % (result['name'], result['scale'], ratio, flag)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analysis on synthetic data")
+    parser.add_argument('--scale', nargs='+', choices=list(scales), default=['small'],
+                        help="data sizes to run at")
+    parser.add_argument('--only', nargs='+', choices=list(benchmarks), help="benchmarks to run")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs of each benchmark")
+    parser.add_argument('-o', '--output', default='benchmark.json', help="JSON report to write")
+    parser.add_argument('--compare', help="earlier JSON report to compare with")
+    args = parser.parse_args(argv)
+
+    report = runBenchmarks(args.only, args.scale, repeat=args.repeat)
+    atomicWrite(args.output, json.dumps(report, indent=1, sort_keys=True))
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compareReports(report, json.load(f))
+        if regressions: sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,409 +1,309 @@
-from qgis.core import *
-import qgis.utils
-import ipdb
 import datetime
-import urllib2
 import numpy as np
 import matplotlib
 matplotlib.use('Agg') # Workaround for Tkinter import error
-import matplotlib.pyplot as plt
-import json
-import sys
-import collections
-import math
-import urllib2
-import matplotlib.dates as mdates
-import csv
-import numpy as np
+import os
 import emcee
-import corner
-
-def updateData():
-    key = "1uZ4_bSXdB188mBj8PVJL4fGErOeOyN1g5OR8_ZLdAlk"
-    gid = "1919569404"
-    response = urllib2.urlopen("https://docs.google.com/spreadsheet/ccc?key=" + key + "&output=csv", timeout = 5)
-    countdata = response.read().split('\r\n')
-    response = urllib2.urlopen("https://docs.google.com/spreadsheet/ccc?key=" + key + "&gid=" + gid + "&output=csv", timeout = 5)
-    locationdata = response.read().split('\r\n')
-    f = open( "count.csv", 'w' )
-    f.write( '\n'.join(countdata))
-    f.close()
-    f = open( "location.csv", 'w' )
-    f.write( '\n'.join(locationdata))
-    f.close()
-
-def readcsv(csvname):
-    # read the CSV file into a dictionary
-    f = open(csvname, 'rb')
-    reader = csv.reader(f)
-    headers = reader.next()
-    values = {}
-    for h in headers:
-        values[h] = []
-    for row in reader:
-        for h, v in zip(headers, row):
-            values[h].append(v)    
-    return values
-
-
-# get the weather for a given day by airport code (is it international?)
-#def getWeather(date, airport='BOS', timezone=5):
-def getWeather(date, airport='BED', timezone=5):
-
-    # https://www.wunderground.com/history/airport/BOS/2015/10/8/DailyHistory.html?&format=1
-    url = 'https://www.wunderground.com/history/airport/' + airport + '/' +\
-          str(date.year) + '/' + str(date.month) + '/' + str(date.day) +\
-          '/DailyHistory.html?&format=1'
-    request = urllib2.Request(url)
+from weather import getWeatherRange, joinWeather, joinColumns
+from weatherstore import openStation
+from countdata import readCounts
+from likelihood import BikeLike
+from parallel import ParallelBikeLike
+from chainstore import ChainStore
+from sampling import warmStart, initWalkers, runMCMC, GaugedLike, reducePars, expandPars
+from predictive import posteriorPredictive
+from pipeline import Pipeline
+import countdata
+import weather
+import weatherstore
+import likelihood
+import parallel
+import sampling
+import chainstore
+import predictive
+import design
+import mapfit
+from mapfit import fitMAP, laplaceSamples
+import summaries
+import figures
+from figures import FigureSpec, renderFigures
+import compare
+from compare import compareModels, printComparison
+import bootstrap
+from bootstrap import bootstrapFit
+from summaries import PosteriorSummary, iterArray, plotHistograms, plotTriangle
+from design import Design
+import scipy.sparse
+import scipy.sparse.linalg
+
+# the count at each location corrected to 70F by the model of pars, one
+# figure per location
+def bestfitFigures(pars, data, formula='temperature + humidity', airport='BED'):
+
+    design = Design(data, formula, airport)
+    pars = np.asarray(pars, dtype=float)
+    bikers = design.model(pars)[0]
+    rate = data['Total Bike']/data['Interval']
+    zeropoints = pars[design.zeropoints]
+    ctemp = pars[design.index('temperature')]
+
+    specs = []
+    for i, location in enumerate(design.locations):
+        match = np.where(design.codes == i)
+
+        # data corrected to 70F
+        y = zeropoints[i]*ctemp*(70-data['Temperature (' + airport + ')'][match]) +\
+            bikers[match] - rate[match]
+
+        spec = FigureSpec(location + '.png', 'timeseries', title=location)
+        spec.plot(data['datetime'][match], y, 'bo', label=location)
+#        spec.plot(data['datetime'][match], bikers[match], 'bo', label=location)
+#        spec.plot(data['datetime'][match], rate[match], 'ro', label=location)
+        specs.append(spec)
+    return specs
+
+# The analysis as cached stages; run "python bikecount.py --help" for how to run
+# part of it, e.g. --from triangle to redo the triangle plot from the cached chain
+pipeline = Pipeline(os.path.join('.pipeline', 'bikecount'))
+
+# the airport the weather covariates come from, the '<label> (<airport>)'
+# columns of the count table; the spreadsheet has BED's, others need joinweather
+airport = 'BED'
+
+# read count.csv into typed columns (cached in count.csv.npz). With joinweather,
+# fill the weather covariates from the airport's history instead of using the
+# values typed into the spreadsheet: from the local store weatherdir (see
+# weatherstore.py; --force counts after rebuilding it) if given, otherwise
+# downloaded
+@pipeline.stage('counts', files=['count.csv'], code=[countdata, weather, weatherstore],
+                joinweather=False, weatherdir=None, airport=airport)
+def counts(joinweather, weatherdir, airport):
+    data = readCounts('count.csv')
+    if joinweather:
+        start = data['datetime'].min().astype(datetime.datetime) - datetime.timedelta(days=1)
+        end = data['datetime'].max().astype(datetime.datetime) + datetime.timedelta(days=1)
+        if weatherdir:
+            joinColumns(data, openStation(weatherdir, airport, start, end), airport=airport)
+        else:
+            joinWeather(data, getWeatherRange(airport, start, end), airport=airport)
+    return data
+
+# the covariates of the model, e.g. 'temperature + humidity + precipitation +
+# hour' (see design.covariates for the names)
+formula = 'temperature + humidity'
+
+# seed the walkers from the least-squares/MAP solution instead of zero weather
+# coefficients
+@pipeline.stage('warmstart', inputs=['counts'], code=[design, likelihood, sampling, mapfit],
+                formula=formula, airport=airport)
+def warmstart(data, formula, airport):
+    initpars = warmStart(BikeLike(data, formula=formula, airport=airport))
+    print initpars
+    return initpars
+
+# sample until the autocorrelation time has converged, streaming the chain to
+# workdir/chain and resuming from its last checkpoint if there is one. The
+# chain holds the parameters with the mean zeropoint fixed at 1 and the last
+# zeropoint left out (see sampling.GaugedLike).
+@pipeline.stage('mcmc', inputs=['counts', 'warmstart'],
+                code=[design, likelihood, parallel, sampling, chainstore],
+                nwalkers=1000, maxsteps=10000, nprocs=1, formula=formula, airport=airport)
+def mcmc(data, initpars, nwalkers, maxsteps, nprocs, formula, airport, workdir):
+
+    # number of worker processes for the likelihood; 1 evaluates in this process
+    if nprocs > 1: lnlike = ParallelBikeLike(data, nprocs=nprocs, formula=formula, airport=airport)
+    else: lnlike = BikeLike(data, formula=formula, airport=airport)
+    # the workers and their shared memory go away even if sampling fails or is
+    # interrupted
     try:
-        response = urllib2.urlopen(request)
-    except:
-        print 'could not open ' + url
-        return -1
-
-    data = response.read().split('<br />\n')
-
-    # is it stable? is it uniform for all airports/times? 
-    # TODO: read with CSV reader (?), check that required keys are present
-    weather = {'time':[],'temperature':[],'dewPoint':[],'humidity':[],'pressure':[],'visibility':[],
-                'windDir':[],'windSpeed':[],'windGust':[],'precipitation':[],'events':[],'conditions':[]}    
-    for values in data[1:]:
-        valarr = values.split(',')
-        if len(valarr) == 14:
-            weather['time'].append(datetime.datetime.strptime(valarr[13],'%Y-%m-%d %H:%M:%S') -
-                                   datetime.timedelta(hours=timezone))
-            weather['temperature'].append(valarr[1])
-            weather['dewPoint'].append(valarr[2])
-            weather['humidity'].append(valarr[3])
-            weather['pressure'].append(valarr[4])
-            weather['visibility'].append(valarr[5])
-            weather['windDir'].append(valarr[12])
-            weather['windSpeed'].append(valarr[7])
-            weather['windGust'].append(valarr[8])
-            weather['precipitation'].append(valarr[9])
-            weather['events'].append(valarr[10])
-            weather['conditions'].append(valarr[11])
-    return weather   
-
-# calculate the likelihood of a given set of parameters given the data
-def bikelike(pars, data, bikers=None, plot=False):
-
-    # Bike count model:
-    # bikers(location,time) = zeropoint(location)*(c0*temperature(time) + c1*humidity(time) + c2*rain(time))
-    # pars[0] = coeff_temp
-    # pars[1] = coeff_humidity
-    # pars[2] = coeff_rain
-    # pars[3:] = zeropoints
-
-    locations = list(set(data['Location']))
-#    if len(locations)+3 != len(pars):
-    if len(locations)+2 != len(pars):
-        print "Parameter array does not match data; exiting"
-        sys.exit()
-
-    locations.sort()
-    nlocations = len(locations)
-    bikers = np.zeros(len(data['Location']))
-    residuals = np.zeros(len(data['Location']))
-
-    for i in range(nlocations):        
-        match = np.where(data['Location'] == locations[i])
-#        bikers[match] = pars[i+3]*(pars[0]*data['Temperature (BED)'][match] + pars[1]*data['Humidity (BED)'][match] + pars[2]*data['Precipitation (BED)'][match])
-        bikers[match] = pars[i+2]*(pars[0]*data['Temperature (BED)'][match] + pars[1]*data['Humidity (BED)'][match])
-#        bikers[match] = pars[i+2]*(pars[0]*data['Temperature (BED)'][match] + pars[1]*data['Precipitation (BED)'][match])
-
-        if plot:
-            fig = plt.figure()
-            ax = fig.add_subplot(111)
-            ax.set_xlabel("Date")
-            ax.set_ylabel("Bikers/minute")
-            ax.set_title(locations[i])
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y'))
-            ax.xaxis.set_ticks([datetime.datetime(2013,1,1),datetime.datetime(2014,1,1),datetime.datetime(2015,1,1),datetime.datetime(2016,1,1)])
-            ax.set_xlim([datetime.datetime(2013,1,1),datetime.datetime(2017,1,1)])
-            y_formatter = matplotlib.ticker.ScalarFormatter(useOffset=False)
-            ax.yaxis.set_major_formatter(y_formatter)
-
-            # data corrected to 70F, 0% humid, 0" rain
-#            y = pars[i+3]*pars[0]*(70-data['Temperature (BED)'][match]) +\
-#                bikers[match] - data['Total Bike'][match]/data['Interval'][match]
-            y = pars[i+2]*pars[0]*(70-data['Temperature (BED)'][match]) +\
-                bikers[match] - data['Total Bike'][match]/data['Interval'][match]
-#            print y
-          
-            plt.plot(data['datetime'][match].astype(datetime.datetime), y, 'bo', label=locations[i])
-#            plt.plot(data['datetime'][match].astype(datetime.datetime), bikers[match], 'bo', label=locations[i])
-#            plt.plot(data['datetime'][match].astype(datetime.datetime), data['Total Bike'][match]/data['Interval'][match], 'ro', label=locations[i])
-
-            plt.savefig(locations[i] + '.png')
-            plt.close()
-#            ipdb.set_trace()
-            
-
-    # negative bikers is unphysical
-    bad = np.where(bikers < 0)
-    if len(bad[0] > 0): return np.NINF
-    
-    residuals = bikers - data['Total Bike']/data['Interval']
-
-    # Poisson Errors
-#    sigma = sqrt(bikers)/data['Interval']
-#    ivar = (1.0/sigma)**2
-    ivar = data['Interval']**2/bikers
-
-    loglike = -0.5*np.sum(ivar*residuals**2)
-#    if loglike > -20: ipdb.set_trace()
-
-    if math.isnan(loglike): ipdb.set_trace()
-    
-    return -0.5*np.sum(ivar*residuals**2)
-
-# read the CSV file into a dictionary
-data = readcsv('count.csv')
-
-# convert date and time to datetime objects
-data['datetime'] = np.array([],dtype=np.datetime64)
-for date,time in zip(data['Date'],data['Time']):
-    data['datetime'] = np.append(data['datetime'], np.datetime64(datetime.datetime.strptime(date + ' ' + time,'%m/%d/%Y %H:%M')))
-
-# define and convert the data types to numpy arrays
-datatypes = {
-    'Location':str,
-    'Weather':str,
-    'Counter':str,
-    'Notes':str,
-    'Latitude':float,
-    'Longitude':float,
-    'Female Ped':float,
-    'Male Ped':float,
-    'Total Ped':float,
-    'Female Bike':float,
-    'Male Bike':float,
-    'Total Bike':float,
-    'Female Other':float,
-    'Male Other':float,
-    'Total Other':float,
-    'Interval':float,
-    'Precipitation (BED)':float,
-    'Temperature (BED)':float,
-    'Humidity (BED)':float,
-    }
-for key in datatypes.keys():
-    array=[]
-    for value in data[key]:
-        if value=='':
-            value = np.nan
-        array.append(value)
-    data[key] = np.asarray(array,dtype=datatypes[key])
-
-# The unique locations
-locations = list(set(data['Location']))
-locations.sort()
-
-
-#ndim, nwalkers = len(locations)+3, 100
-ndim, nwalkers = len(locations)+2, 1000
-sampler = emcee.EnsembleSampler(nwalkers, ndim, bikelike, args=[data])
-
-initpars = [0.0,0.0]
-for location in locations:
-    match = np.where(data['Location'] == location)
-    zeropt = np.sum(data['Total Bike'][match])/np.sum(data['Interval'][match])
-    initpars.append(zeropt)
-print initpars
-
-
-p0 = [np.random.rand(ndim)/1000 + initpars for i in range(nwalkers)]
-
-
-sampler.run_mcmc(p0, 10000)
-
-#labels = ['coeff_temp','coeff_humid','coeff_rain']
-labels = ['coeff_temp','coeff_humid']
-for location in locations:
-    labels.append("c_" + location)
-
-samples = sampler.chain[:, 50:, :].reshape((-1, ndim))
-for i in range(ndim):
-    plt.figure()
-    plt.hist(samples[:,i], 100, color="k", histtype="step")
-    plt.title(labels[i])
-    plt.savefig("Dimension{0:d}".format(i) + '.png')
-    plt.close()
-
-#ipdb.set_trace()
-
-maxlike = np.NINF
-
-for i in range(len(locations)):
-    '''
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    ax.set_xlabel("Date")
-    ax.set_ylabel("Bikers/minute")
-    ax.set_title(locations[i])
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y'))
-    ax.xaxis.set_ticks([datetime.datetime(2013,1,1),datetime.datetime(2014,1,1),datetime.datetime(2015,1,1),datetime.datetime(2016,1,1)])
-    ax.set_xlim([datetime.datetime(2013,1,1),datetime.datetime(2017,1,1)])
-    y_formatter = matplotlib.ticker.ScalarFormatter(useOffset=False)
-    ax.yaxis.set_major_formatter(y_formatter)
-    '''
-    
-    match = np.where(data['Location'] == locations[i])
-
-    x = data['datetime'][match].astype(datetime.datetime)
-    for pars in samples[np.random.randint(len(samples), size=1000)]:
-        like = bikelike(pars,data)
-        print like, pars[0:2]
-        if like > maxlike:
-            maxlike = like
-            bestpars = pars
-
-        bikers = pars[i+2]*(pars[0]*data['Temperature (BED)'][match] + pars[1]*data['Humidity (BED)'][match])
-        #plt.plot(x, bikers, 'b-', label=location, alpha=0.01)
-
-    y = data['Total Bike'][match]/data['Interval'][match]
-#    plt.plot(x, y, 'bo', label=location)
-
-
-#    plt.savefig(locations[i] + '.png')
-#    plt.close()
-    
-
-#ipdb.set_trace()
-print bestpars
-bikelike(bestpars,data,plot=True)
-ipdb.set_trace()
-
+        gauged = GaugedLike(lnlike)
+        ndim = gauged.ndim
+        sampler = emcee.EnsembleSampler(nwalkers, ndim, gauged, vectorize=True)
+
+        p0 = initWalkers(gauged, reducePars(lnlike.design, initpars), nwalkers)
+
+        chaindir = os.path.join(workdir, 'chain')
+        if os.path.exists(os.path.join(chaindir, 'meta.json')): store = ChainStore.open(chaindir)
+        else: store = ChainStore(chaindir, nwalkers, ndim, thin=10, dtype=np.float32)
+
+        run = runMCMC(sampler, p0, maxsteps=maxsteps, store=store)
+    finally:
+        if nprocs > 1: lnlike.close()
+    print "Autocorrelation times:", run['tau']
+    print "Burn-in:", run['burn'], "Thin:", run['thin'], "Steps:", run['nsteps']
+
+    run['chaindir'] = chaindir
+    run['draws'] = expandPars(lnlike.design, store.drawSamples(1000, discard=run['burn']))
+    return run
+
+# MAP fit from the analytic gradient and Hessian, with samples from the Laplace
+# approximation to the posterior in place of a chain. Parameters the data do
+# not constrain are reported and held at their MAP values. Only run when
+# posteriorstage reads it, or asked for with --until laplace.
+@pipeline.stage('laplace', inputs=['counts', 'warmstart'], code=[design, likelihood, mapfit],
+                optional=True, nsamples=100000, formula=formula, airport=airport)
+def laplace(data, initpars, nsamples, formula, airport):
+    lnlike = BikeLike(data, formula=formula, airport=airport)
+    try:
+        fit = fitMAP(lnlike, pars=initpars)
+    except ValueError as error:
+        print "Warning:", error
+        fit = fitMAP(lnlike, pars=initpars, singular='pinv')
+    print "MAP:", fit['loglike'], fit['pars'], "Converged:", fit['converged']
+
+    fit['samples'] = laplaceSamples(fit, nsamples, like=lnlike)
+    fit['draws'] = fit['samples'][:1000]
+    return fit
+
+# where the posterior samples below come from: 'mcmc', or 'laplace' for a
+# quick fit
+posteriorstage = 'mcmc'
+
+# Histograms, moments and quantiles of the posterior, accumulated chunk by
+# chunk from the stored chain (or the Laplace samples) so neither memory nor
+# the plots grow with the length of the run
+@pipeline.stage('summary', inputs=['counts', posteriorstage],
+                code=[design, sampling, chainstore, summaries], bins=100, bins2d=40, formula=formula,
+                airport=airport)
+def summary(data, run, bins, bins2d, formula, airport):
+    designmatrix = Design(data, formula, airport)
+    if 'chaindir' in run:
+        store = ChainStore.open(run['chaindir'])
+        chunks = lambda: (expandPars(designmatrix, chunk)
+                          for chunk in store.iterSamples(discard=run['burn'], thin=run['thin']))
+    else:
+        chunks = lambda: iterArray(run['samples'])
+    result = PosteriorSummary.fromChunks(chunks, designmatrix.names, bins=bins, bins2d=bins2d)
+    print "Posterior mean:", result.mean
+    print "Posterior median:", result.quantiles([50])[0]
+    return result
+
+# the histogram of each parameter; returns the files written
+@pipeline.stage('histograms', inputs=['summary'], outputs=lambda filenames: filenames,
+                code=[summaries])
+def histograms(summary):
+    return plotHistograms(summary)
+
+# likelihoods, best sample and predicted bikers/minute bands for every
+# location from one batch of posterior samples
+@pipeline.stage('predictive', inputs=['counts', posteriorstage], code=[design, likelihood, predictive],
+                formula=formula, airport=airport)
+def posterior(data, run, formula, airport):
+    result = posteriorPredictive(BikeLike(data, formula=formula, airport=airport), run['draws'])
+    print result['maxlike'], result['bestpars'][0:2]
+    return result
+
+# the counts of each location corrected by the best sample; returns the files
+# written
+@pipeline.stage('bestfit', inputs=['counts', 'predictive'], outputs=lambda filenames: filenames,
+                code=[design, figures, bestfitFigures], formula=formula, airport=airport)
+def bestfit(data, result, formula, airport):
+    bestpars = result['bestpars']
+    print bestpars
+    specs = bestfitFigures(bestpars, data, formula=formula, airport=airport)
+    renderFigures(specs)
+    return [spec.filename for spec in specs]
 
 # make a triangle plot
-fig = corner.corner(samples, labels=labels)
-fig.savefig("triangle.png")
-
-
-ipdb.set_trace()
-
-
-#from matplotlib.font_manager import FontProperties
-#fontP = FontProperties()
-#fontP.set_size('small')
-zeropoints = np.zeros((len(locations),len(data['datetime'])),dtype=float)
+@pipeline.stage('triangle', inputs=['summary'], outputs=['triangle.png'], code=[summaries])
+def triangle(summary):
+    plotTriangle(summary, "triangle.png")
 
-i=0
-for location in locations:
+@pipeline.stage('countplots', inputs=['counts'], code=[figures],
+                outputs=['countvtemp.png', 'countvhumidity.png', 'countvrain.png'], airport=airport)
+def countplots(data, airport):
 
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    ax.set_xlabel("Date")
-    ax.set_ylabel("Bikers/minute")
-    ax.set_title(location)
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y'))
-    ax.xaxis.set_ticks([datetime.datetime(2013,1,1),datetime.datetime(2014,1,1),datetime.datetime(2015,1,1),datetime.datetime(2016,1,1)])
-    ax.set_xlim([datetime.datetime(2013,1,1),datetime.datetime(2017,1,1)])
-    y_formatter = matplotlib.ticker.ScalarFormatter(useOffset=False)
-    ax.yaxis.set_major_formatter(y_formatter)
-
-    match = np.where(data['Location'] == location)
-
-    zeropoints[i][match] = 1.0
+    locations = list(data['locations'])
+    rate = data['Total Bike']/data['Interval']
 
     pars1 = [2.98955584e-3,-1.93944467e-4,-1.96151944] # fitting just temp, humid, rain
     pars1 = [0.00293953,-0.00151096,0.9622594] # fitting temp, humid, rain, and zeropoints for each location
     pars1 = [0.00381207,-0.00133282] # fitting temp, humid, zeropoints
 
-    y = data['Total Bike'][match]/data['Interval'][match] +\
-        (70-data['Temperature (BED)'][match])*pars1[0] +\
-        (0-data['Humidity (BED)'][match])*pars1[1] #+\
-#        (0-data['Precipitation (BED)'][match])*pars1[2] 
-    
-  
-    plt.plot(data['datetime'][match].astype(datetime.datetime), y, 'bo', label=location)
-#    print data['datetime'][match], data['Total Bike'][match]/data['Interval'][match], location
-
-    plt.savefig(location + '.png')
-    plt.close()
-
-    i += 1
-
-fig = plt.figure()
-ax = fig.add_subplot(111)
-ax.set_xlabel("Temperature (BED)")
-ax.set_ylabel("Bikers/minute")
-y_formatter = matplotlib.ticker.ScalarFormatter(useOffset=False)
-ax.yaxis.set_major_formatter(y_formatter)
-plt.plot(data['Temperature (BED)'],data['Total Bike']/data['Interval'],'bo')
-plt.savefig('countvtemp.png')
-plt.close()
-
-fig = plt.figure()
-ax = fig.add_subplot(111)
-ax.set_xlabel("Humidity (BED)")
-ax.set_ylabel("Bikers/minute")
-y_formatter = matplotlib.ticker.ScalarFormatter(useOffset=False)
-ax.yaxis.set_major_formatter(y_formatter)
-plt.plot(data['Humidity (BED)'],data['Total Bike']/data['Interval'],'bo')
-plt.savefig('countvhumidity.png')
-plt.close()
-
-fig = plt.figure()
-ax = fig.add_subplot(111)
-ax.set_xlabel("Precipitation (BED)")
-ax.set_ylabel("Bikers/minute")
-y_formatter = matplotlib.ticker.ScalarFormatter(useOffset=False)
-ax.yaxis.set_major_formatter(y_formatter)
-plt.plot(data['Precipitation (BED)'],data['Total Bike']/data['Interval'],'bo')
-plt.savefig('countvrain.png')
-plt.close()
+    specs = []
+    for location in locations:
 
+        match = np.where(data['Location'] == location)
 
+        y = rate[match] +\
+            (70-data['Temperature (' + airport + ')'][match])*pars1[0] +\
+            (0-data['Humidity (' + airport + ')'][match])*pars1[1] #+\
+    #        (0-data['Precipitation (' + airport + ')'][match])*pars1[2] 
 
+        specs.append(FigureSpec(location + '.png', 'timeseries', title=location).plot(
+            data['datetime'][match], y, 'bo', label=location))
 
+    for label, filename in [('Temperature', 'countvtemp.png'),
+                            ('Humidity', 'countvhumidity.png'),
+                            ('Precipitation', 'countvrain.png')]:
+        column = label + ' (' + airport + ')'
+        specs.append(FigureSpec(filename, 'scatter', xlabels=[column]).plot(data[column], rate, 'bo'))
 
-temp = data['Temperature (BED)']
-humid = data['Humidity (BED)']
-rain = data['Precipitation (BED)']
-time = data['datetime']
+    print renderFigures(specs)
 
+# least-squares fit of the covariate coefficients and zeropoints, and the count
+# corrected for all but each coefficient
+@pipeline.stage('lstsq', inputs=['counts'], code=[design, figures], outputs=['corrected_count.png'],
+                formula=formula, airport=airport)
+def lstsq(data, formula, airport):
 
+    # covariate columns and sparse location indicators (the zeropoints)
+    designmatrix = Design(data, formula, airport)
+    A = designmatrix.matrix()
 
-A = np.vstack([temp, humid, rain, zeropoints]).T
+    y = data['Total Bike']/data['Interval']
+    pars = scipy.sparse.linalg.lsqr(A, y, atol=1e-12, btol=1e-12)[0]
 
-A = np.vstack([temp, humid, zeropoints]).T
-#lt alt,az,cosrot,sinrot,temp,np.ones(len(x))]).T
+    model = A.dot(pars)
 
-y = data['Total Bike']/data['Interval']
-pars = np.linalg.lstsq(A,y)[0]
 
-model = np.dot(A,pars)
 
+    residuals = y-model
 
 
-residuals = y-model
+    npars = designmatrix.ncoeffs
+    labels = designmatrix.names
+    spec = FigureSpec("corrected_count.png", 'scatter', xlabels=labels[:npars], npanels=npars,
+                      figsize=(15, 12))
 
+    for i in range(npars):
 
-npars = 2
-nxplots = 1
-nyplots = npars
-fig = plt.figure(figsize=(15, 12))
-ax = fig.add_subplot(nyplots,nxplots,1)
+        column = A[:,i].toarray().ravel()
+        sub = residuals + pars[i]*column
+        spec.plot(column, sub, 'o', panel=i)
+        spec.plot(column, pars[i]*column, '-', panel=i, color='r')
 
-labels = ['Temperature', 'Humidity','Rain']
-for location in locations: labels.append(location)
-           
-for i in range(npars):
+    renderFigures([spec])
+    print pars
+    return pars
 
-    ax = fig.add_subplot(nyplots,nxplots,i)
-    sub = residuals + pars[i]*A[:,i]
-    ax.scatter(A[:,i], sub)
-    ax.plot(A[:,i], pars[i]*A[:,i],color='r')
-    ax.set_xlabel(labels[i])
-    ax.set_ylabel("Bikes/minute")
+# bootstrap errors on the least-squares fit: nboot resamples ('poisson'
+# weights or 'index' draws with replacement) solved together in batches
+@pipeline.stage('bootstrap', inputs=['counts'], code=[design, bootstrap], nboot=2000,
+                method='poisson', formula=formula, airport=airport)
+def bootstrapErrors(data, nboot, method, formula, airport):
+    result = bootstrapFit(Design(data, formula, airport), data['Total Bike']/data['Interval'],
+                          nboot=nboot, method=method)
+    for name, value, (low, high) in zip(result['names'], result['pars'], result['intervals'].T):
+        print '%-24s %12.6g [%12.6g, %12.6g]' % (name, value, low, high)
+    return result
 
-fig.savefig("corrected_count.png")
-print pars
-ipdb.set_trace()               
-#plt.legend(prop=fontP)
+# the covariate sets weighed against each other by the compare stage
+variants = ['temperature + humidity',
+            'temperature + humidity + precipitation',
+            'temperature + precipitation']
 
-#legend([plot1], "title", prop = fontP)
+# fit every variant with nprocs processes and rank them by BIC, WAIC and
+# k-fold cross-validated log likelihood. Not part of a plain run; ask for it
+# with --until compare
+@pipeline.stage('compare', inputs=['counts'], code=[design, likelihood, parallel, mapfit, compare],
+                optional=True, variants=variants, nfolds=5, nsamples=1000, nprocs=4,
+                airport=airport)
+def comparison(data, variants, nfolds, nsamples, nprocs, airport):
+    results = compareModels(data, variants, nfolds=nfolds, nsamples=nsamples, nprocs=nprocs,
+                            airport=airport)
+    printComparison(results)
+    return results
 
-    
+if __name__ == '__main__':
+    pipeline.main(description="Fit the bike counts")
@@ -0,0 +1,118 @@
+import numpy as np
+import scipy.sparse
+
+# Bootstrap errors for the additive least-squares fit of bikecount.lstsq,
+#   rate = covariates . coefficients + zeropoint(location)
+# without a separate lstsq per resample. A resample is a vector of weights on
+# the observations (how many times each was drawn, or Poisson(1) weights), and
+# every block of the weighted normal equations is a product of the (nboot x
+# ndata) weight matrix with a column precomputed once from the design:
+#
+#   covariates x covariates    W . (x_i x_j)            (nboot x ncoeffs^2)
+#   covariates x zeropoints    (x_j by location)^T W^T  (nboot x nlocations*ncoeffs)
+#   zeropoints x zeropoints    W . indicators           (nboot x nlocations), diagonal
+#
+# and likewise for the right-hand sides. The diagonal zeropoint block is
+# eliminated (Schur complement), leaving a batch of small ncoeffs x ncoeffs
+# solves:
+#
+#   result = bootstrapFit(Design(data, formula), rate, nboot=2000)
+#   result['intervals']         # (2 x ndim) 95% percentile intervals
+#   result['zeropointcov']      # (nlocations x nlocations)
+
+# The parts of the normal equations, one row per weight vector
+class NormalBlocks(object):
+
+    def __init__(self, design, y):
+
+        y = np.asarray(y, dtype=float)
+        self.design = design
+        self.ncoeffs = design.ncoeffs
+        self.nlocations = design.nlocations
+        covariates = design.covariateMatrix()
+        # rows without a rate or covariate never enter a fit
+        self.good = np.isfinite(y) & np.all(np.isfinite(covariates), axis=1)
+        covariates[~self.good] = 0.0
+        y = np.where(self.good, y, 0.0)
+
+        n, k = covariates.shape
+        self.products = (covariates[:, :, np.newaxis]*covariates[:, np.newaxis, :]).reshape((n, k*k))
+        self.covariatesy = covariates*y[:, np.newaxis]
+        # covariate j of each row in column location*k + j
+        rows = np.repeat(np.arange(n), k)
+        columns = (design.codes[:, np.newaxis]*k + np.arange(k)).ravel()
+        self.bylocation = scipy.sparse.csr_matrix((covariates.ravel(), (rows, columns)),
+                                                  shape=(n, self.nlocations*k))
+        self.indicators = design.indicators()
+        self.indicatorsy = self.indicators.multiply(y[:, np.newaxis]).tocsr()
+
+    # Solve the normal equations weighted by each row of weights (nboot x
+    # ndata). Returns (nboot x ndim) parameters; zeropoints of locations with
+    # no weight in a resample are NaN.
+    def solve(self, weights):
+        weights = np.asarray(weights, dtype=float)*self.good
+        nboot, k, nloc = len(weights), self.ncoeffs, self.nlocations
+
+        xx = weights.dot(self.products).reshape((nboot, k, k))
+        xy = weights.dot(self.covariatesy)
+        cross = np.asarray(self.bylocation.T.dot(weights.T)).T.reshape((nboot, nloc, k))
+        diagonal = np.asarray(self.indicators.T.dot(weights.T)).T
+        zy = np.asarray(self.indicatorsy.T.dot(weights.T)).T
+
+        # eliminate the zeropoints: z = (zy - cross . c)/diagonal
+        seen = diagonal > 0
+        inverse = np.where(seen, 1.0/np.where(seen, diagonal, 1.0), 0.0)
+        scaled = cross*inverse[:, :, np.newaxis]
+        reduced = xx - np.einsum('blj,blk->bjk', cross, scaled)
+        rhs = xy - np.einsum('blj,bl->bj', scaled, zy)
+        try:
+            coeffs = np.linalg.solve(reduced, rhs[:, :, np.newaxis])[:, :, 0]
+        except np.linalg.LinAlgError:
+            # a covariate is degenerate (e.g. a level never seen), so take the
+            # minimum-norm solutions
+            coeffs = np.einsum('bjk,bk->bj', np.linalg.pinv(reduced), rhs)
+        zeropoints = (zy - np.einsum('blk,bk->bl', cross, coeffs))*inverse
+        zeropoints[~seen] = np.nan
+        return np.hstack([coeffs, zeropoints])
+
+# (nboot x ndata) resampling weights: the number of times each observation is
+# drawn in ndata draws with replacement ('index'), or Poisson(1) ('poisson')
+def resampleWeights(ndata, nboot, method='poisson', random=np.random):
+    if method == 'poisson':
+        return random.poisson(1.0, (nboot, ndata)).astype(float)
+    if method == 'index':
+        indices = random.randint(0, ndata, (nboot, ndata))
+        flat = (np.arange(nboot)[:, np.newaxis]*ndata + indices).ravel()
+        return np.bincount(flat, minlength=nboot*ndata).reshape((nboot, ndata)).astype(float)
+    raise ValueError("Unknown resampling method " + repr(method))
+
+# Bootstrap the least-squares fit of y (bikers/minute) on design with nboot
+# resamples, solved batchsize at a time. Returns a dict with
+#   names, pars     - parameter names and the fit to all the data
+#   samples         - (nboot x ndim) fits to the resamples
+#   std, cov        - their standard deviations and covariance
+#   intervals       - (2 x ndim) percentile intervals of confidence level
+#   zeropointcov    - the covariance of the location zeropoints
+def bootstrapFit(design, y, nboot=1000, method='poisson', level=0.95, batchsize=None, seed=None):
+
+    blocks = NormalBlocks(design, y)
+    random = np.random.RandomState(seed)
+    # about 1e7 weights at a time
+    if batchsize is None: batchsize = max(1, min(nboot, 10000000//max(design.ndata, 1)))
+
+    pars = blocks.solve(np.ones((1, design.ndata)))[0]
+    samples = np.empty((nboot, design.ndim))
+    for start in range(0, nboot, batchsize):
+        count = min(batchsize, nboot - start)
+        samples[start:start+count] = blocks.solve(resampleWeights(design.ndata, count, method, random))
+
+    # a location missing from a resample only drops out of its own statistics
+    masked = np.ma.masked_invalid(samples)
+    cov = np.ma.cov(masked, rowvar=False).filled(np.nan)
+    tail = 50.0*(1.0 - level)
+    intervals = np.array([np.nanpercentile(samples, tail, axis=0),
+                          np.nanpercentile(samples, 100.0 - tail, axis=0)])
+    return {'names':design.names, 'pars':pars, 'samples':samples,
+            'std':np.sqrt(np.diag(cov)), 'cov':cov, 'intervals':intervals,
+            'zeropointcov':cov[design.zeropoints, design.zeropoints], 'method':method,
+            'level':level}
@@ -0,0 +1,153 @@
+import os
+import json
+import pickle
+import numpy as np
+from fileio import atomicWrite
+
+# On-disk storage for an emcee chain. Steps are streamed into memory-mapped
+# .npy segments of segment steps each, so the chain never has to fit in RAM,
+# and the walker state is checkpointed so an interrupted run can be resumed:
+#
+#   store = ChainStore.open('chain') if os.path.exists('chain/meta.json') else\
+#           ChainStore('chain', nwalkers, ndim, thin=10)
+#   runMCMC(sampler, p0, store=store)
+#
+# Only every thin-th step is kept, in dtype (float32 by default).
+class ChainStore(object):
+
+    def __init__(self, path, nwalkers, ndim, thin=1, dtype=np.float32, segment=1000):
+        if not os.path.exists(path): os.makedirs(path)
+        self.path = path
+        self.nwalkers = nwalkers
+        self.ndim = ndim
+        self.thin = thin
+        self.dtype = np.dtype(dtype)
+        self.segment = segment
+        self.nsaved = 0     # stored (thinned) steps
+        self.iteration = 0  # sampler steps taken, including those thinned away
+        self._segments = {}
+        self._writeMeta()
+
+    # reopen an existing store at its last checkpoint
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, 'meta.json')) as metafile:
+            meta = json.load(metafile)
+        store = cls.__new__(cls)
+        store.path = path
+        store.nwalkers = meta['nwalkers']
+        store.ndim = meta['ndim']
+        store.thin = meta['thin']
+        store.dtype = np.dtype(str(meta['dtype']))
+        store.segment = meta['segment']
+        store.nsaved = meta['nsaved']
+        store.iteration = meta['iteration']
+        store._segments = {}
+        return store
+
+    def _writeMeta(self):
+        meta = {'nwalkers':self.nwalkers, 'ndim':self.ndim, 'thin':self.thin,
+                'dtype':self.dtype.str, 'segment':self.segment,
+                'nsaved':self.nsaved, 'iteration':self.iteration}
+        atomicWrite(os.path.join(self.path, 'meta.json'), json.dumps(meta))
+
+    def _segmentFiles(self, i):
+        return (os.path.join(self.path, 'chain.%05d.npy' % i),
+                os.path.join(self.path, 'lnprob.%05d.npy' % i))
+
+    # memory-mapped (chain, lnprob) arrays for segment i
+    def _getSegment(self, i, create=False):
+        if i in self._segments: return self._segments[i]
+        chainfile, probfile = self._segmentFiles(i)
+        if os.path.exists(chainfile):
+            segment = (np.load(chainfile, mmap_mode='r+'), np.load(probfile, mmap_mode='r+'))
+        elif create:
+            segment = (np.lib.format.open_memmap(chainfile, mode='w+', dtype=self.dtype,
+                                                 shape=(self.segment, self.nwalkers, self.ndim)),
+                       np.lib.format.open_memmap(probfile, mode='w+', dtype=self.dtype,
+                                                 shape=(self.segment, self.nwalkers)))
+        else:
+            raise IOError("Missing chain segment " + chainfile)
+        self._segments[i] = segment
+        return segment
+
+    # record the state after one sampler step
+    def save(self, state):
+        self.iteration += 1
+        if self.iteration % self.thin: return
+        chain, lnprob = self._getSegment(self.nsaved//self.segment, create=True)
+        chain[self.nsaved % self.segment] = state.coords
+        lnprob[self.nsaved % self.segment] = state.log_prob
+        self.nsaved += 1
+
+    # flush the segments and record enough to restart the sampler from state
+    def checkpoint(self, state):
+        for chain, lnprob in self._segments.values():
+            chain.flush()
+            lnprob.flush()
+        checkpoint = {'coords':state.coords, 'log_prob':state.log_prob,
+                      'random_state':state.random_state}
+        atomicWrite(os.path.join(self.path, 'state.pkl'),
+                    pickle.dumps(checkpoint, pickle.HIGHEST_PROTOCOL))
+        self._writeMeta()
+
+        # drop segments that are full; they are reopened read-only on demand
+        for i in list(self._segments.keys()):
+            if (i + 1)*self.segment <= self.nsaved: del self._segments[i]
+
+    # the checkpointed state as a dict of coords, log_prob and random_state
+    def lastState(self):
+        with open(os.path.join(self.path, 'state.pkl'), 'rb') as statefile:
+            return pickle.load(statefile)
+
+    # the first stored step left after discarding discard sampler steps; a
+    # burn-in that leaves nothing is an error rather than an empty chain
+    def _firstStep(self, discard):
+        start = int(np.ceil(float(discard)/self.thin))
+        if start >= self.nsaved:
+            raise ValueError("No samples left after discarding %d burn-in steps from a chain "
+                             "of %d steps" % (discard, self.nsaved*self.thin))
+        return start
+
+    # Yield (chain, lnprob) views of the stored steps after discarding the first
+    # discard sampler steps and keeping every thin-th sampler step. Each chunk
+    # covers at most one segment and is a view onto the memory map.
+    def iterChain(self, discard=0, thin=1):
+        thin = max(1, int(np.ceil(float(thin)/self.thin)))
+        start = self._firstStep(discard) if discard > 0 else 0
+        for i in range(start//self.segment, (self.nsaved - 1)//self.segment + 1):
+            chain, lnprob = self._getSegment(i)
+            first = max(start, i*self.segment)
+            # stay on the global thinning grid across segment boundaries
+            first += (start - first) % thin
+            last = min(self.nsaved, (i + 1)*self.segment)
+            if first >= last: continue
+            rows = slice(first - i*self.segment, last - i*self.segment, thin)
+            yield chain[rows], lnprob[rows]
+
+    # flattened (nsamples, ndim) chunks of iterChain
+    def iterSamples(self, discard=0, thin=1):
+        for chain, lnprob in self.iterChain(discard=discard, thin=thin):
+            yield chain.reshape((-1, self.ndim))
+
+    # the (nsteps, nwalkers, ndim) chain, optionally for a subset of walkers
+    # (e.g. to estimate the autocorrelation time from a bounded amount of memory)
+    def getChain(self, discard=0, thin=1, walkers=slice(None), flat=False):
+        chunks = [chain[:, walkers] for chain, lnprob in self.iterChain(discard, thin)]
+        if len(chunks) == 0: chain = np.empty((0, self.nwalkers, self.ndim), dtype=self.dtype)[:, walkers]
+        else: chain = np.concatenate(chunks)
+        if flat: return chain.reshape((-1, self.ndim))
+        return chain
+
+    # n random (flattened) samples, gathered without reading the whole chain
+    def drawSamples(self, n, discard=0):
+        start = self._firstStep(discard)
+        rows = np.sort(np.random.randint(start*self.nwalkers, self.nsaved*self.nwalkers, size=n))
+        steps, walkers = np.divmod(rows, self.nwalkers)
+        samples = np.empty((n, self.ndim), dtype=self.dtype)
+        for i in np.unique(steps//self.segment):
+            chain, lnprob = self._getSegment(i)
+            match = np.where(steps//self.segment == i)
+            samples[match] = chain[steps[match] % self.segment, walkers[match]]
+        np.random.shuffle(samples)
+        return samples
@@ -0,0 +1,141 @@
+import datetime
+import numpy as np
+import scipy.sparse
+import instrument
+from shapefile import readDBF
+
+# the fields of the Strava data layer that are read
+fields = ['YEAR', 'DAY', 'HOUR', 'MINUTE', 'EDGE_ID', 'COMMUTE_CO']
+
+# Strava local time as datetime64[m]; day is the day of the year, starting at 1
+def stravaTime(year, day, hour, minute):
+    year = np.asarray(year, dtype=np.int64)
+    return (year - 1970).astype('datetime64[Y]').astype('datetime64[m]') +\
+           ((np.asarray(day, dtype=np.int64) - 1)*1440 +
+            np.asarray(hour, dtype=np.int64)*60 +
+            np.asarray(minute, dtype=np.int64)).astype('timedelta64[m]')
+
+# Strava commuter counts as a sparse (minute x edge) matrix: row i is the minute
+# start + i (Strava local time), column j is row j of the EdgeStore. Any time
+# resolution, time range or set of edges is then a slice or a sparse reduction:
+#
+#   commuters = CommuterMatrix.fromLayer(data_layer, edgestore)
+#   hourly = commuters.resample(60)        # (nhours x nedges)
+#   totals = commuters.edgeTotals()        # (nedges,)
+class CommuterMatrix(object):
+
+    def __init__(self, matrix, start, edgestore):
+        self.matrix = matrix.tocsr()
+        self.start = np.datetime64(start, 'm')
+        self.edgestore = edgestore
+        self.nminutes, self.nedges = self.matrix.shape
+        # column-major copy for edge lookups, built on first use
+        self._columns = None
+
+    # Build from the Strava columns. Counts outside [start, end) or on edges that
+    # are not in edgestore are dropped (and counted in self.dropped). By default
+    # the matrix starts at midnight before the first count and ends after the last.
+    @classmethod
+    def fromColumns(cls, year, day, hour, minute, edgeid, commuters, edgestore,
+                    start=None, end=None):
+
+        times = stravaTime(year, day, hour, minute)
+        return cls.fromTimes(times, edgeid, commuters, edgestore, start=start, end=end)
+
+    # build from the time of each count as datetime64[m] (see fromColumns)
+    @classmethod
+    def fromTimes(cls, times, edgeid, commuters, edgestore, start=None, end=None):
+
+        if start is None:
+            start = times.min().astype('datetime64[D]') if len(times) > 0 else np.datetime64(0, 'D')
+        if end is None:
+            end = times.max() + np.timedelta64(1, 'm') if len(times) > 0 else start
+        start = np.datetime64(start, 'm')
+        end = np.datetime64(end, 'm')
+
+        offset = (times - start).astype(np.int64)
+        nminutes = int((end - start).astype(np.int64))
+        rows = edgestore.rows(edgeid)
+        good = (offset >= 0) & (offset < nminutes) & (rows >= 0)
+
+        # duplicate (minute, edge) entries are summed
+        matrix = scipy.sparse.coo_matrix((np.asarray(commuters, dtype=float)[good],
+                                          (offset[good], rows[good])),
+                                         shape=(nminutes, edgestore.nedges))
+        store = cls(matrix, start, edgestore)
+        store.dropped = int(np.sum(~good))
+        return store
+
+    # Build from the Strava .dbf without QGIS, decoding only the needed fields
+    # chunk by chunk
+    @classmethod
+    def fromDBF(cls, dbffile, edgestore, start=None, end=None, chunksize=1000000):
+        times, edgeids, commuters = [], [], []
+        for chunk in readDBF(dbffile, columns=fields, chunksize=chunksize):
+            times.append(stravaTime(chunk['YEAR'], chunk['DAY'], chunk['HOUR'], chunk['MINUTE']))
+            edgeids.append(chunk['EDGE_ID'])
+            commuters.append(chunk['COMMUTE_CO'])
+        if len(times) == 0:
+            times, edgeids, commuters = [np.empty(0, dtype='datetime64[m]')], [[]], [[]]
+        return cls.fromTimes(np.concatenate(times), np.concatenate(edgeids),
+                             np.concatenate(commuters), edgestore, start=start, end=end)
+
+    # Build from the QGIS data layer in a single pass over its features
+    @classmethod
+    def fromLayer(cls, data_layer, edgestore, start=None, end=None):
+        indices = [data_layer.fieldNameIndex(field) for field in fields]
+        columns = list(zip(*[[feature[i] for i in indices] for feature in data_layer.getFeatures()]))
+        if len(columns) == 0: columns = [[]]*len(fields)
+        if instrument.enabled: instrument.count('layer.features', len(columns[0]))
+        return cls.fromColumns(*columns, edgestore=edgestore, start=start, end=end)
+
+    # the start time of each row of a resample(minutes)
+    def times(self, minutes=1):
+        nbins = -(-self.nminutes//minutes)
+        return self.start + np.arange(nbins)*np.timedelta64(minutes, 'm')
+
+    # (nbins x nedges) counts summed over bins of minutes (e.g. 15, 60, 1440),
+    # aligned to start
+    def resample(self, minutes):
+        if minutes == 1: return self.matrix
+        nbins = -(-self.nminutes//minutes)
+        binning = scipy.sparse.csr_matrix((np.ones(self.nminutes),
+                                           (np.arange(self.nminutes)//minutes,
+                                            np.arange(self.nminutes))),
+                                          shape=(nbins, self.nminutes))
+        return (binning*self.matrix).tocsr()
+
+    # the counts from start to end (datetimes), as a new CommuterMatrix
+    def timeRange(self, start, end):
+        first = max(int((np.datetime64(start, 'm') - self.start).astype(np.int64)), 0)
+        last = min(int((np.datetime64(end, 'm') - self.start).astype(np.int64)), self.nminutes)
+        last = max(first, last)
+        return CommuterMatrix(self.matrix[first:last], self.start + np.timedelta64(first, 'm'),
+                              self.edgestore)
+
+    # the (nminutes x len(edgeids)) counts on the given edges
+    def edges(self, edgeids):
+        rows = self.edgestore.rows(edgeids)
+        if np.any(rows < 0): raise ValueError("Unknown edge ID")
+        if self._columns is None: self._columns = self.matrix.tocsc()
+        return self._columns[:, rows]
+
+    # total commuters on each edge (in edgestore row order)
+    def edgeTotals(self):
+        return np.asarray(self.matrix.sum(axis=0)).ravel()
+
+    # total commuters in each bin of minutes, over all edges or the given ones
+    def timeSeries(self, minutes=60, edgeids=None):
+        matrix = self.matrix if edgeids is None else self.edges(edgeids)
+        counts = np.asarray(matrix.sum(axis=1)).ravel()
+        nbins = -(-self.nminutes//minutes)
+        return np.bincount(np.arange(self.nminutes)//minutes, weights=counts, minlength=nbins)
+
+    # the edge rows with commuters in minute i, and their counts
+    def frame(self, i):
+        start, stop = self.matrix.indptr[i], self.matrix.indptr[i+1]
+        return self.matrix.indices[start:stop], self.matrix.data[start:stop]
+
+    # the start of row i of resample(minutes) as a datetime
+    def timeOf(self, i, minutes=1):
+        return (self.start + np.timedelta64(i*minutes, 'm')).astype(datetime.datetime)
@@ -0,0 +1,173 @@
+import multiprocessing
+import numpy as np
+from likelihood import BikeLike
+from design import parseFormula, defaultairport
+from parallel import shareLike, sharedLike
+from mapfit import fitMAP, laplaceSamples
+
+# Comparison of models with different covariates, e.g.
+#
+#   results = compareModels(data, ['temperature + humidity',
+#                                  'temperature + humidity + precipitation',
+#                                  'temperature + precipitation'])
+#   printComparison(results)
+#
+# The covariates of all the formulas are evaluated once into one design, which
+# is put in shared memory for a pool of worker processes; each variant is a
+# selection of its columns. Every variant is fitted to all the data (MAP and a
+# Laplace approximation, see mapfit.py) for BIC and WAIC, and to each training
+# set of a k-fold split for the cross-validated log likelihood of the held-out
+# counts, all as independent tasks for the pool.
+#
+# The variants are fitted and scored with the exact Poisson likelihood of the
+# counts (BikeLike with poisson). The Gaussian approximation the sampler uses
+# leaves out a normalization that depends on the parameters, so its
+# likelihoods cannot be compared between models.
+
+# the union likelihood and fold of every observation, in each worker
+_workerLike = None
+_workerFolds = None
+
+def _initWorker(folds, *shared):
+    global _workerLike, _workerFolds
+    _workerLike = sharedLike(*shared)
+    _workerFolds = folds
+
+# Assign the observations of each location at random to nfolds folds, so every
+# location keeps observations in every training set. Locations with fewer than
+# nfolds observations are only used for training (fold -1).
+def assignFolds(codes, nfolds, seed=0):
+    random = np.random.RandomState(seed)
+    folds = np.full(len(codes), -1, dtype=np.intp)
+    order = np.argsort(codes, kind='mergesort')
+    starts = np.searchsorted(codes[order], np.arange(codes.max() + 1 if len(codes) else 0))
+    stops = np.append(starts[1:], len(codes))
+    for start, stop in zip(starts, stops):
+        if stop - start < nfolds: continue
+        rows = order[start:stop]
+        folds[rows[random.permutation(len(rows))]] = np.arange(len(rows)) % nfolds
+    return folds
+
+# Watanabe-Akaike information criterion -2*(lppd - pwaic) from the pointwise
+# log likelihoods of samples, accumulated over blocks of samples so only
+# (blocksize x ndata) is held at once. Returns waic, lppd and pwaic.
+def waic(like, samples, blocksize=None):
+    blocksize = blocksize or like.blocksize
+    nsamples = len(samples)
+    peak = np.full(like.ndata, -np.inf)
+    sumexp = np.zeros(like.ndata)
+    mean = np.zeros(like.ndata)
+    scatter = np.zeros(like.ndata)
+    for start in range(0, nsamples, blocksize):
+        loglike = like.pointwise(samples[start:start+blocksize])
+
+        # running log-sum-exp over the samples
+        newpeak = np.maximum(peak, loglike.max(axis=0))
+        sumexp = sumexp*np.exp(peak - newpeak) + np.exp(loglike - newpeak).sum(axis=0)
+        peak = newpeak
+
+        # running variance over the samples (Chan et al.)
+        n = len(loglike)
+        blockmean = loglike.mean(axis=0)
+        delta = blockmean - mean
+        total = start + n
+        scatter += ((loglike - blockmean)**2).sum(axis=0) + delta**2*start*n/float(total)
+        mean += delta*n/float(total)
+
+    lppd = np.sum(peak + np.log(sumexp/nsamples))
+    pwaic = np.sum(scatter/max(nsamples - 1, 1))
+    return -2.0*(lppd - pwaic), lppd, pwaic
+
+# One fit: with fold None, of all the observations (for BIC and WAIC),
+# otherwise of the other folds, scored on the held-out fold
+def _fitTask(task):
+    formula, fold, nsamples, seed = task
+    like = _workerLike
+    try:
+        if fold is None:
+            variant = like.select(formula)
+            fit = fitMAP(variant)
+            # the mean zeropoint is fixed, so one parameter fewer is free
+            nfree = variant.ndim - 1
+            samples = laplaceSamples(fit, nsamples, like=variant, seed=seed)
+            criterion, lppd, pwaic = waic(variant, samples)
+            return formula, fold, {'pars':fit['pars'], 'names':variant.design.names,
+                                   'loglike':fit['loglike'], 'converged':fit['converged'],
+                                   'nfree':nfree, 'ndata':variant.ndata,
+                                   'bic':nfree*np.log(variant.ndata) - 2.0*fit['loglike'],
+                                   'waic':criterion, 'lppd':lppd, 'pwaic':pwaic}
+        train = np.where(_workerFolds != fold)[0]
+        test = np.where(_workerFolds == fold)[0]
+        fit = fitMAP(like.select(formula, train))
+        heldout = float(np.sum(like.select(formula, test).pointwise(fit['pars'])))
+        return formula, fold, {'loglike':heldout, 'ntest':len(test)}
+    except (ValueError, np.linalg.LinAlgError) as error:
+        return formula, fold, {'error':str(error)}
+
+# Fit every formula with nprocs processes (all CPUs by default) and score it,
+# with the weather covariates of airport.
+# Returns one dict per formula, in order, with
+#   formula, names, pars, loglike - the MAP fit to all the data
+#   nfree, bic                    - free parameters and the BIC
+#   waic, lppd, pwaic             - from nsamples Laplace samples
+#   cvloglike, cvfolds            - held-out log likelihood, total and per fold
+#   errors                        - messages of any fits that failed
+def compareModels(data, formulas, nfolds=5, nsamples=1000, nprocs=None, seed=0,
+                  airport=defaultairport):
+
+    terms = []
+    for formula in formulas:
+        terms += [term for term in parseFormula(formula) if term not in terms]
+    like = BikeLike(data, formula=terms, poisson=True, airport=airport)
+    folds = assignFolds(like.codes, nfolds, seed=seed)
+
+    tasks = [(formula, fold, nsamples, seed) for formula in formulas
+             for fold in [None] + list(range(nfolds))]
+    shared = shareLike(like)
+    if nprocs is None: nprocs = multiprocessing.cpu_count()
+    nprocs = max(min(nprocs, len(tasks)), 1)
+    if nprocs > 1:
+        pool = multiprocessing.Pool(nprocs, initializer=_initWorker, initargs=(folds,) + shared)
+        try:
+            outcomes = pool.map(_fitTask, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _initWorker(folds, *shared)
+        outcomes = [_fitTask(task) for task in tasks]
+
+    results = [{'formula':formula, 'cvfolds':[None]*nfolds, 'errors':[]} for formula in formulas]
+    for formula, fold, outcome in outcomes:
+        result = results[list(formulas).index(formula)]
+        if 'error' in outcome:
+            result['errors'].append(('all' if fold is None else 'fold %d' % fold, outcome['error']))
+        elif fold is None: result.update(outcome)
+        else: result['cvfolds'][fold] = outcome['loglike']
+    for result in results:
+        cv = result['cvfolds']
+        result['cvloglike'] = sum(cv) if all(value is not None for value in cv) else None
+    return results
+
+# print the criteria of compareModels' results, best WAIC first, with each
+# difference from the best
+def printComparison(results):
+    scored = [result for result in results if 'waic' in result]
+    best = dict((key, min(result[key] for result in scored)) for key in ['bic', 'waic'])\
+           if scored else {}
+    bestcv = max([result['cvloglike'] for result in results if result['cvloglike'] is not None]
+                 or [None])
+    print '%-45s %5s %12s %10s %12s %10s %14s %10s' %\
+          ('formula', 'npars', 'BIC', 'dBIC', 'WAIC', 'dWAIC', 'CV loglike', 'dCV')
+    for result in sorted(results, key=lambda result: result.get('waic', np.inf)):
+        if 'waic' in result:
+            print '%-45s %5d %12.1f %10.1f %12.1f %10.1f' %\
+                  (result['formula'], result['nfree'], result['bic'], result['bic'] - best['bic'],
+                   result['waic'], result['waic'] - best['waic']),
+        else:
+            print '%-45s %5s %12s %10s %12s %10s' % (result['formula'], '', '', '', '', ''),
+        if result['cvloglike'] is not None:
+            print '%14.1f %10.1f' % (result['cvloglike'], result['cvloglike'] - bestcv)
+        else:
+            print '%14s %10s' % ('', '')
+        for where, error in result['errors']: print '    failed (' + where + '): ' + error
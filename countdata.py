@@ -0,0 +1,110 @@
+import os
+import csv
+import hashlib
+import numpy as np
+from fileio import replace
+
+# define the data types of the count.csv columns; any other column is kept as
+# strings
+datatypes = {
+    'Location':str,
+    'Weather':str,
+    'Counter':str,
+    'Notes':str,
+    'Latitude':float,
+    'Longitude':float,
+    'Female Ped':float,
+    'Male Ped':float,
+    'Total Ped':float,
+    'Female Bike':float,
+    'Male Bike':float,
+    'Total Bike':float,
+    'Female Other':float,
+    'Male Other':float,
+    'Total Other':float,
+    'Interval':float,
+    'Precipitation (BED)':float,
+    'Temperature (BED)':float,
+    'Humidity (BED)':float,
+    }
+
+# key of the content hash inside the cache file
+_hashkey = '__hash__'
+
+# Read count.csv into a dictionary of NumPy columns typed by datatypes, with
+# empty values as NaN, 'datetime' parsed from Date and Time as datetime64[m],
+# and the locations encoded as 'locationCode' indices into the sorted unique
+# 'locations'. The parsed columns are cached next to the CSV (count.csv.npz)
+# under the SHA-1 of its contents, so later runs skip parsing until the file
+# changes.
+def readCounts(csvname='count.csv', cache=True):
+
+    with open(csvname, 'rb') as f:
+        contents = f.read()
+    digest = hashlib.sha1(contents).hexdigest()
+
+    cachename = csvname + '.npz'
+    if cache and os.path.exists(cachename):
+        with np.load(cachename, allow_pickle=False) as cached:
+            if str(cached[_hashkey]) == digest:
+                return dict((key, cached[key]) for key in cached.files if key != _hashkey)
+
+    data = parseCounts(contents.splitlines())
+
+    if cache:
+        columns = dict(data)
+        columns[_hashkey] = np.array(digest)
+        tmpname = cachename + '.tmp'
+        with open(tmpname, 'wb') as f:
+            np.savez(f, **columns)
+        replace(tmpname, cachename)
+
+    return data
+
+# parse the lines of a count.csv file (see readCounts)
+def parseCounts(lines):
+
+    reader = csv.reader(lines)
+    headers = next(reader)
+    rows = [row for row in reader if len(row) > 0]
+
+    # pad short rows so every column has one entry per row
+    ncols = len(headers)
+    rows = [row + ['']*(ncols - len(row)) if len(row) < ncols else row for row in rows]
+    columns = zip(*rows) if len(rows) > 0 else [()]*ncols
+
+    data = {}
+    for header, column in zip(headers, columns):
+        values = np.array(column, dtype=str)
+        if datatypes.get(header, str) is float:
+            values = np.where(values == '', 'nan', values).astype(float)
+        data[header] = values
+
+    data['datetime'] = parseDateTime(data['Date'], data['Time'])
+
+    data['locations'], data['locationCode'] = np.unique(data['Location'], return_inverse=True)
+    return data
+
+# Combine 'm/d/Y' dates and 'H:M' times into datetime64[m]. Only the unique
+# dates and times are parsed; empty or malformed entries become NaT.
+def parseDateTime(dates, times):
+
+    udates, idates = np.unique(dates, return_inverse=True)
+    days = np.empty(len(udates), dtype='datetime64[D]')
+    for i, date in enumerate(udates):
+        try:
+            month, day, year = date.split('/')
+            days[i] = np.datetime64('%04d-%02d-%02d' % (int(year), int(month), int(day)))
+        except ValueError:
+            days[i] = np.datetime64('NaT')
+
+    utimes, itimes = np.unique(times, return_inverse=True)
+    minutes = np.empty(len(utimes), dtype='timedelta64[m]')
+    for i, time in enumerate(utimes):
+        try:
+            hour, minute = time.split(':')
+            minutes[i] = np.timedelta64(60*int(hour) + int(minute), 'm')
+        except ValueError:
+            minutes[i] = np.timedelta64('NaT')
+
+    return days[idates].astype('datetime64[m]') + minutes[itimes]
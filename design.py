@@ -0,0 +1,188 @@
+import numpy as np
+import scipy.sparse
+
+# Registry of the covariates a model can use, by name. Each is a function of
+# the count table (readCounts) and the airport whose weather columns it reads
+# ('<label> (<airport>)', see weather.joinWeather), giving one value per row;
+# categorical ones (levels set) give integer codes 0..levels-1 and enter the
+# model as one coefficient per level that occurs in the data, with the lowest
+# of those as the reference. Register more with
+#
+#   @covariate('dewpoint')
+#   def dewpoint(data, airport): return data['Dew Point (' + airport + ')']
+covariates = {}
+
+def covariate(name, levels=None):
+    def register(func):
+        covariates[name] = (func, levels)
+        return func
+    return register
+
+# the airport whose weather the count table has by default
+defaultairport = 'BED'
+
+def _column(data, label, airport):
+    label = label + ' (' + airport + ')'
+    if label not in data:
+        raise KeyError("No column " + label + " in the count table (see weather.joinWeather)")
+    return np.asarray(data[label], dtype=float)
+
+@covariate('temperature')
+def temperature(data, airport): return _column(data, 'Temperature', airport)
+
+@covariate('humidity')
+def humidity(data, airport): return _column(data, 'Humidity', airport)
+
+@covariate('precipitation')
+def precipitation(data, airport): return _column(data, 'Precipitation', airport)
+
+@covariate('wind')
+def wind(data, airport): return _column(data, 'Wind Speed', airport)
+
+# rows without a date or time are put in the reference level
+@covariate('hour', levels=24)
+def hour(data, airport):
+    times = data['datetime']
+    return np.where(np.isnat(times), 0, times.astype('datetime64[h]').astype(np.int64) % 24)
+
+# Monday is 0 (1970-01-01 was a Thursday)
+@covariate('weekday', levels=7)
+def weekday(data, airport):
+    times = data['datetime']
+    return np.where(np.isnat(times), 0, (times.astype('datetime64[D]').astype(np.int64) + 3) % 7)
+
+defaultformula = 'temperature + humidity'
+
+# the covariate names in a formula such as 'temperature + humidity + hour'
+def parseFormula(formula):
+    if not isinstance(formula, str): return list(formula)
+    terms = [term.strip() for term in formula.split('+')]
+    for term in terms:
+        if term not in covariates: raise KeyError("Unknown covariate " + repr(term))
+    return terms
+
+# The covariates of a formula and the location of every row of the count table,
+# laid out for both fits:
+#   BikeLike:     bikers = zeropoint(location)*(covariates . coefficients)
+#   least squares: rate = covariates . coefficients + zeropoint(location)
+# The parameters are the coefficients of the continuous covariates (in formula
+# order), then those of the categorical levels 1..levels-1, then a zeropoint
+# per location (in sorted order); names lists them and coeffs/zeropoints slice
+# them. Continuous covariates are kept as one (ndata x ncolumns) array,
+# categorical ones and locations as integer codes, so memory grows with the
+# rows and not with rows x locations. The weather covariates are those of
+# airport.
+class Design(object):
+
+    def __init__(self, data, formula=defaultformula, airport=defaultairport):
+
+        terms = parseFormula(formula)
+        # sorted unique locations and the index of each observation into them
+        if 'locationCode' in data:
+            locations, codes = data['locations'], data['locationCode']
+        else:
+            locations, codes = np.unique(np.asarray(data['Location']), return_inverse=True)
+
+        columnnames = [term for term in terms if covariates[term][1] is None]
+        columns = np.empty((len(codes), len(columnnames)))
+        for i, name in enumerate(columnnames):
+            columns[:, i] = covariates[name][0](data, airport)
+        # levels that never occur would get coefficients with no data behind
+        # them, so the codes are renumbered over the levels present
+        factors = []
+        for term in terms:
+            if covariates[term][1] is None: continue
+            present, factorcodes = np.unique(np.asarray(covariates[term][0](data, airport),
+                                                        dtype=np.intp), return_inverse=True)
+            factors.append((term, factorcodes, present.tolist()))
+        self._setArrays(terms, locations, codes, columns, columnnames, factors)
+
+    # build directly from the arrays (e.g. views onto shared memory); factors
+    # is a list of (name, codes, levels), the codes indexing the list of level
+    # values
+    @classmethod
+    def fromArrays(cls, terms, locations, codes, columns, columnnames, factors):
+        design = cls.__new__(cls)
+        design._setArrays(terms, locations, codes, columns, columnnames, factors)
+        return design
+
+    def _setArrays(self, terms, locations, codes, columns, columnnames, factors):
+        self.terms = list(terms)
+        self.locations = list(locations)
+        self.nlocations = len(self.locations)
+        self.codes = np.ascontiguousarray(codes, dtype=np.intp)
+        self.ndata = len(self.codes)
+
+        self.columnnames = list(columnnames)
+        self.columns = np.ascontiguousarray(columns, dtype=float).reshape((self.ndata, len(columnnames)))
+        self.factors = [(name, np.ascontiguousarray(factorcodes, dtype=np.intp), levels)
+                        for name, factorcodes, levels in factors]
+
+        self.names = list(self.columnnames)
+        for name, factorcodes, levels in self.factors:
+            self.names += [name + '=' + str(level) for level in levels[1:]]
+        self.ncoeffs = len(self.names)
+        self.names += ['c_' + str(location) for location in self.locations]
+        self.ndim = len(self.names)
+        self.coeffs = slice(0, self.ncoeffs)
+        self.zeropoints = slice(self.ncoeffs, self.ndim)
+
+    # The design of a formula whose terms are all in this one, for a subset of
+    # the rows (keeping every location and level), without evaluating the
+    # covariates again
+    def select(self, formula, rows=slice(None)):
+        terms = parseFormula(formula)
+        missing = [term for term in terms if term not in self.terms]
+        if missing: raise KeyError("Terms not in the design: " + ', '.join(missing))
+        columnnames = [term for term in terms if term in self.columnnames]
+        indices = [self.columnnames.index(term) for term in columnnames]
+        factors = [(name, factorcodes[rows], levels) for term in terms
+                   for name, factorcodes, levels in self.factors if name == term]
+        return Design.fromArrays(terms, self.locations, self.codes[rows],
+                                 self.columns[rows][:, indices], columnnames, factors)
+
+    # position of a parameter in names
+    def index(self, name):
+        return self.names.index(name)
+
+    # covariates . coefficients for each row of pars, shape (npars, len(rows))
+    def linear(self, pars, rows=slice(None)):
+        pars = np.atleast_2d(pars)
+        ncolumns = len(self.columnnames)
+        linear = np.dot(pars[:, :ncolumns], self.columns[rows].T)
+        start = ncolumns
+        for name, factorcodes, levels in self.factors:
+            coeffs = np.zeros((len(pars), len(levels)))
+            coeffs[:, 1:] = pars[:, start:start+len(levels)-1]
+            linear += coeffs[:, factorcodes[rows]]
+            start += len(levels) - 1
+        return linear
+
+    # bikers/minute of the multiplicative model for each row of pars
+    def model(self, pars, rows=slice(None)):
+        pars = np.atleast_2d(pars)
+        return pars[:, self.zeropoints][:, self.codes[rows]]*self.linear(pars, rows)
+
+    # the (len(rows) x ncoeffs) covariates, with an indicator per categorical level
+    def covariateMatrix(self, rows=slice(None)):
+        codes = self.codes[rows]
+        matrix = np.zeros((len(codes), self.ncoeffs))
+        ncolumns = len(self.columnnames)
+        matrix[:, :ncolumns] = self.columns[rows]
+        start = ncolumns
+        for name, factorcodes, levels in self.factors:
+            level = factorcodes[rows]
+            some = level > 0
+            matrix[np.where(some)[0], start + level[some] - 1] = 1.0
+            start += len(levels) - 1
+        return matrix
+
+    # sparse (ndata x nlocations) indicator of each row's location
+    def indicators(self):
+        return scipy.sparse.csr_matrix((np.ones(self.ndata), (np.arange(self.ndata), self.codes)),
+                                       shape=(self.ndata, self.nlocations))
+
+    # sparse (ndata x ndim) design matrix of the additive model, for least squares
+    def matrix(self):
+        return scipy.sparse.hstack([scipy.sparse.csr_matrix(self.covariateMatrix()),
+                                    self.indicators()]).tocsr()
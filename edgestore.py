@@ -0,0 +1,112 @@
+import os
+import json
+import numpy as np
+from fileio import atomicWrite
+from spatial import EdgeIndex
+from shapefile import dbfFields, readDBFColumns
+
+# the arrays kept for each edge
+_arrays = ['edgeid', 'x1', 'y1', 'x2', 'y2', 'street']
+
+# The street network as parallel NumPy arrays, one row per edge: the edge ID,
+# the end points (X1,Y1)-(X2,Y2) in degrees, and the street name as a code into
+# streetnames. Rows are looked up by edge ID through a sorted copy of the IDs.
+class EdgeStore(object):
+
+    def __init__(self, edgeid, x1, y1, x2, y2, street, streetnames, order=None):
+        self.edgeid = edgeid
+        self.x1 = x1
+        self.y1 = y1
+        self.x2 = x2
+        self.y2 = y2
+        self.street = street
+        self.streetnames = streetnames
+        self.nedges = len(edgeid)
+
+        if order is None: order = np.argsort(edgeid, kind='mergesort')
+        self.order = order
+        self.sortedids = edgeid[self.order]
+        self._index = None
+
+    # build from columns; names are the street name of each edge
+    @classmethod
+    def fromColumns(cls, edgeid, x1, y1, x2, y2, names):
+        streetnames, street = np.unique(np.asarray(names, dtype=str), return_inverse=True)
+        return cls(np.asarray(edgeid, dtype=np.int64),
+                   np.asarray(x1, dtype=float), np.asarray(y1, dtype=float),
+                   np.asarray(x2, dtype=float), np.asarray(y2, dtype=float),
+                   street.astype(np.int32), streetnames)
+
+    # build from the edge layer of nyc_edges.shp in one pass over its features
+    # (edge ID in the first field, street name in the third)
+    @classmethod
+    def fromLayer(cls, edge_layer):
+        idxx1 = edge_layer.fieldNameIndex('X1')
+        idxx2 = edge_layer.fieldNameIndex('X2')
+        idxy1 = edge_layer.fieldNameIndex('Y1')
+        idxy2 = edge_layer.fieldNameIndex('Y2')
+        columns = [(feature[0], feature[idxx1], feature[idxy1], feature[idxx2],
+                    feature[idxy2], feature[2]) for feature in edge_layer.getFeatures()]
+        edgeid, x1, y1, x2, y2, names = zip(*columns)
+        return cls.fromColumns(edgeid, x1, y1, x2, y2,
+                               [(u'%s' % name).encode('utf-8') for name in names])
+
+    # build from nyc_edges.shp without QGIS: the attributes come from its .dbf
+    # (edge ID in the first field, street name in the third, as for fromLayer)
+    @classmethod
+    def fromShapefile(cls, shpfile):
+        dbffile = os.path.splitext(shpfile)[0] + '.dbf'
+        fields = [field[0] for field in dbfFields(dbffile)]
+        columns = readDBFColumns(dbffile, columns=[fields[0], fields[2], 'X1', 'Y1', 'X2', 'Y2'])
+        return cls.fromColumns(columns[fields[0]], columns['X1'], columns['Y1'],
+                               columns['X2'], columns['Y2'], columns[fields[2]])
+
+    # rows of the given edge IDs; -1 for IDs that are not in the store
+    def rows(self, edgeids):
+        edgeids = np.asarray(edgeids, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.sortedids, edgeids), max(self.nedges - 1, 0))
+        found = (self.nedges > 0) & (self.sortedids[pos] == edgeids)
+        return np.where(found, self.order[pos], -1)
+
+    # spatial index over the edges (see spatial.EdgeIndex), built on first use
+    def index(self):
+        if self._index is None:
+            self._index = EdgeIndex(self.x1, self.y1, self.x2, self.y2)
+        return self._index
+
+    # write each array as .npy in path, recording the source it was built from
+    def save(self, path, source=None):
+        if not os.path.exists(path): os.makedirs(path)
+        for name in _arrays + ['order']:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+        np.save(os.path.join(path, 'streetnames.npy'), self.streetnames)
+        atomicWrite(os.path.join(path, 'meta.json'), json.dumps({'source':_signature(source)}))
+
+    # memory-map a saved store
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+                  for name in _arrays]
+        streetnames = np.load(os.path.join(path, 'streetnames.npy'))
+        order = np.load(os.path.join(path, 'order.npy'), mmap_mode=mmap_mode)
+        return cls(*arrays, streetnames=streetnames, order=order)
+
+# size and modification time of a file, to tell when a cache is stale
+def _signature(source):
+    if source is None or not os.path.exists(source): return None
+    stat = os.stat(source)
+    return [stat.st_size, int(stat.st_mtime)]
+
+# Open the edge store cached in cachedir, or build it with build() and cache it
+# if there is none or source (e.g. nyc_edges.shp) has changed since.
+def openEdgeStore(source, cachedir, build):
+    metafile = os.path.join(cachedir, 'meta.json')
+    if os.path.exists(metafile):
+        with open(metafile) as f:
+            meta = json.load(f)
+        if meta['source'] == _signature(source):
+            return EdgeStore.load(cachedir)
+
+    store = build()
+    store.save(cachedir, source)
+    return store
@@ -0,0 +1,193 @@
+import os
+import json
+import hashlib
+import datetime
+import multiprocessing
+import numpy as np
+import matplotlib
+matplotlib.use('Agg') # Workaround for Tkinter import error
+import matplotlib.pyplot as plt
+import matplotlib.ticker
+import matplotlib.dates as mdates
+import instrument
+from fileio import atomicWrite
+
+# Batch plotting. A figure is described by a FigureSpec (the template it is
+# drawn on, its title and the data series of each panel) and a list of specs
+# is rendered by a process pool:
+#
+#   spec = FigureSpec('countvtemp.png', 'scatter', xlabels=["Temperature (BED)"])
+#   spec.plot(data['Temperature (BED)'], rate, 'bo')
+#   renderFigures([spec, ...])
+#
+# Each worker builds the axes of a template once and reuses them for every
+# figure drawn on it, removing the previous figure's lines in between. The
+# hash of every spec is kept in a manifest, and figures whose spec did not
+# change since they were last written are skipped.
+
+# Registry of figure templates, by name. A template sets up the axes of a new
+# figure with npanels panels (one above the other) and returns them.
+templates = {}
+
+def template(name):
+    def register(func):
+        templates[name] = func
+        return func
+    return register
+
+def _plainAxis(axis):
+    axis.set_major_formatter(matplotlib.ticker.ScalarFormatter(useOffset=False))
+
+# bikers/minute at one location from 2013 to 2016
+@template('timeseries')
+def timeseries(fig, npanels):
+    axes = [fig.add_subplot(npanels, 1, i+1) for i in range(npanels)]
+    for ax in axes:
+        ax.set_xlabel("Date")
+        ax.set_ylabel("Bikers/minute")
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y'))
+        ax.xaxis.set_ticks([datetime.datetime(2013,1,1),datetime.datetime(2014,1,1),
+                            datetime.datetime(2015,1,1),datetime.datetime(2016,1,1)])
+        ax.set_xlim([datetime.datetime(2013,1,1),datetime.datetime(2017,1,1)])
+        _plainAxis(ax.yaxis)
+    return axes
+
+# bikers/minute against a covariate (set the xlabels of the spec)
+@template('scatter')
+def scatter(fig, npanels):
+    axes = [fig.add_subplot(npanels, 1, i+1) for i in range(npanels)]
+    for ax in axes:
+        ax.set_ylabel("Bikers/minute")
+        _plainAxis(ax.yaxis)
+    return axes
+
+# What to draw on one figure. Series are added with plot(), in the order they
+# are drawn.
+class FigureSpec(object):
+
+    def __init__(self, filename, template, title=None, xlabels=None, npanels=1, figsize=None):
+        if template not in templates: raise KeyError("Unknown template " + repr(template))
+        self.filename = filename
+        self.template = template
+        self.title = title
+        self.xlabels = xlabels
+        self.npanels = npanels
+        self.figsize = figsize
+        self.series = []
+
+    # x against y on panel with a matplotlib format string and line options;
+    # datetime64 x values are drawn as dates
+    def plot(self, x, y, fmt='-', panel=0, **options):
+        self.series.append((panel, np.asarray(x), np.asarray(y), fmt, options))
+        return self
+
+    # the figures that share a key can be drawn on the same axes
+    def templateKey(self):
+        return (self.template, self.npanels, self.figsize)
+
+    # SHA-1 of everything that is drawn
+    def digest(self):
+        digest = hashlib.sha1(json.dumps([self.template, self.title, self.xlabels, self.npanels,
+                                          self.figsize]).encode('utf-8'))
+        for panel, x, y, fmt, options in self.series:
+            digest.update(json.dumps([panel, fmt, options, str(x.dtype), str(y.dtype),
+                                      len(x)], sort_keys=True, default=repr).encode('utf-8'))
+            digest.update(np.ascontiguousarray(x).tobytes())
+            digest.update(np.ascontiguousarray(y).tobytes())
+        return digest.hexdigest()
+
+# A figure made from a template, drawn on again and again
+class _Canvas(object):
+
+    def __init__(self, key):
+        name, npanels, figsize = key
+        self.fig = plt.figure(figsize=figsize)
+        self.axes = templates[name](self.fig, npanels)
+        # the template's labels, restored after each figure
+        self.titles = [ax.get_title() for ax in self.axes]
+        self.xlabels = [ax.get_xlabel() for ax in self.axes]
+        self.autoscale = [(ax.get_autoscalex_on(), ax.get_autoscaley_on()) for ax in self.axes]
+
+    def draw(self, spec, outdir):
+        artists = []
+        if spec.title is not None: self.axes[0].set_title(spec.title)
+        for ax, xlabel in zip(self.axes, spec.xlabels or []): ax.set_xlabel(xlabel)
+        for panel, x, y, fmt, options in spec.series:
+            if x.dtype.kind == 'M': x = x.astype(datetime.datetime)
+            artists += self.axes[panel].plot(x, y, fmt, **options)
+        for ax, (scalex, scaley) in zip(self.axes, self.autoscale):
+            ax.relim()
+            ax.autoscale_view(scalex=scalex, scaley=scaley)
+
+        self.fig.savefig(os.path.join(outdir, spec.filename))
+
+        for artist in artists: artist.remove()
+        for ax, title, xlabel in zip(self.axes, self.titles, self.xlabels):
+            ax.set_title(title)
+            ax.set_xlabel(xlabel)
+            # forget the colours used, so the next figure starts from the first
+            ax.set_prop_cycle(None)
+
+# the canvases of each worker process, by template key
+_workerCanvases = {}
+
+def _renderShard(args):
+    specs, outdir = args
+    for spec in specs:
+        key = spec.templateKey()
+        if key not in _workerCanvases: _workerCanvases[key] = _Canvas(key)
+        _workerCanvases[key].draw(spec, outdir)
+    return [spec.filename for spec in specs]
+
+# Render the specs into outdir with nprocs processes (all CPUs by default), in
+# shards of up to chunksize figures that share a template. The spec hashes are
+# kept in outdir/manifest, and figures that already exist with the same hash
+# are skipped unless force. Returns the number of figures rendered and kept.
+def renderFigures(specs, outdir='.', nprocs=None, chunksize=10, manifest='.figures.json',
+                  force=False):
+
+    if not os.path.exists(outdir): os.makedirs(outdir)
+    manifestfile = os.path.join(outdir, manifest)
+    hashes = {}
+    if os.path.exists(manifestfile):
+        with open(manifestfile) as f:
+            hashes = json.load(f)
+
+    todo = {}
+    stats = {'rendered':0, 'kept':0}
+    digests = {}
+    for spec in specs:
+        digests[spec.filename] = spec.digest()
+        if not force and hashes.get(spec.filename) == digests[spec.filename] and\
+           os.path.exists(os.path.join(outdir, spec.filename)):
+            stats['kept'] += 1
+            continue
+        todo.setdefault(spec.templateKey(), []).append(spec)
+
+    shards = [(group[start:start+chunksize], outdir)
+              for group in todo.values() for start in range(0, len(group), chunksize)]
+    if nprocs is None: nprocs = multiprocessing.cpu_count()
+    nprocs = max(min(nprocs, len(shards)), 1)
+    if nprocs > 1:
+        pool = multiprocessing.Pool(nprocs)
+        results = pool.imap_unordered(_renderShard, shards)
+    else:
+        pool = None
+        results = (_renderShard(shard) for shard in shards)
+
+    try:
+        # record each figure as soon as it is written, so an interrupted batch
+        # does not redraw the figures it finished
+        for filenames in results:
+            for filename in filenames: hashes[filename] = digests[filename]
+            stats['rendered'] += len(filenames)
+            if instrument.enabled: instrument.count('figures.rendered', len(filenames))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        else:
+            for canvas in _workerCanvases.values(): plt.close(canvas.fig)
+            _workerCanvases.clear()
+        atomicWrite(manifestfile, json.dumps(hashes, sort_keys=True))
+    return stats
@@ -0,0 +1,21 @@
+import os
+
+# write to a temporary file and rename it over the target, so a crash never
+# leaves a half-written file behind
+def atomicWrite(filename, contents):
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'wb') as f:
+        if not isinstance(contents, bytes): contents = contents.encode('utf-8')
+        f.write(contents)
+        f.flush()
+        os.fsync(f.fileno())
+    replace(tmpname, filename)
+
+# rename src over dst
+def replace(src, dst):
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # os.rename will not replace an existing file on Windows
+        os.remove(dst)
+        os.rename(src, dst)
@@ -0,0 +1,201 @@
+import os
+import sys
+import csv
+import json
+import time
+import signal
+import pstats
+import cProfile
+import datetime
+import traceback
+import collections
+from fileio import atomicWrite, replace
+try:
+    import resource
+except ImportError:
+    # not on Windows
+    resource = None
+
+# Run instrumentation: wall and CPU timers, event counters (likelihood calls,
+# records read, frames rendered, ...), peak memory, and optional profiles of
+# chosen pipeline stages, gathered into one JSON or CSV report:
+#
+#   instrument.enable(profile=['mcmc'], profiler='sample')
+#   with instrument.timer('stage.mcmc'), instrument.profiled('mcmc'):
+#       ...
+#   instrument.count('likelihood.calls')
+#   instrument.writeReport('run.json')
+#
+# It is off until enable() is called. Hot paths guard their calls with
+# "if instrument.enabled:", so a disabled run pays one attribute lookup per
+# call; timers and profiles are only used around whole stages.
+
+enabled = False
+
+# stages to profile, the profiler ('cprofile' or 'sample') and where the
+# profiles are written
+_profile = set()
+_profiler = 'cprofile'
+_profiledir = '.'
+
+_counters = collections.defaultdict(int)
+_timers = collections.OrderedDict()
+_profiles = collections.OrderedDict()
+_started = None
+
+def enable(profile=(), profiler='cprofile', profiledir='.'):
+    global enabled, _profile, _profiler, _profiledir, _started
+    if profiler not in ('cprofile', 'sample'): raise ValueError("Unknown profiler " + repr(profiler))
+    enabled = True
+    _profile = set(profile)
+    _profiler = profiler
+    _profiledir = profiledir
+    _started = time.time()
+
+def disable():
+    global enabled
+    enabled = False
+
+# forget everything recorded so far
+def reset():
+    _counters.clear()
+    _timers.clear()
+    _profiles.clear()
+
+# add n to a counter
+def count(name, n=1):
+    if enabled: _counters[name] += n
+
+# peak resident set size of this process and of its waited-for children (MB),
+# or None where the resource module is missing
+def peakRSS():
+    if resource is None: return None, None
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    scale = 1.0/(1 << 20) if sys.platform == 'darwin' else 1.0/(1 << 10)
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss*scale)
+
+def _cpuTimes():
+    times = os.times()
+    return times[0] + times[1], times[2] + times[3]
+
+# Time the block under name: wall seconds, CPU seconds of this process and of
+# the worker processes that finished during it, and the peak RSS afterwards.
+# Repeated blocks of the same name add up.
+class timer(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if enabled:
+            self.wall = time.time()
+            self.cpu, self.childcpu = _cpuTimes()
+        return self
+
+    def __exit__(self, *args):
+        if not enabled: return False
+        cpu, childcpu = _cpuTimes()
+        entry = _timers.setdefault(self.name, {'calls':0, 'wall':0.0, 'cpu':0.0, 'childcpu':0.0})
+        entry['calls'] += 1
+        entry['wall'] += time.time() - self.wall
+        entry['cpu'] += cpu - self.cpu
+        entry['childcpu'] += childcpu - self.childcpu
+        entry['peakrss'], entry['childpeakrss'] = peakRSS()
+        return False
+
+# Statistical profiler: every interval seconds of CPU time, the Python stack is
+# recorded, and the stacks are written in the folded format of flame graph
+# tools ("outer;inner;innermost count" per line). Unix only.
+class SamplingProfiler(object):
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.defaultdict(int)
+
+    def _sample(self, signum, frame):
+        stack = traceback.extract_stack(frame)
+        self.stacks[';'.join('%s:%s' % (os.path.basename(entry[0]), entry[2])
+                             for entry in stack)] += 1
+
+    def enable(self):
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous)
+
+    # the functions seen in the most samples, as (function, samples)
+    def top(self, n=20):
+        totals = collections.defaultdict(int)
+        for stack, samples in self.stacks.items():
+            totals[stack.rsplit(';', 1)[-1]] += samples
+        return sorted(totals.items(), key=lambda item: -item[1])[:n]
+
+    def dump(self, filename):
+        atomicWrite(filename, ''.join('%s %d\n' % (stack, samples)
+                                      for stack, samples in sorted(self.stacks.items())))
+
+# Profile the block if enable() was given its name, writing
+# profiledir/name.prof (cProfile; read with pstats or snakeviz) or
+# profiledir/name.folded (sampling profiler) and keeping the top functions for
+# the report
+class profiled(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.profiler = None
+
+    def __enter__(self):
+        if enabled and self.name in _profile:
+            self.profiler = cProfile.Profile() if _profiler == 'cprofile' else SamplingProfiler()
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *args):
+        if self.profiler is None: return False
+        self.profiler.disable()
+        if not os.path.exists(_profiledir): os.makedirs(_profiledir)
+        if isinstance(self.profiler, SamplingProfiler):
+            filename = os.path.join(_profiledir, self.name + '.folded')
+            self.profiler.dump(filename)
+            top = self.profiler.top()
+        else:
+            filename = os.path.join(_profiledir, self.name + '.prof')
+            self.profiler.dump_stats(filename)
+            stats = pstats.Stats(self.profiler).stats
+            top = sorted([('%s:%d:%s' % (os.path.basename(key[0]), key[1], key[2]), value[3])
+                          for key, value in stats.items()], key=lambda item: -item[1])[:20]
+        _profiles[self.name] = {'file':filename, 'profiler':_profiler, 'top':top}
+        self.profiler = None
+        return False
+
+# everything recorded, as a dict
+def report():
+    peak, childpeak = peakRSS()
+    return {'started':datetime.datetime.fromtimestamp(_started).isoformat() if _started else None,
+            'seconds':time.time() - _started if _started else None,
+            'argv':sys.argv, 'peakrss':peak, 'childpeakrss':childpeak,
+            'timers':_timers, 'counters':dict(_counters), 'profiles':_profiles}
+
+# Write the report as JSON, or as CSV (one row per timer and counter) if
+# filename ends in .csv
+def writeReport(filename):
+    if not filename.lower().endswith('.csv'):
+        atomicWrite(filename, json.dumps(report(), indent=1))
+        return
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(['kind', 'name', 'calls', 'wall', 'cpu', 'childcpu', 'peakrss', 'value'])
+        for name, entry in _timers.items():
+            writer.writerow(['timer', name, entry['calls'], '%.6f' % entry['wall'],
+                             '%.6f' % entry['cpu'], '%.6f' % entry['childcpu'],
+                             entry['peakrss'], ''])
+        for name in sorted(_counters):
+            writer.writerow(['counter', name, '', '', '', '', '', _counters[name]])
+        peak, childpeak = peakRSS()
+        writer.writerow(['memory', 'peakrss', '', '', '', '', peak, ''])
+        writer.writerow(['memory', 'childpeakrss', '', '', '', '', childpeak, ''])
+    replace(tmpname, filename)
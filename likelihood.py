@@ -0,0 +1,216 @@
+import numpy as np
+import scipy.special
+import instrument
+from design import Design, defaultformula, defaultairport
+
+# Vectorized version of bikelike (below). The data are reduced once to
+# integer location codes and contiguous float columns so that a whole block of
+# walkers can be evaluated in one NumPy pass, e.g.:
+#
+#   like = BikeLike(data)
+#   sampler = emcee.EnsembleSampler(nwalkers, ndim, like, vectorize=True)
+#
+# Bike count model (see design.Design), by default
+# bikers(location,time) = zeropoint(location)*(c0*temperature(time) + c1*humidity(time))
+# pars[0] = coeff_temp
+# pars[1] = coeff_humidity
+# pars[2:] = zeropoints, in sorted location order
+# Other covariates are added through formula, e.g. 'temperature + humidity + hour',
+# and the weather covariates are those of airport.
+class BikeLike(object):
+
+    def __init__(self, data, blocksize=64, formula=defaultformula, poisson=False,
+                 airport=defaultairport):
+
+        interval = np.asarray(data['Interval'], dtype=float)
+        self._setArrays(Design(data, formula, airport), interval,
+                        np.asarray(data['Total Bike'], dtype=float)/interval, blocksize, poisson)
+
+    # build directly from a Design and the reduced columns (e.g. views onto
+    # shared memory); arrays that are already contiguous with the right dtype
+    # are not copied
+    @classmethod
+    def fromArrays(cls, design, interval, rate, blocksize=64, poisson=False):
+        like = cls.__new__(cls)
+        like._setArrays(design, interval, rate, blocksize, poisson)
+        return like
+
+    def _setArrays(self, design, interval, rate, blocksize, poisson):
+        self.design = design
+        self.locations = design.locations
+        self.nlocations = design.nlocations
+        self.codes = design.codes
+
+        self.interval = np.ascontiguousarray(interval, dtype=float)
+        self.rate = np.ascontiguousarray(rate, dtype=float)
+        self.interval2 = self.interval**2
+
+        self.ndim = design.ndim
+        self.ndata = design.ndata
+
+        # walkers evaluated together; bounds the (walkers x data) temporaries
+        self.blocksize = blocksize
+
+        # the exact Poisson probability of the counts rather than the Gaussian
+        # approximation; slower, but normalized, so that the likelihoods of
+        # different models can be compared
+        self.poisson = poisson
+
+        # dense covariates for the derivatives, built on first use
+        self._covariates = None
+
+    # bikers/minute predicted for each row of pars, shape (npars, ndata), or
+    # (npars, len(rows)) for a subset of the observations
+    def model(self, pars, rows=slice(None)):
+        return self.design.model(pars, rows=rows)
+
+    # the same likelihood for a formula within this one's terms and a subset of
+    # the observations, sharing the covariates already evaluated
+    def select(self, formula, rows=slice(None)):
+        return BikeLike.fromArrays(self.design.select(formula, rows), self.interval[rows],
+                                   self.rate[rows], self.blocksize, self.poisson)
+
+    # log likelihood of each observation for each row of pars, shape
+    # (npars, ndata); -inf where the predicted count is negative
+    def pointwise(self, pars):
+        bikers = self.model(pars)
+        if self.poisson: return self._poisson(bikers)
+        residuals = bikers - self.rate
+
+        # Poisson Errors
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ivar = self.interval2/bikers
+            loglike = -0.5*ivar*residuals**2
+
+        # negative bikers is unphysical
+        loglike[bikers < 0] = -np.inf
+        return loglike
+
+    # log Poisson probability of the counts given bikers/minute, (npars, ndata)
+    def _poisson(self, bikers):
+        counts = self.rate*self.interval
+        expected = bikers*self.interval
+        with np.errstate(divide='ignore', invalid='ignore'):
+            loglike = counts*np.log(expected) - expected - scipy.special.gammaln(counts + 1)
+        # no counts is certain when none are expected
+        loglike[(expected == 0) & (counts == 0)] = 0.0
+        loglike[~(expected >= 0)] = -np.inf
+        return loglike
+
+    def _loglike(self, pars):
+        bikers = self.model(pars)
+        if self.poisson: return np.sum(self._poisson(bikers), axis=1)
+        residuals = bikers - self.rate
+
+        # Poisson Errors
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ivar = self.interval2/bikers
+            loglike = -0.5*np.sum(ivar*residuals**2, axis=1)
+
+        # negative bikers is unphysical
+        loglike[np.any(bikers < 0, axis=1)] = -np.inf
+        return loglike
+
+    # the model and the derivatives of the log likelihood with respect to it
+    # for one parameter vector. Per observation
+    #   loglike = -0.5*interval**2*(bikers - rate)**2/bikers
+    #   d loglike/d bikers = -0.5*interval**2*(1 - rate**2/bikers**2)
+    #   d2 loglike/d bikers2 = -interval**2*rate**2/bikers**3
+    # or with poisson, up to a constant,
+    #   loglike = interval*(rate*log(bikers) - bikers)
+    #   d loglike/d bikers = interval*(rate/bikers - 1)
+    #   d2 loglike/d bikers2 = -interval*rate/bikers**2
+    # and bikers = zeropoint*linear, with linear = covariates . coefficients.
+    def _bikerDerivatives(self, pars):
+        pars = np.asarray(pars, dtype=float)
+        if self._covariates is None: self._covariates = self.design.covariateMatrix()
+        zeropoint = pars[self.design.zeropoints][self.codes]
+        linear = self._covariates.dot(pars[self.design.coeffs])
+        bikers = zeropoint*linear
+        if self.poisson:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                d1 = self.interval*(self.rate/bikers - 1.0)
+                d2 = -self.interval*self.rate/bikers**2
+            return zeropoint, linear, d1, d2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio2 = self.rate**2/bikers**2
+            d1 = -0.5*self.interval2*(1.0 - ratio2)
+            d2 = -self.interval2*ratio2/bikers
+        return zeropoint, linear, d1, d2
+
+    # gradient of the log likelihood of one parameter vector
+    def gradient(self, pars):
+        zeropoint, linear, d1, d2 = self._bikerDerivatives(pars)
+        grad = np.empty(self.ndim)
+        grad[self.design.coeffs] = self._covariates.T.dot(d1*zeropoint)
+        grad[self.design.zeropoints] = np.bincount(self.codes, weights=d1*linear,
+                                                   minlength=self.nlocations)
+        return grad
+
+    # Hessian of the log likelihood of one parameter vector; the zeropoint
+    # block is diagonal and the coefficient/zeropoint block is summed through
+    # the sparse location indicators
+    def hessian(self, pars):
+        zeropoint, linear, d1, d2 = self._bikerDerivatives(pars)
+        coeffs, zeropoints = self.design.coeffs, self.design.zeropoints
+        scaled = zeropoint[:, np.newaxis]*self._covariates
+
+        hess = np.zeros((self.ndim, self.ndim))
+        hess[coeffs, coeffs] = scaled.T.dot(d2[:, np.newaxis]*scaled)
+        cross = self.design.indicators().T.dot((d2*linear)[:, np.newaxis]*scaled +
+                                               d1[:, np.newaxis]*self._covariates)
+        hess[zeropoints, coeffs] = cross
+        hess[coeffs, zeropoints] = cross.T
+        hess[zeropoints, zeropoints] = np.diag(np.bincount(self.codes, weights=d2*linear**2,
+                                                           minlength=self.nlocations))
+        return hess
+
+    # log likelihood of a single parameter vector, or of each row of an
+    # (nwalkers, ndim) block
+    def __call__(self, pars):
+        pars = np.asarray(pars, dtype=float)
+        if pars.shape[-1] != self.ndim:
+            raise ValueError("Parameter array does not match data")
+        if instrument.enabled:
+            instrument.count('likelihood.calls')
+            instrument.count('likelihood.evaluations', 1 if pars.ndim == 1 else len(pars))
+
+        if pars.ndim == 1:
+            return self._loglike(pars)[0]
+
+        loglike = np.empty(len(pars))
+        for i in range(0, len(pars), self.blocksize):
+            loglike[i:i+self.blocksize] = self._loglike(pars[i:i+self.blocksize])
+        return loglike
+
+# The scalar likelihood BikeLike replaces, kept as the reference it is checked
+# and benchmarked against: the log likelihood of one parameter vector, building
+# the design from data on every call
+def bikelike(pars, data, bikers=None, formula='temperature + humidity'):
+
+    # Bike count model (see design.Design):
+    # bikers(location,time) = zeropoint(location)*(c0*temperature(time) + c1*humidity(time) + ...)
+    # pars[design.coeffs] = the covariate coefficients, in design.names order
+    # pars[design.zeropoints] = zeropoints
+
+    design = Design(data, formula)
+    if design.ndim != len(pars):
+        raise ValueError("Parameter array does not match data")
+
+    pars = np.asarray(pars, dtype=float)
+    bikers = design.model(pars)[0]
+    rate = data['Total Bike']/data['Interval']
+
+    # negative bikers is unphysical
+    if np.any(bikers < 0): return -np.inf
+
+    residuals = bikers - rate
+
+    # Poisson Errors
+    ivar = data['Interval']**2/bikers
+
+    loglike = -0.5*np.sum(ivar*residuals**2)
+    if np.isnan(loglike):
+        raise ValueError("NaN log likelihood for parameters " + repr(list(pars)))
+
+    return loglike
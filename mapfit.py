@@ -0,0 +1,151 @@
+import numpy as np
+import scipy.optimize
+from sampling import warmStart
+
+# Maximum a posteriori fit of a BikeLike (flat priors) from its analytic
+# gradient and Hessian, with a Laplace (Gaussian) approximation to the
+# posterior about it -- seconds instead of a long emcee run:
+#
+#   fit = fitMAP(like)
+#   samples = laplaceSamples(fit, 100000, like=like)
+#
+# The likelihood only depends on the products zeropoint*coefficients, so the
+# overall scale is fixed by holding the mean zeropoint at 1 (as warmStart
+# does); steps and the covariance are taken within that constraint.
+
+# an orthonormal (ndim x ndim-1) basis of the parameter changes that keep the
+# sum of the zeropoints fixed
+def _gaugeBasis(design):
+    normal = np.zeros(design.ndim)
+    normal[design.zeropoints] = 1.0
+    q = np.linalg.qr(np.column_stack([normal, np.eye(design.ndim)]))[0]
+    return q[:, 1:]
+
+# rescale so that the mean zeropoint is 1, leaving the model unchanged
+def normalizePars(design, pars):
+    pars = np.array(pars, dtype=float)
+    scale = np.mean(pars[design.zeropoints])
+    pars[design.zeropoints] /= scale
+    pars[design.coeffs] *= scale
+    return pars
+
+# Fit from pars (warmStart's least-squares solution by default) by Newton's
+# method with Levenberg-Marquardt damping, or by L-BFGS (method='lbfgs'). A
+# step is only taken if every predicted count stays positive and the
+# likelihood does not decrease. Returns a dict with
+#   pars      - the MAP parameters
+#   loglike   - their log likelihood
+#   cov       - (ndim x ndim) Laplace covariance, the inverse of the negative
+#               Hessian within the mean zeropoint constraint
+#   converged - whether the relative change in the likelihood fell below tol
+#   iterations
+#   unidentified - names of the parameters the data do not constrain
+# If the negative Hessian is not positive definite there, a ValueError names
+# the parameters involved; with singular='pinv' the covariance is taken as its
+# pseudo-inverse instead, with no spread along those directions.
+def fitMAP(like, pars=None, method='newton', maxiter=200, tol=1e-10, singular='raise'):
+
+    design = like.design
+    if pars is None: pars = warmStart(like, optimize=False)
+    pars = normalizePars(design, pars)
+    basis = _gaugeBasis(design)
+    loglike = like(pars)
+    if not np.isfinite(loglike): raise ValueError("Starting parameters are unphysical")
+
+    if method == 'lbfgs':
+        pars, loglike, converged, iterations = _lbfgs(like, pars, basis, maxiter, tol)
+    elif method == 'newton':
+        pars, loglike, converged, iterations = _newton(like, pars, loglike, basis, maxiter, tol)
+    else:
+        raise ValueError("Unknown method " + repr(method))
+
+    curvature = -basis.T.dot(like.hessian(pars)).dot(basis)
+    values, vectors = _curvatureModes(curvature)
+    flat = values <= 0
+    unidentified = _modeNames(design, basis.dot(vectors[:, flat]))
+    if np.any(flat) and singular != 'pinv':
+        raise ValueError("The data do not identify " + ', '.join(unidentified) +
+                         " (singular or indefinite curvature at the MAP)")
+    inverse = (vectors[:, ~flat]/values[~flat]).dot(vectors[:, ~flat].T)
+    cov = basis.dot(inverse).dot(basis.T)
+    return {'pars':pars, 'loglike':loglike, 'cov':cov, 'converged':converged,
+            'iterations':iterations, 'basis':basis, 'curvature':curvature,
+            'unidentified':unidentified}
+
+# eigenvalues and eigenvectors of a curvature matrix, with those that are not
+# clearly positive (relative to the largest) set to 0
+def _curvatureModes(curvature, rtol=1e-10):
+    values, vectors = np.linalg.eigh(curvature)
+    largest = np.max(np.abs(values)) if len(values) else 0.0
+    return np.where(values > rtol*largest, values, 0.0), vectors
+
+# the parameters that take part in any of the (ndim x n) directions
+def _modeNames(design, directions, threshold=0.1):
+    if directions.shape[1] == 0: return []
+    weight = np.max(np.abs(directions), axis=1)
+    return [name for name, w in zip(design.names, weight) if w > threshold*np.max(weight)]
+
+def _newton(like, pars, loglike, basis, maxiter, tol):
+    damping = 1e-3
+    for iteration in range(1, maxiter + 1):
+        grad = basis.T.dot(like.gradient(pars))
+        curvature = -basis.T.dot(like.hessian(pars)).dot(basis)
+        diagonal = np.abs(np.diag(curvature)) + 1e-12*np.max(np.abs(np.diag(curvature)))
+
+        # raise the damping until the step is an improvement
+        while True:
+            try:
+                step = np.linalg.solve(curvature + damping*np.diag(diagonal), grad)
+                trial = pars + basis.dot(step)
+                trialLike = like(trial)
+            except np.linalg.LinAlgError:
+                trialLike = -np.inf
+            if np.isfinite(trialLike) and trialLike >= loglike: break
+            damping *= 10.0
+            if damping > 1e16: return pars, loglike, False, iteration
+
+        change = trialLike - loglike
+        pars, loglike = trial, trialLike
+        damping = max(damping/10.0, 1e-12)
+        if change <= tol*max(1.0, abs(loglike)): return pars, loglike, True, iteration
+    return pars, loglike, False, maxiter
+
+def _lbfgs(like, pars, basis, maxiter, tol):
+    start = pars
+
+    # minimize the negative log likelihood over offsets within the constraint;
+    # unphysical parameters get a huge value so the line search backs off
+    def objective(offset):
+        trial = start + basis.dot(offset)
+        loglike = like(trial)
+        if not np.isfinite(loglike): return 1e300, np.zeros(len(offset))
+        return -loglike, -basis.T.dot(like.gradient(trial))
+
+    result = scipy.optimize.minimize(objective, np.zeros(basis.shape[1]), jac=True,
+                                     method='L-BFGS-B',
+                                     options={'maxiter':maxiter, 'ftol':tol, 'gtol':1e-12})
+    pars = start + basis.dot(result.x)
+    return pars, like(pars), bool(result.success), int(result.nit)
+
+# Draw nsamples parameter vectors from the Laplace approximation of a fitMAP
+# result, as a (nsamples x ndim) array like a flattened chain. With like, draws
+# that predict negative counts are redrawn.
+def laplaceSamples(fit, nsamples, like=None, seed=None, maxtries=100):
+    random = np.random.RandomState(seed)
+    # curvature = V diag(values) V^T, so V diag(values)^-1/2 times a standard
+    # normal has covariance curvature^-1 (the pseudo-inverse if it is singular)
+    values, vectors = _curvatureModes(fit['curvature'])
+    good = values > 0
+    transform = vectors[:, good]/np.sqrt(values[good])
+
+    def draw(n):
+        normal = random.standard_normal((transform.shape[1], n))
+        return fit['pars'] + fit['basis'].dot(transform.dot(normal)).T
+
+    samples = draw(nsamples)
+    if like is None: return samples
+    for i in range(maxtries):
+        bad = ~np.isfinite(like(samples))
+        if not np.any(bad): break
+        samples[bad] = draw(np.sum(bad))
+    return samples
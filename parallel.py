@@ -0,0 +1,106 @@
+import ctypes
+import multiprocessing
+import numpy as np
+import instrument
+from likelihood import BikeLike
+from design import Design, defaultformula, defaultairport
+
+# Parallel version of BikeLike. The design arrays and numeric columns are
+# copied once into shared memory when the pool starts; each worker wraps them
+# in NumPy views (no copy, no per-call pickling of the data) and evaluates its
+# share of the walker block. Only the parameter rows and the resulting log
+# likelihoods cross the process boundary on each call.
+#
+#   with ParallelBikeLike(data, nprocs=32) as lnlike:
+#       sampler = emcee.EnsembleSampler(nwalkers, ndim, lnlike, vectorize=True)
+#       ...
+
+_columns = ['interval', 'rate']
+
+# the likelihood held by each worker process
+_workerLike = None
+
+def _toShared(array, ctype):
+    shared = multiprocessing.RawArray(ctype, len(array))
+    np.frombuffer(shared, dtype=array.dtype)[:] = array
+    return shared
+
+# Copy the design arrays and numeric columns of like into shared memory.
+# Returns the arguments that rebuild it with sharedLike; keep them alive for
+# as long as the workers use them.
+def shareLike(like):
+    design = like.design
+    spec = (design.terms, design.locations, design.columnnames,
+            [(name, levels) for name, factorcodes, levels in design.factors])
+    return (spec, _toShared(design.codes, ctypes.c_ssize_t),
+            _toShared(design.columns.ravel(), ctypes.c_double),
+            [_toShared(factorcodes, ctypes.c_ssize_t) for name, factorcodes, levels in design.factors],
+            [_toShared(getattr(like, name), ctypes.c_double) for name in _columns], like.blocksize,
+            like.poisson)
+
+# a BikeLike on NumPy views of shareLike's memory; spec is (terms, locations,
+# columnnames, [(factor name, levels)])
+def sharedLike(spec, codes, designcolumns, factorcodes, columns, blocksize, poisson=False):
+    terms, locations, columnnames, factors = spec
+    design = Design.fromArrays(terms, locations, np.frombuffer(codes, dtype=np.intp),
+                               np.frombuffer(designcolumns, dtype=float), columnnames,
+                               [(name, np.frombuffer(shared, dtype=np.intp), levels)
+                                for (name, levels), shared in zip(factors, factorcodes)])
+    views = [np.frombuffer(column, dtype=float) for column in columns]
+    return BikeLike.fromArrays(design, *views, blocksize=blocksize, poisson=poisson)
+
+def _initWorker(*shared):
+    global _workerLike
+    _workerLike = sharedLike(*shared)
+
+def _evalChunk(pars):
+    return _workerLike(pars)
+
+class ParallelBikeLike(object):
+
+    def __init__(self, data, nprocs=None, blocksize=64, formula=defaultformula,
+                 airport=defaultairport):
+
+        if nprocs is None: nprocs = multiprocessing.cpu_count()
+        self.nprocs = nprocs
+
+        like = BikeLike(data, blocksize=blocksize, formula=formula, airport=airport)
+        self.locations = like.locations
+        self.nlocations = like.nlocations
+        self.ndim = like.ndim
+        self.ndata = like.ndata
+
+        self._shared = shareLike(like)
+
+        # the parent evaluates single parameter vectors from the same memory
+        _initWorker(*self._shared)
+        self._like = _workerLike
+
+        self.pool = multiprocessing.Pool(nprocs, initializer=_initWorker, initargs=self._shared)
+
+    # expose the reduced columns (codes, rate, ...) like BikeLike does
+    def __getattr__(self, name):
+        if name.startswith('_'): raise AttributeError(name)
+        return getattr(self._like, name)
+
+    def __call__(self, pars):
+        pars = np.asarray(pars, dtype=float)
+        if pars.ndim == 1 or len(pars) < 2:
+            return self._like(pars)
+
+        # the workers' own counters are not reported back
+        if instrument.enabled:
+            instrument.count('likelihood.calls')
+            instrument.count('likelihood.evaluations', len(pars))
+        chunks = np.array_split(pars, min(self.nprocs, len(pars)))
+        return np.concatenate(self.pool.map(_evalChunk, chunks))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import pickle
+import shutil
+import hashlib
+import inspect
+import argparse
+import collections
+import instrument
+from fileio import atomicWrite
+
+# Named analysis stages whose results are cached on disk under a hash of
+# everything that went into them: the stage's source (and the source of any
+# modules or functions it declares in code), its parameters, the contents of
+# its input files and the keys of the stages it reads. A stage only runs when
+# one of those changes, when one of its declared output files is missing, when
+# a stage it reads has just run, or when it is forced:
+#
+#   pipeline = Pipeline('.pipeline')
+#
+#   @pipeline.stage('counts', files=['count.csv'])
+#   def counts():
+#       return readCounts('count.csv')
+#
+#   @pipeline.stage('fit', inputs=['counts'], code=[likelihood], nwalkers=1000)
+#   def fit(data, nwalkers):
+#       ...
+#
+#   pipeline.main()   # e.g. --until fit, --from fit, --force counts, --list,
+#                     # --report run.json, --profile fit
+#
+# A stage function is called with the results of its inputs (in order) and its
+# parameters as keywords. If it takes an argument named workdir, it is given a
+# scratch directory that belongs to its current key (e.g. for a ChainStore, so
+# an interrupted run resumes), which is emptied when the stage is forced.
+#
+# When the files a stage writes depend on its data (e.g. one figure per
+# location), outputs can instead be a function of the stage's result that
+# returns them; the list is kept next to the cached result.
+
+class Stage(object):
+
+    def __init__(self, name, func, inputs=(), files=(), outputs=(), code=(), version=0,
+                 params=None, optional=False):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.files = list(files)
+        self.outputs = outputs if callable(outputs) else list(outputs)
+        self.code = list(code)
+        self.version = version
+        self.params = params or {}
+        self.optional = optional
+        argnames = func.__code__.co_varnames[:func.__code__.co_argcount]
+        self.wantsworkdir = 'workdir' in argnames
+
+def _update(digest, text):
+    if not isinstance(text, bytes): text = text.encode('utf-8')
+    digest.update(text)
+
+def _fileHash(filename, blocksize=1 << 20):
+    if not os.path.exists(filename): return 'missing'
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''): digest.update(block)
+    return digest.hexdigest()
+
+class Pipeline(object):
+
+    def __init__(self, cachedir='.pipeline', verbose=True):
+        self.cachedir = cachedir
+        self.verbose = verbose
+        self.stages = collections.OrderedDict()
+
+    # decorator registering a stage; the stages it reads must already be
+    # registered. An optional stage is left out of a plain run unless a stage
+    # that is not optional reads it, and otherwise only runs when it is named
+    # by until, start or force.
+    def stage(self, name, inputs=(), files=(), outputs=(), code=(), version=0, optional=False,
+              **params):
+        def register(func):
+            if name in self.stages: raise ValueError("Stage " + name + " is already defined")
+            for inputname in inputs:
+                if inputname not in self.stages:
+                    raise ValueError("Stage " + name + " reads unknown stage " + inputname)
+            self.stages[name] = Stage(name, func, inputs=inputs, files=files, outputs=outputs,
+                                      code=code, version=version, params=params,
+                                      optional=optional)
+            return func
+        return register
+
+    # the stage and every stage it (indirectly) reads
+    def upstream(self, name):
+        names = set([name])
+        for inputname in self.stages[name].inputs: names |= self.upstream(inputname)
+        return names
+
+    # the stage and every stage that (indirectly) reads it
+    def downstream(self, name):
+        names = set([name])
+        for other in self.stages.values():
+            if name in other.inputs: names |= self.downstream(other.name)
+        return names
+
+    # the cache key of every stage
+    def keys(self):
+        keys = {}
+        for stage in self.stages.values():
+            digest = hashlib.sha1()
+            _update(digest, stage.name)
+            for obj in [stage.func] + stage.code: _update(digest, inspect.getsource(obj))
+            _update(digest, json.dumps([stage.version, stage.params], sort_keys=True, default=repr))
+            for filename in stage.files: _update(digest, filename + ':' + _fileHash(filename))
+            for inputname in stage.inputs: _update(digest, keys[inputname])
+            keys[stage.name] = digest.hexdigest()
+        return keys
+
+    def _path(self, name, key, suffix):
+        return os.path.join(self.cachedir, name, key + suffix)
+
+    # the output files of the stage's result for key, None if they are unknown
+    def outputs(self, name, key):
+        outputs = self.stages[name].outputs
+        if not callable(outputs): return outputs
+        filename = self._path(name, key, '.outputs.json')
+        if not os.path.exists(filename): return None
+        with open(filename) as f:
+            return json.load(f)
+
+    # whether the stage's result for key is on disk along with its output files
+    def cached(self, name, key):
+        if not os.path.exists(self._path(name, key, '.pkl')): return False
+        outputs = self.outputs(name, key)
+        return outputs is not None and all(os.path.exists(output) for output in outputs)
+
+    # Run the stages that are out of date, up to and including until (by
+    # default, every stage that is not optional and the stages they read).
+    # start reruns that stage and everything downstream of it, force reruns
+    # the named stages (or 'all') and everything downstream of them.
+    # Results are only loaded from the cache when a stage that runs needs them.
+    # Returns {name: result} of the stages that were run or loaded.
+    def run(self, until=None, start=None, force=()):
+
+        keys = self.keys()
+        if until is not None: needed = self.upstream(until)
+        else:
+            needed = set()
+            for name, stage in self.stages.items():
+                if not stage.optional: needed |= self.upstream(name)
+        forced = set()
+        for name in list(force) + ([start] if start is not None else []):
+            if name == 'all': forced = set(self.stages)
+            else: forced |= self.downstream(name)
+            # naming an optional stage asks for it
+            if name in self.stages and self.stages[name].optional: needed |= self.upstream(name)
+
+        results = {}
+        def result(name):
+            if name not in results:
+                with open(self._path(name, keys[name], '.pkl'), 'rb') as f:
+                    results[name] = pickle.load(f)
+            return results[name]
+
+        rerun = set()
+        for name, stage in self.stages.items():
+            if name not in needed: continue
+            key = keys[name]
+            if name not in forced and name not in rerun and self.cached(name, key):
+                if self.verbose: print 'stage ' + name + ': cached (' + key[:10] + ')'
+                continue
+
+            args = [result(inputname) for inputname in stage.inputs]
+            kwargs = dict(stage.params)
+            if stage.wantsworkdir:
+                workdir = self._path(name, key, '.work')
+                if name in forced and os.path.exists(workdir): shutil.rmtree(workdir)
+                if not os.path.exists(workdir): os.makedirs(workdir)
+                kwargs['workdir'] = workdir
+
+            if self.verbose: print 'stage ' + name + ': running (' + key[:10] + ')'
+            began = time.time()
+            with instrument.timer('stage.' + name), instrument.profiled(name):
+                results[name] = stage.func(*args, **kwargs)
+            seconds = time.time() - began
+
+            stagedir = os.path.join(self.cachedir, name)
+            if not os.path.exists(stagedir): os.makedirs(stagedir)
+            if callable(stage.outputs):
+                atomicWrite(self._path(name, key, '.outputs.json'),
+                            json.dumps(list(stage.outputs(results[name]))))
+            atomicWrite(self._path(name, key, '.pkl'),
+                        pickle.dumps(results[name], pickle.HIGHEST_PROTOCOL))
+            atomicWrite(os.path.join(stagedir, 'latest.json'),
+                        json.dumps({'key':key, 'time':time.time(), 'seconds':seconds}))
+            if self.verbose: print 'stage ' + name + ': done in %.1f s' % seconds
+            # the output may differ even with the same key (e.g. a new chain)
+            rerun |= self.downstream(name)
+
+        return results
+
+    # the cached result of a stage for its current inputs
+    def result(self, name):
+        key = self.keys()[name]
+        if not self.cached(name, key): raise KeyError("Stage " + name + " is not up to date")
+        with open(self._path(name, key, '.pkl'), 'rb') as f:
+            return pickle.load(f)
+
+    # (name, key, up to date) for every stage
+    def status(self):
+        keys = self.keys()
+        stale = set()
+        for name, stage in self.stages.items():
+            if not self.cached(name, keys[name]) or any(inputname in stale for inputname in stage.inputs):
+                stale.add(name)
+        return [(name, keys[name], name not in stale) for name in self.stages]
+
+    # command line interface: run (part of) the pipeline or list its stages
+    def main(self, argv=None, description=None):
+        names = list(self.stages)
+        parser = argparse.ArgumentParser(description=description)
+        parser.add_argument('--until', choices=names, help="stop after this stage")
+        parser.add_argument('--from', dest='start', choices=names,
+                            help="rerun this stage and everything after it")
+        parser.add_argument('--force', nargs='+', default=[], choices=names + ['all'],
+                            help="rerun these stages (and what depends on them)")
+        parser.add_argument('--list', action='store_true',
+                            help="list the stages and whether they are up to date")
+        parser.add_argument('--report',
+                            help="write the stage timings, counters and peak memory to this "
+                                 "JSON (or .csv) file")
+        parser.add_argument('--profile', nargs='+', default=[], choices=names,
+                            help="profile these stages (implies --report)")
+        parser.add_argument('--profiler', choices=['cprofile', 'sample'], default='cprofile',
+                            help="cProfile (.prof files) or a sampling profiler (.folded stacks)")
+        args = parser.parse_args(argv)
+
+        if args.list:
+            for name, key, current in self.status():
+                print '%-16s %s %s%s' % (name, key[:10], 'up to date' if current else 'stale',
+                                         ' (optional)' if self.stages[name].optional else '')
+            return None
+
+        report = args.report
+        if args.profile and report is None: report = os.path.join(self.cachedir, 'report.json')
+        if report is not None:
+            instrument.enable(profile=args.profile, profiler=args.profiler,
+                              profiledir=os.path.join(self.cachedir, 'profiles'))
+        try:
+            return self.run(until=args.until, start=args.start, force=args.force)
+        finally:
+            if report is not None:
+                instrument.writeReport(report)
+                print 'report written to ' + report
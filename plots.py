@@ -5,7 +5,6 @@ import json
 import csv
 import datetime
 import ipdb
-from qgis.core import *
 
 with open('x.dat') as xfile:
     x = json.load(xfile)
@@ -0,0 +1,34 @@
+import numpy as np
+
+# Posterior-predictive summaries from a (nsamples, ndim) sample matrix in a few
+# block operations: the log likelihood of every sample, the most likely sample,
+# and quantiles of the predicted bikers/minute for every observation, which
+# also give the predictive band at each location.
+#
+# Returns a dict with
+#   loglike   - (nsamples,) log likelihood of each sample
+#   bestpars  - the sample with the highest likelihood
+#   maxlike   - its log likelihood
+#   quantiles - (len(quantiles), ndata) model quantiles for each observation
+#   bands     - {location: (rows, quantiles[:, rows])}, rows in data order
+def posteriorPredictive(like, samples, quantiles=(16, 50, 84), blocksize=4096):
+
+    samples = np.asarray(samples, dtype=float)
+    loglike = like(samples)
+    best = np.argmax(loglike)
+
+    # bound the (nsamples x observations) temporary by chunking the data
+    bands = np.empty((len(quantiles), like.ndata))
+    for i in range(0, like.ndata, blocksize):
+        rows = slice(i, i + blocksize)
+        bands[:, rows] = np.percentile(like.model(samples, rows=rows), quantiles, axis=0)
+
+    order = np.argsort(like.codes, kind='mergesort')
+    bounds = np.searchsorted(like.codes[order], np.arange(like.nlocations + 1))
+    bylocation = {}
+    for i, location in enumerate(like.locations):
+        rows = order[bounds[i]:bounds[i+1]]
+        bylocation[location] = (rows, bands[:, rows])
+
+    return {'loglike':loglike, 'bestpars':samples[best], 'maxlike':loglike[best],
+            'quantiles':bands, 'bands':bylocation}
@@ -0,0 +1,124 @@
+import numpy as np
+import emcee
+
+# Seed for the walkers. The zeropoints start at the mean rate at each location
+# and the covariate coefficients come from the least-squares solution of
+#   Total Bike/Interval = zeropoint(location)*(c0*temperature + c1*humidity + ...)
+# with the zeropoints held fixed, which is linear in the coefficients. When
+# optimize is set, that solution is polished into the MAP estimate by
+# mapfit.fitMAP.
+def warmStart(like, optimize=True):
+
+    zeropoints = np.bincount(like.codes, weights=like.rate*like.interval,
+                             minlength=like.nlocations) /\
+                 np.bincount(like.codes, weights=like.interval,
+                             minlength=like.nlocations)
+
+    # the rate is only defined up to the product of zeropoint and coefficients,
+    # so normalize the zeropoints and let the coefficients carry the scale
+    zeropoints /= np.mean(zeropoints)
+    scale = zeropoints[like.codes]
+    A = scale[:, np.newaxis]*like.design.covariateMatrix()
+    good = np.all(np.isfinite(A), axis=1) & np.isfinite(like.rate)
+    coeffs = np.linalg.lstsq(A[good], like.rate[good], rcond=None)[0]
+
+    pars = np.concatenate([coeffs, zeropoints])
+    if optimize:
+        from mapfit import fitMAP
+        try:
+            pars = fitMAP(like, pars=pars, singular='pinv')['pars']
+        except ValueError:
+            # the least-squares solution is unphysical; start from it anyway
+            pass
+    return pars
+
+# The likelihood only depends on the products zeropoint*coefficients, so the
+# full parameter space has an exactly flat direction (zeropoints*s,
+# coefficients/s) along which walkers drift without end, and the
+# autocorrelation time along it never settles. The sampler is instead given
+# every parameter but the last zeropoint, which is set so that the mean
+# zeropoint is 1 (the gauge of mapfit.normalizePars).
+
+# (..., ndim) parameters to the (..., ndim-1) sampled ones
+def reducePars(design, pars):
+    pars = np.array(pars, dtype=float)
+    scale = np.mean(pars[..., design.zeropoints], axis=-1)[..., np.newaxis]
+    pars[..., design.zeropoints] /= scale
+    pars[..., design.coeffs] *= scale
+    return pars[..., :-1]
+
+# (..., ndim-1) sampled parameters to the full (..., ndim) ones
+def expandPars(design, reduced):
+    reduced = np.asarray(reduced, dtype=float)
+    last = design.nlocations - np.sum(reduced[..., design.ncoeffs:], axis=-1)
+    return np.concatenate([reduced, last[..., np.newaxis]], axis=-1)
+
+# a likelihood (BikeLike or ParallelBikeLike) of the reduced parameters
+class GaugedLike(object):
+
+    def __init__(self, like):
+        self.like = like
+        self.design = like.design
+        self.ndim = like.ndim - 1
+
+    def __call__(self, reduced):
+        return self.like(expandPars(self.design, reduced))
+
+# a small ball of walkers around pars, redrawing any that start unphysical
+def initWalkers(like, pars, nwalkers, scatter=1e-3, maxtries=100):
+    pars = np.asarray(pars, dtype=float)
+    p0 = pars*(1.0 + scatter*np.random.randn(nwalkers, len(pars)))
+    for i in range(maxtries):
+        bad = ~np.isfinite(like(p0))
+        if not np.any(bad): return p0
+        p0[bad] = pars*(1.0 + scatter*np.random.randn(np.sum(bad), len(pars)))
+    raise ValueError("Could not initialize walkers with finite likelihood")
+
+# Run the sampler until the integrated autocorrelation time is stable (changes
+# by less than tautol) and the chain is longer than ntau autocorrelation times,
+# or maxsteps is reached. Burn-in and thinning are chosen from tau.
+#
+# With a ChainStore, steps are streamed to disk instead of being kept by the
+# sampler, the state is checkpointed every checkpointevery steps, and a store
+# that already holds steps resumes from its last checkpoint (p0 is ignored).
+# The autocorrelation time is then estimated from at most tauwalkers walkers.
+def runMCMC(sampler, p0, maxsteps=10000, checkevery=100, ntau=50, tautol=0.01,
+            store=None, checkpointevery=1000, tauwalkers=64):
+
+    if store is not None and store.iteration > 0:
+        checkpoint = store.lastState()
+        p0 = emcee.State(checkpoint['coords'], log_prob=checkpoint['log_prob'],
+                         random_state=checkpoint['random_state'])
+    iteration = 0 if store is None else store.iteration
+
+    oldtau = np.inf
+    tau = None
+    converged = False
+    state = None
+    for state in sampler.sample(p0, iterations=max(maxsteps - iteration, 0),
+                                store=store is None):
+        iteration += 1
+        if store is not None:
+            store.save(state)
+            if iteration % checkpointevery == 0: store.checkpoint(state)
+        if iteration % checkevery: continue
+
+        tau = _autocorrTime(sampler, store, tauwalkers)
+        if np.all(np.isfinite(tau)):
+            converged = bool(np.all(tau*ntau < iteration) and\
+                             np.all(np.abs(oldtau - tau)/tau < tautol))
+            if converged: break
+        oldtau = tau
+
+    if store is not None and state is not None: store.checkpoint(state)
+    if tau is None or not np.all(np.isfinite(tau)):
+        tau = _autocorrTime(sampler, store, tauwalkers)
+    burn = int(2*np.max(tau))
+    thin = max(1, int(0.5*np.min(tau)))
+    return {'tau':tau, 'burn':burn, 'thin':thin, 'converged':converged,
+            'nsteps':iteration}
+
+def _autocorrTime(sampler, store, tauwalkers):
+    if store is None: return sampler.get_autocorr_time(tol=0)
+    chain = store.getChain(walkers=slice(0, tauwalkers))
+    return emcee.autocorr.integrated_time(chain.astype(float), tol=0)*store.thin
@@ -0,0 +1,143 @@
+import os
+import struct
+import numpy as np
+import instrument
+
+# Readers for ESRI shapefiles (.shp/.shx geometry and .dbf attributes) that need
+# neither QGIS nor GDAL. Both stream the file in chunks of records straight into
+# NumPy arrays.
+
+# the fields of a .dbf file as a list of (name, type, length, decimals)
+def dbfFields(dbffile):
+    with open(dbffile, 'rb') as f:
+        header = f.read(32)
+        nrecords, headerlength, recordlength = struct.unpack('<IHH', header[4:12])
+        fields = []
+        while True:
+            descriptor = f.read(32)
+            if len(descriptor) < 32 or descriptor[0:1] == b'\r': break
+            name = descriptor[:11].split(b'\0')[0].decode('ascii')
+            fields.append((str(name), descriptor[11:12].decode('ascii'),
+                           ord(descriptor[16:17]), ord(descriptor[17:18])))
+    return fields
+
+def _dbfHeader(dbffile):
+    with open(dbffile, 'rb') as f:
+        nrecords, headerlength, recordlength = struct.unpack('<IHH', f.read(12)[4:12])
+    return nrecords, headerlength, recordlength
+
+# convert fixed-width dBase values to a NumPy column
+def _decode(values, fieldtype, decimals):
+    values = np.char.strip(values)
+    if fieldtype in 'NF':
+        blank = (values == b'') | (np.char.count(values, b'*') > 0)
+        if fieldtype == 'N' and decimals == 0 and not np.any(blank):
+            return values.astype(np.int64)
+        return np.where(blank, b'nan', values).astype(float)
+    if fieldtype == 'L':
+        return np.isin(values, [b'T', b't', b'Y', b'y'])
+    return values
+
+# Yield the records of a .dbf file in chunks of up to chunksize records, each a
+# dict of {field: array}. Only the fields named in columns (all by default) are
+# decoded; numeric fields become int64 (or float with NaN for blanks), logical
+# fields bool, and anything else stripped byte strings. Deleted records are
+# skipped.
+def readDBF(dbffile, columns=None, chunksize=100000):
+
+    fields = dbfFields(dbffile)
+    nrecords, headerlength, recordlength = _dbfHeader(dbffile)
+    if columns is None: columns = [field[0] for field in fields]
+    missing = set(columns) - set(field[0] for field in fields)
+    if missing: raise KeyError("No such fields in " + dbffile + ": " + ', '.join(sorted(missing)))
+
+    # one record as a structured dtype, starting with the deletion flag
+    names = ['_deleted'] + ['_%d' % i for i in range(len(fields))]
+    formats = ['S1'] + ['S%d' % field[2] for field in fields]
+    dtype = np.dtype({'names':names, 'formats':formats})
+    if dtype.itemsize != recordlength:
+        raise IOError("Unexpected record length in " + dbffile)
+    selected = [(i, field) for i, field in enumerate(fields) if field[0] in columns]
+
+    with open(dbffile, 'rb') as f:
+        f.seek(headerlength)
+        for start in range(0, nrecords, chunksize):
+            count = min(chunksize, nrecords - start)
+            records = np.frombuffer(f.read(count*recordlength), dtype=dtype, count=count)
+            keep = records['_deleted'] != b'*'
+            chunk = {}
+            for i, (name, fieldtype, length, decimals) in selected:
+                chunk[name] = _decode(records['_%d' % i][keep], fieldtype, decimals)
+            if instrument.enabled: instrument.count('dbf.records', int(np.sum(keep)))
+            yield chunk
+
+# all of readDBF's chunks concatenated into one dict of arrays
+def readDBFColumns(dbffile, columns=None, chunksize=100000):
+    chunks = list(readDBF(dbffile, columns=columns, chunksize=chunksize))
+    if len(chunks) == 0: return {}
+    return dict((name, np.concatenate([chunk[name] for chunk in chunks])) for name in chunks[0])
+
+# little-endian int32 values at the given byte offsets of buf
+def _int32At(buf, offsets):
+    return buf[np.asarray(offsets)[:, None] + np.arange(4)].copy().view('<i4').ravel()
+
+# expand byte ranges [starts, starts + lengths) into one index array
+def _byteRanges(starts, lengths):
+    total = int(np.sum(lengths))
+    offsets = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + offsets
+
+# Yield the geometry of a polyline, polygon or point shapefile in chunks of up
+# to chunksize records, using the .shx index to find them. Each chunk is a dict:
+#   shapeType - (n,) shape type of each record (0 for null shapes)
+#   offsets   - (n+1,) record i has points offsets[i]:offsets[i+1]
+#   parts     - (nparts,) first point of each part, indexing x and y
+#   partOffsets - (n+1,) record i has parts partOffsets[i]:partOffsets[i+1]
+#   x, y      - the points
+def readShapes(shpfile, chunksize=100000):
+
+    shxfile = os.path.splitext(shpfile)[0] + '.shx'
+    with open(shxfile, 'rb') as f:
+        f.seek(100)
+        index = np.frombuffer(f.read(), dtype='>i4').reshape((-1, 2)).astype(np.int64)*2
+    # byte offset and content length of each record
+    recordoffsets, contentlengths = index[:, 0], index[:, 1]
+
+    with open(shpfile, 'rb') as f:
+        for start in range(0, len(recordoffsets), chunksize):
+            stop = min(start + chunksize, len(recordoffsets))
+            first = recordoffsets[start]
+            f.seek(first)
+            buf = np.frombuffer(f.read(recordoffsets[stop-1] + 8 + contentlengths[stop-1] - first),
+                                dtype=np.uint8)
+
+            # content of each record, after its 8 byte header
+            content = recordoffsets[start:stop] - first + 8
+            shapetype = _int32At(buf, content)
+
+            unsupported = ~np.isin(shapetype, [0, 1, 3, 5, 8])
+            if np.any(unsupported):
+                raise ValueError("Unsupported shape type %d in %s" % (shapetype[unsupported][0], shpfile))
+            point = shapetype == 1
+            multipoint = shapetype == 8
+            haspart = (shapetype == 3) | (shapetype == 5)
+
+            nparts = np.zeros(len(shapetype), dtype=np.int64)
+            nparts[haspart] = _int32At(buf, content[haspart] + 36)
+            npoints = point.astype(np.int64)
+            npoints[multipoint] = _int32At(buf, content[multipoint] + 36)
+            npoints[haspart] = _int32At(buf, content[haspart] + 40)
+
+            # where the parts and points of each record start
+            partstart = content + 44
+            pointstart = np.where(point, content + 4,
+                                  np.where(multipoint, content + 40, partstart + 4*nparts))
+
+            parts = _int32At(buf, _byteRanges(partstart, 4*nparts)[::4]).astype(np.int64)
+            offsets = np.concatenate([[0], np.cumsum(npoints)])
+            partOffsets = np.concatenate([[0], np.cumsum(nparts)])
+            parts += np.repeat(offsets[:-1], nparts)
+
+            xy = buf[_byteRanges(pointstart, 16*npoints)].copy().view('<f8').reshape((-1, 2))
+            yield {'shapeType':shapetype, 'offsets':offsets, 'parts':parts,
+                   'partOffsets':partOffsets, 'x':xy[:, 0], 'y':xy[:, 1]}
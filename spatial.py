@@ -0,0 +1,183 @@
+import numpy as np
+
+# radius of the earth (m)
+r_earth = 6.3781e6
+
+# Great-circle distance (m) from points (x0, y0) to the segments (x1, y1)-(x2, y2),
+# all in degrees of longitude (x) and latitude (y) and broadcast against each
+# other. The closest point is found in a local equirectangular projection about
+# each query point (exact for the short segments of a street network) and the
+# distance to it uses the haversine formula, which unlike the spherical law of
+# cosines stays accurate down to millimetres.
+def segmentDistance(x1, y1, x2, y2, x0, y0):
+
+    x1, y1, x2, y2, x0, y0 = [np.asarray(v, dtype=float) for v in (x1, y1, x2, y2, x0, y0)]
+    coslat = np.cos(np.radians(y0))
+
+    # segment and point relative to its start, in projected degrees
+    dx = (x2 - x1)*coslat
+    dy = y2 - y1
+    px = (x0 - x1)*coslat
+    py = y0 - y1
+
+    length2 = dx*dx + dy*dy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(length2 > 0, (px*dx + py*dy)/length2, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+
+    # closest point on the segment
+    x = x1 + t*(x2 - x1)
+    y = y1 + t*(y2 - y1)
+
+    sindlat = np.sin(np.radians(y - y0)/2.0)
+    sindlon = np.sin(np.radians(x - x0)/2.0)
+    a = sindlat**2 + coslat*np.cos(np.radians(y))*sindlon**2
+    return 2.0*r_earth*np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+# distance (m) from (x0,y0) to the segment (x1,y1)-(x2,y2), in degrees
+def getMinDist(x1,y1,x2,y2,x0,y0):
+    return float(segmentDistance(x1,y1,x2,y2,x0,y0))
+
+# expand integer ranges [starts, stops) into one array of indices, along with
+# the position of the range each index came from
+def _expandRanges(starts, stops):
+    counts = np.maximum(stops - starts, 0)
+    owner = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets, owner
+
+# Uniform-grid spatial index over line segments in lon/lat degrees. Each segment
+# is listed under every grid cell its bounding box touches, and the cell lists
+# are packed into one sorted array, so every query below runs as a batch of
+# array operations:
+#
+#   index = EdgeIndex(x1, y1, x2, y2)
+#   rows, dist = index.radius(lon, lat, 100.0)[0]
+class EdgeIndex(object):
+
+    def __init__(self, x1, y1, x2, y2, cellsize=0.005):
+
+        self.x1, self.y1, self.x2, self.y2 = [np.ascontiguousarray(v, dtype=float)
+                                              for v in (x1, y1, x2, y2)]
+        self.nsegments = len(self.x1)
+        self.cellsize = cellsize
+
+        self.xmin = np.minimum(self.x1, self.x2)
+        self.xmax = np.maximum(self.x1, self.x2)
+        self.ymin = np.minimum(self.y1, self.y2)
+        self.ymax = np.maximum(self.y1, self.y2)
+        if self.nsegments > 0:
+            self.x0 = self.xmin.min()
+            self.y0 = self.ymin.min()
+            self.nx = int((self.xmax.max() - self.x0)//cellsize) + 1
+            self.ny = int((self.ymax.max() - self.y0)//cellsize) + 1
+        else:
+            self.x0 = self.y0 = 0.0
+            self.nx = self.ny = 1
+
+        # every (cell, segment) pair, sorted by cell
+        ix0, iy0 = self._cell(self.xmin, self.ymin)
+        ix1, iy1 = self._cell(self.xmax, self.ymax)
+        keys, segments = self._cellPairs(ix0, iy0, ix1, iy1)
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        self.segments = segments[order]
+        self.cellkeys, self.cellstarts = np.unique(keys, return_index=True)
+        self.cellstops = np.append(self.cellstarts[1:], len(keys))
+
+    def _cell(self, x, y):
+        ix = np.clip(((np.asarray(x) - self.x0)//self.cellsize).astype(int), 0, self.nx - 1)
+        iy = np.clip(((np.asarray(y) - self.y0)//self.cellsize).astype(int), 0, self.ny - 1)
+        return ix, iy
+
+    # the cell keys covered by each box of cells [ix0, ix1] x [iy0, iy1], and the
+    # box each belongs to
+    def _cellPairs(self, ix0, iy0, ix1, iy1):
+        width = ix1 - ix0 + 1
+        height = iy1 - iy0 + 1
+        flat, owner = _expandRanges(np.zeros(len(width), dtype=int), width*height)
+        ix = ix0[owner] + flat % width[owner]
+        iy = iy0[owner] + flat//width[owner]
+        return ix*self.ny + iy, owner
+
+    # candidate (query, segment) pairs for query boxes in degrees, without duplicates
+    def _candidates(self, xmin, ymin, xmax, ymax):
+        inside = (xmax >= self.x0) & (ymax >= self.y0) &\
+                 (xmin <= self.x0 + self.nx*self.cellsize) &\
+                 (ymin <= self.y0 + self.ny*self.cellsize)
+        queries = np.where(inside)[0]
+        if len(self.cellkeys) == 0: queries = queries[:0]
+        ix0, iy0 = self._cell(xmin[queries], ymin[queries])
+        ix1, iy1 = self._cell(xmax[queries], ymax[queries])
+        keys, owner = self._cellPairs(ix0, iy0, ix1, iy1)
+
+        # look up each cell's range of segments; missing cells are empty
+        pos = np.searchsorted(self.cellkeys, keys)
+        pos = np.minimum(pos, len(self.cellkeys) - 1)
+        found = self.cellkeys[pos] == keys
+        starts = np.where(found, self.cellstarts[pos], 0)
+        stops = np.where(found, self.cellstops[pos], 0)
+        entries, pair = _expandRanges(starts, stops)
+
+        pairs = np.unique(queries[owner[pair]]*self.nsegments + self.segments[entries])
+        return pairs//self.nsegments, pairs % self.nsegments
+
+    # split flat (query, row, value) results into one (rows, values) per query
+    def _split(self, nqueries, query, rows, values):
+        bounds = np.searchsorted(query, np.arange(nqueries + 1))
+        return [(rows[bounds[i]:bounds[i+1]], values[bounds[i]:bounds[i+1]])
+                for i in range(nqueries)]
+
+    # Segments within radius (m) of each point. Returns one (rows, distances)
+    # per point, in order of increasing distance.
+    def radius(self, lon, lat, radius):
+        lon = np.atleast_1d(np.asarray(lon, dtype=float))
+        lat = np.atleast_1d(np.asarray(lat, dtype=float))
+        radius = np.broadcast_to(np.asarray(radius, dtype=float), lon.shape)
+        query, rows, dist = self._radius(lon, lat, radius)
+        return self._split(len(lon), query, rows, dist)
+
+    def _radius(self, lon, lat, radius):
+        dlat = np.degrees(radius/r_earth)
+        dlon = dlat/np.maximum(np.cos(np.radians(np.minimum(np.abs(lat) + dlat, 89.9))), 1e-6)
+        query, rows = self._candidates(lon - dlon, lat - dlat, lon + dlon, lat + dlat)
+        dist = segmentDistance(self.x1[rows], self.y1[rows], self.x2[rows], self.y2[rows],
+                               lon[query], lat[query])
+        keep = dist <= radius[query]
+        query, rows, dist = query[keep], rows[keep], dist[keep]
+        order = np.lexsort((dist, query))
+        return query[order], rows[order], dist[order]
+
+    # The k nearest segments to each point, as one (rows, distances) per point.
+    # The search radius starts at guess (m) and doubles for the points that have
+    # not found k segments yet.
+    def nearest(self, lon, lat, k=1, guess=100.0):
+        lon = np.atleast_1d(np.asarray(lon, dtype=float))
+        lat = np.atleast_1d(np.asarray(lat, dtype=float))
+        k = min(k, self.nsegments)
+        results = [(np.empty(0, dtype=int), np.empty(0))]*len(lon)
+
+        # beyond this every segment is a candidate
+        span = r_earth*np.radians(max(self.nx, self.ny)*self.cellsize)
+        pending = np.arange(len(lon))
+        radius = np.full(len(lon), guess)
+        while len(pending) > 0:
+            query, rows, dist = self._radius(lon[pending], lat[pending], radius[pending])
+            counts = np.bincount(query, minlength=len(pending))
+            for i, (r, d) in enumerate(self._split(len(pending), query, rows, dist)):
+                if counts[i] >= k: results[pending[i]] = (r[:k], d[:k])
+            pending = pending[counts < k]
+            radius[pending] *= 2
+            # far from the network; take every segment
+            radius[pending[radius[pending] > 2*span + guess]] = 1e3*r_earth
+        return results
+
+    # Segments whose bounding boxes overlap each box, as one array of rows per box
+    def bbox(self, xmin, ymin, xmax, ymax):
+        xmin, ymin, xmax, ymax = [np.atleast_1d(np.asarray(v, dtype=float))
+                                  for v in (xmin, ymin, xmax, ymax)]
+        query, rows = self._candidates(xmin, ymin, xmax, ymax)
+        keep = (self.xmax[rows] >= xmin[query]) & (self.xmin[rows] <= xmax[query]) &\
+               (self.ymax[rows] >= ymin[query]) & (self.ymin[rows] <= ymax[query])
+        query, rows = query[keep], rows[keep]
+        return [r for r, q in self._split(len(xmin), query, rows, query)]
@@ -1,16 +1,29 @@
-from qgis.core import *
-import qgis.utils
-import ipdb
+import os
 import datetime
-import urllib2
 import numpy as np
 import matplotlib
 matplotlib.use('Agg') # Workaround for Tkinter import error
 import matplotlib.pyplot as plt
-import json
-import sys
-import collections
 import math
+from weather import getWeatherRange
+from edgestore import EdgeStore, openEdgeStore
+from commuters import CommuterMatrix
+from animate import animate
+from tiles import buildTiles
+from pipeline import Pipeline
+import weather
+import spatial
+import shapefile
+import commuters
+import tiles
+import edgestore as edgemodule
+import animate as animatemodule
+try:
+    from qgis.core import *
+    import qgis.utils
+    haveqgis = True
+except ImportError:
+    haveqgis = False
 
 '''
 This code's goal is to create an accurate model of biking traffic from Strava
@@ -102,161 +115,36 @@ http://docs.qgis.org/testing/en/docs/pyqgis_developer_cookbook/raster.html
 
 '''
 
-# get the weather for a given day by airport code (is it international?)
-def getWeather(date, airport='BOS', timezone=5):
-
-    # https://www.wunderground.com/history/airport/BOS/2015/10/8/DailyHistory.html?&format=1
-    url = 'https://www.wunderground.com/history/airport/' + airport + '/' +\
-          str(date.year) + '/' + str(date.month) + '/' + str(date.day) +\
-          '/DailyHistory.html?&format=1'
-    request = urllib2.Request(url)
-    try:
-        response = urllib2.urlopen(request)
-    except:
-        print 'could not open ' + url
-        return -1
-
-    data = response.read().split('<br />\n')
-
-    # is it stable? is it uniform for all airports/times? 
-    # TODO: read with CSV reader (?), check that required keys are present
-    weather = {'time':[],'temperature':[],'dewPoint':[],'humidity':[],'pressure':[],'visibility':[],
-                'windDir':[],'windSpeed':[],'windGust':[],'precipitation':[],'events':[],'conditions':[]}    
-    for values in data[1:]:
-        valarr = values.split(',')
-        if len(valarr) == 14:
-            weather['time'].append(datetime.datetime.strptime(valarr[13],'%Y-%m-%d %H:%M:%S') -
-                                   datetime.timedelta(hours=timezone))
-            weather['temperature'].append(valarr[1])
-            weather['dewPoint'].append(valarr[2])
-            weather['humidity'].append(valarr[3])
-            weather['pressure'].append(valarr[4])
-            weather['visibility'].append(valarr[5])
-            weather['windDir'].append(valarr[12])
-            weather['windSpeed'].append(valarr[7])
-            weather['windGust'].append(valarr[8])
-            weather['precipitation'].append(valarr[9])
-            weather['events'].append(valarr[10])
-            weather['conditions'].append(valarr[11])
-    return weather   
-
 # get the field names of a given layer:
 def getFieldNames(layer):
     field_names = [field.name() for field in layer.pendingFields()]
     return field_names
 
-def getMinDist(x1,y1,x2,y2,x0,y0):
-
-    if x2 == x1:
-        # horizontal segment
-        x = x1
-        y = y0
-    elif y1==y2:
-        # vertical segment
-        x = x0
-        y = y1
-    else:
-        # the equation of the edge's line
-        m1 = (y2-y1)/(x2-x1)
-        b1 = y1 - m1*x1
-
-        # the equation of the perpendicular line that passes through the specified point
-        m2 = -1.0/m1
-        b2 = y0 - m2*x0
-
-        # the coordinates of intersection
-        x = (b2-b1)/(m1-m2)
-        y = m1*x+b1
-
-    # must be closest to the segment, not the line
-    if x1 > x2: # can't assume x1 < x2
-        if x > x1: x = x1
-        if x < x2: x = x2
-    else:
-        if x < x1: x = x1
-        if x > x2: x = x2
-    if y1 > y2: # can't assume y1 < y2
-        if y > y1: y = y1
-        if y < y2: y = y2
-    else:
-        if y < y1: y = y1
-        if y > y2: y = y2
-
-    # closest approach is the distance from the perpendicular line
-    # angular separation in radians * r_earth = distance
-    r_earth = 6.3781e6
-    mindist = math.acos(math.sin(y0*math.pi/180.0)*math.sin(y*math.pi/180.0)+math.cos(y0*math.pi/180.0)*math.cos(y*math.pi/180.0)*math.cos((x0-x)*math.pi/180.0))*r_earth
-
-    return mindist
-
-def plotEdges(edge_layer,lat=None,lon=None,radius=None, edgeids=[]):
+def plotEdges(edgestore,lat=None,lon=None,radius=None, edgeids=[]):
 
     # edge file is in this coordinate system
     # +proj=longlat +datum=WGS84 +no_defs
 
-    crs = QgsCoordinateReferenceSystem(4326, QgsCoordinateReferenceSystem.PostgisCrsId)
-    crsSrc = QgsCoordinateReferenceSystem(4326)    # WGS 84
-    crsDest = QgsCoordinateReferenceSystem(32633)  # WGS 84 / UTM zone 33N
-    xform = QgsCoordinateTransform(crsSrc, crsDest)
-
-# forward transformation: src -> dest
-#pt1 = xform.transform(QgsPoint(40,-70))
-#print "Transformed point:", pt1
-
-# inverse transformation: dest -> src
-#pt2 = xform.transform(pt1, QgsCoordinateTransform.ReverseTransform)
-#print "Transformed back:", pt2
-
-    x = [] # Longitude (deg E)
-    y = [] # Latitude (deg N)
+    # NaN separates the segments in a single line plot
+    gap = np.full(edgestore.nedges, np.nan)
+    x = np.column_stack([edgestore.x1*np.cos(edgestore.y1*math.pi/180.0),
+                         edgestore.x2*np.cos(edgestore.y2*math.pi/180.0), gap]).ravel() # Longitude (deg E)
+    y = np.column_stack([edgestore.y1, edgestore.y2, gap]).ravel() # Latitude (deg N)
 
-    xclose = []
-    yclose = []
+    close = []
     streetname = []
-    
-    idxx1 = edge_layer.fieldNameIndex('X1') 
-    idxx2 = edge_layer.fieldNameIndex('X2') 
-    idxy1 = edge_layer.fieldNameIndex('Y1') 
-    idxy2 = edge_layer.fieldNameIndex('Y2')
-
-    for feature in edge_layer.getFeatures():
-        pt1 = xform.transform(QgsPoint(feature[idxx1],feature[idxy1]))
-        pt2 = xform.transform(QgsPoint(feature[idxx2],feature[idxy2]))
-
-#        x.append(-pt1[1])
-#        x.append(-pt2[1])
-        x.append(feature[idxx1]*math.cos(feature[idxy1]*math.pi/180.0))
-        x.append(feature[idxx2]*math.cos(feature[idxy2]*math.pi/180.0))
-        x.append(None)
-#        y.append(pt1[0])
-#        y.append(pt2[0])
-        y.append(feature[idxy1])#/math.cos(feature[idxx1]*math.pi/180.0))
-        y.append(feature[idxy2])#/math.cos(feature[idxx2]*math.pi/180.0))
-        y.append(None)
-
-        
-        
-        if lat != None and lon != None:
-            if radius != None:
-                mindist = getMinDist(feature[idxx1],feature[idxy1],feature[idxx2],feature[idxy2],lon,lat)
-                if mindist <= radius:
-                    xclose.append(feature[idxx1])
-                    xclose.append(feature[idxx2])
-                    xclose.append(None)
-                    yclose.append(feature[idxy1])
-                    yclose.append(feature[idxy2])
-                    yclose.append(None)
-                    edgeid = feature[0]
-                    streetname = feature[2]
-        if feature[0] in edgeids:
-            xclose.append(feature[idxx1])
-            xclose.append(feature[idxx2])
-            xclose.append(None)
-            yclose.append(feature[idxy1])
-            yclose.append(feature[idxy2])
-            yclose.append(None)
-            streetname.append(feature[2])
-            
+    if lat != None and lon != None and radius != None:
+        rows, mindist = edgestore.index().radius(lon, lat, radius)[0]
+        close.append(rows)
+        if len(rows) > 0: edgeid = edgestore.edgeid[rows[-1]]
+    if len(edgeids) > 0:
+        rows = edgestore.rows(edgeids)
+        rows = rows[rows >= 0]
+        close.append(rows)
+        streetname = list(edgestore.streetnames[edgestore.street[rows]])
+    close = np.concatenate(close) if len(close) > 0 else np.empty(0, dtype=int)
+    xclose = np.column_stack([edgestore.x1[close], edgestore.x2[close], gap[close]]).ravel()
+    yclose = np.column_stack([edgestore.y1[close], edgestore.y2[close], gap[close]]).ravel()
 
 #    lon = xclose[0]
 #    lat = yclose[0]
@@ -281,39 +169,56 @@ def plotEdges(edge_layer,lat=None,lon=None,radius=None, edgeids=[]):
 #    ax.annotate(streetname + '(' + str(edgeid) + ')',xy=(lon+0.0001,lat))
     plt.savefig('edge.png')
 
-# supply path to qgis install location
-QgsApplication.setPrefixPath("C:/OSGeo4W64", True)
+# read the layers through QGIS, or directly from the shapefiles (headless, and
+# without needing QGIS installed)
+useqgis = False
+edgefile = "data/nyc_edges_ride/nyc_edges.shp"
+datafile = "data/nyc_edges_ride/nyc_edges_metro_street_data.dbf"
+
+if useqgis:
+    if not haveqgis: raise ImportError("useqgis is set but QGIS cannot be imported")
 
-# create a reference to the QgsApplication, setting the
-# second argument to False disables the GUI
-#qgs = QgsApplication([], False)
-qgs = QgsApplication([], True)
+    # supply path to qgis install location
+    QgsApplication.setPrefixPath(os.environ.get('QGIS_PREFIX_PATH', "C:/OSGeo4W64"), True)
 
-# load providers
-qgs.initQgis()
+    # create a reference to the QgsApplication, setting the
+    # second argument to False disables the GUI
+    qgs = QgsApplication([], False)
 
-# Write your code here to load some layers, use processing algorithms, etc.
-edge_layer = QgsVectorLayer("data/nyc_edges_ride/nyc_edges.shp", "NYC_Edges", "ogr")
-if not edge_layer.isValid():
-  print "edge layer failed to load!"
-else: QgsMapLayerRegistry.instance().addMapLayer(edge_layer)
+    # load providers
+    qgs.initQgis()
 
-node_layer = QgsVectorLayer("data/nyc_edges_ride/nyc_edges_nodes.shp", "NYC_Nodes", "ogr")
-if not node_layer.isValid():
-  print "node layer failed to load!"
-else: QgsMapLayerRegistry.instance().addMapLayer(node_layer)
+    # Write your code here to load some layers, use processing algorithms, etc.
+    edge_layer = QgsVectorLayer(edgefile, "NYC_Edges", "ogr")
+    if not edge_layer.isValid():
+      print "edge layer failed to load!"
+    else: QgsMapLayerRegistry.instance().addMapLayer(edge_layer)
 
-poly_layer = QgsVectorLayer("data/nyc_edges_ride/nyc_edges_od_polygons.shp", "NYC_Polygons", "ogr")
-if not poly_layer.isValid():
-  print "polygon layer failed to load!"
-else: QgsMapLayerRegistry.instance().addMapLayer(poly_layer)  
+    node_layer = QgsVectorLayer("data/nyc_edges_ride/nyc_edges_nodes.shp", "NYC_Nodes", "ogr")
+    if not node_layer.isValid():
+      print "node layer failed to load!"
+    else: QgsMapLayerRegistry.instance().addMapLayer(node_layer)
 
-data_layer = QgsVectorLayer("data/nyc_edges_ride/nyc_edges_metro_street_data.dbf", "NYC_Data", "ogr")
-if not data_layer.isValid():
-  print "data layer failed to load!"
-else: QgsMapLayerRegistry.instance().addMapLayer(data_layer)  
+    poly_layer = QgsVectorLayer("data/nyc_edges_ride/nyc_edges_od_polygons.shp", "NYC_Polygons", "ogr")
+    if not poly_layer.isValid():
+      print "polygon layer failed to load!"
+    else: QgsMapLayerRegistry.instance().addMapLayer(poly_layer)
 
-plotEdges(edge_layer)
+    data_layer = QgsVectorLayer(datafile, "NYC_Data", "ogr")
+    if not data_layer.isValid():
+      print "data layer failed to load!"
+    else: QgsMapLayerRegistry.instance().addMapLayer(data_layer)
+
+    buildEdges = lambda: EdgeStore.fromLayer(edge_layer)
+else:
+    buildEdges = lambda: EdgeStore.fromShapefile(edgefile)
+
+# the edges as arrays, cached next to the shapefile after the first run
+edgestore = openEdgeStore(edgefile, "data/nyc_edges_ride/nyc_edges.cache", buildEdges)
+
+# The analysis as cached stages; run "python strava.py --help" for how to run
+# part of it, e.g. --until commuters to only read the counts
+pipeline = Pipeline(os.path.join('.pipeline', 'strava'))
 
 
 '''
@@ -354,159 +259,87 @@ lon = -73.960339
 #plotEdges(edge_layer, edgeid=803175)
 #plotEdges(edge_layer, edgeid=54068)
 #plotEdges(edge_layer, lat=lat, lon=lon, radius=2.5)
-plotEdges(edge_layer, edgeids=[1134166,803175,54068,54853])# lat=lat, lon=lon, radius=2.5)
-
-with open('weather.lga.csv','w') as weatherfile:
-    for i in range(8):
-        weather = getWeather(datetime.datetime(2015,7,13) + datetime.timedelta(days=float(i)),airport='LGA')
-#    ipdb.set_trace()
+@pipeline.stage('edgeplot', files=[edgefile], outputs=['edge.png'],
+                code=[edgemodule, shapefile, spatial, plotEdges])
+def edgeplot():
+    plotEdges(edgestore)
+    plotEdges(edgestore, edgeids=[1134166,803175,54068,54853])# lat=lat, lon=lon, radius=2.5)
+
+@pipeline.stage('weather', outputs=['weather.lga.csv'], code=[weather])
+def lgaweather():
+    weather = getWeatherRange('LGA', datetime.datetime(2015,7,13), datetime.datetime(2015,7,20))
+    with open('weather.lga.csv','w') as weatherfile:
         for time, temperature, humidity, precipitation in zip(weather['time'],weather['temperature'],weather['humidity'],weather['precipitation']):
-                if precipitation == 'N/A': precipitation = 0.0
-                weatherfile.write(str(time) + ',' + str(temperature) + ',' + str(humidity) + ',' + str(precipitation) + '\n')
-#ipdb.set_trace()
-    
-
-# grab the indices of relevant fields
-idxYear = data_layer.fieldNameIndex('YEAR')
-idxDay = data_layer.fieldNameIndex('DAY')
-idxHour = data_layer.fieldNameIndex('HOUR')
-idxMin = data_layer.fieldNameIndex('MINUTE')
-idxCommuters = data_layer.fieldNameIndex('COMMUTE_CO')
-idxEdge = data_layer.fieldNameIndex('EDGE_ID')
-idxx1 = edge_layer.fieldNameIndex('X1') 
-idxx2 = edge_layer.fieldNameIndex('X2') 
-idxy1 = edge_layer.fieldNameIndex('Y1') 
-idxy2 = edge_layer.fieldNameIndex('Y2')
-
-# index the edges by edge ID
-print "Creating the edge ID indices"
-edges = {}
-for feature in edge_layer.getFeatures():
-    edges[feature[0]] = {'x':[feature[idxx1],feature[idxx2]],
-                         'y':[feature[idxy1],feature[idxy2]]}
-
-# index the data layer by date
-print "Creating the date indices"
-
-commutersmin = {}
-commutershr = {}
-commuters15min = {}
-for i in range(0,24*7*60):
-    date = datetime.datetime(2015,7,13) + datetime.timedelta(minutes=float(i))
-    commutersmin[str(date)] = []
-
-    if date.minute == 0:
-        commuters15min[str(date)] = []
-        commutershr[str(date)] = []
-
-    if date.minute == 15 or date.minute == 30 or date.minute == 45:
-        commuters15min[str(date)] = []
-
-for feature in data_layer.getFeatures():
-    datemin = datetime.datetime(feature[idxYear],1,1,feature[idxHour],feature[idxMin]) +\
-              datetime.timedelta(days=feature[idxDay]-1)
-
-    if datemin >= datetime.datetime(2015,7,13) and datemin < datetime.datetime(2015,7,20):
-        datehr = datetime.datetime(feature[idxYear],1,1,feature[idxHour]) +\
-                 datetime.timedelta(days=feature[idxDay]-1)
-
-
-        if feature[idxMin] < 15: minute = 0
-        elif feature[idxMin] < 30: minute = 15
-        elif feature[idxMin] < 45: minute = 30
-        else: minute = 45
-        date15min = datetime.datetime(feature[idxYear],1,1,feature[idxHour], minute) +\
-                    datetime.timedelta(days=feature[idxDay]-1)
-
-        commutersmin[str(datemin)].append(feature)
-        commutershr[str(datehr)].append(feature)
-        commuters15min[str(date15min)].append(feature)
-
-print "Done making data indices"
-
-# make an animated gif of bicycle traffic
-#for i in range(0,24*7):
-for i in range(0,24*7*60):
-    date = datetime.datetime(2015,7,13) + datetime.timedelta(minutes=float(i))
-
-    fig = plt.figure()
-    ax = fig.add_subplot(111, aspect='equal')
-    ax.set_xlabel("Longitude (deg E)")
-    ax.set_ylabel("Latitude (deg N)")
-    ax.set_title(str(date))
-    y_formatter = matplotlib.ticker.ScalarFormatter(useOffset=False)
-    ax.yaxis.set_major_formatter(y_formatter)
-    ax.xaxis.set_major_formatter(y_formatter)
-    ax.set_ylim([40.67,40.90])
-    ax.set_xlim([-74.03,-73.90])
-    ax.set_xticks([-74,-73.95,-73.9])
-    for feature in commutersmin[str(date)]:
-        edgeid = feature[idxEdge]
-        x = edges[edgeid]['x']
-        y = edges[edgeid]['y']
-        alpha = min([float(feature[idxCommuters])*0.3,1])
-        plt.plot(x, y, 'b-', alpha=alpha)
-
-    plt.savefig("minutegif/" + datetime.datetime.strftime(date,'%Y-%m-%dT%H%M%S') + '.png') 
-    plt.close()
-    
-ipdb.set_trace()
-commuters = collections.OrderedDict()
-i=0
-bad = 0
-for i in range(24*7):
-    date = datetime.datetime(2015,7,13) + datetime.timedelta(hours=float(i))
-    commuters[str(date)] = 0
-
-for feature in data_layer.getFeatures():
-    # convert strava time (local time) to datetime object 
-    date = datetime.datetime(feature[idxYear],1,1,feature[idxHour],feature[idxMin]) +\
-           datetime.timedelta(days=feature[idxDay]-1)
-
-    datestr = str(datetime.datetime(feature[idxYear],1,1,feature[idxHour]) +\
-           datetime.timedelta(days=feature[idxDay]-1))
-
-    # filter out dates that aren't supposed to be in the sample (not complete)
-    if date >= datetime.datetime(2015,7,20): bad += 1
-    else:
-#        if feature[idxEdge] == 1134166: # Manhattan Bridge Bikepath
-#        if feature[idxEdge] == 54853: # Random spot
-#        if feature[idxEdge] == 803175: # spot with 43 total weekly commuters; roughly scales to busiest by total population
-        if feature[idxEdge] == 54068: # spot with 122 total weekly commuters; roughly scales to busiest by population density
-            commuters[datestr] += feature[idxCommuters]
-        
-#    print feature[idxEdge], date, feature[idxCommuters]
-#    if str(date) in commuters.keys(): commuters[str(date)] += feature[idxCommuters]
-#    else: commuters[str(date)] = feature[idxCommuters]
-
-    # print progress
-    i += 1
-    if i % 10000 == 0: print float(i)#/float(nfeatures)
-
-with open('commuters.hour.4@E14.csv','w') as commuterfile:
-    for key in commuters.keys():
-        commuterfile.write(key + ',' + str(commuters[key]) + '\n')
-
-ipdb.set_trace()
-
-edgeCommuters = collections.OrderedDict()
-for feature in edge_layer.getFeatures():
-    edgeCommuters[feature[0]] = 0
-
-for feature in data_layer.getFeatures():
-    edgeCommuters[feature[0]] += feature[idxCommuters]
-
-with open('edgecommuters.csv','w') as commuterfile:
-    for key in edgeCommuters.keys():
-        commuterfile.write(str(key) + ',' + str(edgeCommuters[key]) + '\n')
+            if precipitation == 'N/A': precipitation = 0.0
+            weatherfile.write(str(time) + ',' + str(temperature) + ',' + str(humidity) + ',' + str(precipitation) + '\n')
+
+# read the data layer once into a sparse (minute x edge) matrix of commuters.
+# Only the matrix and its start are cached; the edges stay in their
+# memory-mapped store (see commuterMatrix).
+@pipeline.stage('commuters', files=[edgefile, datafile], code=[commuters, shapefile, edgemodule],
+                useqgis=useqgis)
+def readCommuters(useqgis):
+    print "Reading the commuter counts"
+    if useqgis: allcommuters = CommuterMatrix.fromLayer(data_layer, edgestore)
+    else: allcommuters = CommuterMatrix.fromDBF(datafile, edgestore)
+    return {'matrix':allcommuters.matrix, 'start':allcommuters.start}
+
+# the commuters stage's result as a CommuterMatrix on the edge store
+def commuterMatrix(result):
+    return CommuterMatrix(result['matrix'], result['start'], edgestore)
+
+# the week that is complete in the sample
+def completeWeek(result):
+    return commuterMatrix(result).timeRange(datetime.datetime(2015,7,13),
+                                            datetime.datetime(2015,7,20))
+
+# make an animated gif of bicycle traffic, one PNG per minute in minutegif/
+# (or pass e.g. 'week.mp4' to encode it directly)
+@pipeline.stage('animation', inputs=['commuters'], outputs=['minutegif'],
+                code=[commuters, animatemodule, commuterMatrix, completeWeek])
+def animation(allcommuters):
+    animate(completeWeek(allcommuters), 'minutegif', minutes=1, fps=30)
+
+# hourly commuters on one edge
+#edgeid = 1134166 # Manhattan Bridge Bikepath
+#edgeid = 54853 # Random spot
+#edgeid = 803175 # spot with 43 total weekly commuters; roughly scales to busiest by total population
+@pipeline.stage('hourly', inputs=['commuters'], outputs=['commuters.hour.4@E14.csv'],
+                code=[commuters, commuterMatrix, completeWeek], edgeid=54068) # spot with 122 total weekly commuters; roughly scales to busiest by population density
+def hourlyCommuters(allcommuters, edgeid):
+    commuters = completeWeek(allcommuters)
+    hourly = commuters.timeSeries(minutes=60, edgeids=[edgeid])
+
+    with open('commuters.hour.4@E14.csv','w') as commuterfile:
+        for i in range(len(hourly)):
+            commuterfile.write(str(commuters.timeOf(i, minutes=60)) + ',' + '%g' % hourly[i] + '\n')
+
+# total commuters on each edge
+@pipeline.stage('edgetotals', inputs=['commuters'], outputs=['edgecommuters.csv'],
+                code=[commuters, commuterMatrix])
+def edgeTotals(allcommuters):
+    edgeCommuters = commuterMatrix(allcommuters).edgeTotals()
+
+    with open('edgecommuters.csv','w') as commuterfile:
+        for edgeid, total in zip(edgestore.edgeid, edgeCommuters):
+            commuterfile.write(str(edgeid) + ',' + '%g' % total + '\n')
+
+# heatmap tiles of the week, by hour of the day too; browse them with
+# python -c "import tiles; tiles.serveTiles('tiles')"
+@pipeline.stage('tiles', inputs=['commuters'],
+                code=[commuters, tiles, spatial, commuterMatrix, completeWeek],
+                outputs=[os.path.join('tiles', layer, 'manifest.json')
+                         for layer in ['total'] + ['hour%02d' % hour for hour in range(24)]])
+def heatmapTiles(allcommuters):
+    return buildTiles(completeWeek(allcommuters), 'tiles', zooms=range(10, 16), hourly=True)
 
 
 #weather = getWeather(datetime.datetime(2015,7,13), airport='JFK')
 #print bad
-ipdb.set_trace()
+
+if __name__ == '__main__':
+    pipeline.main(description="Strava commuter analysis")
 
 # When your script is complete, call exitQgis() to remove the provider and
 # layer registries from memory
-qgs.exitQgis()
-
-    
+if useqgis: qgs.exitQgis()
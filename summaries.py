@@ -0,0 +1,192 @@
+import numpy as np
+import matplotlib
+matplotlib.use('Agg') # Workaround for Tkinter import error
+import matplotlib.pyplot as plt
+
+# Posterior summaries accumulated one chunk of samples at a time, so neither
+# memory nor plotting time depends on the length of the chain: the count, mean
+# and covariance (merged chunk by chunk), a fine 1D histogram of every
+# parameter (for plots and approximate quantiles) and a coarser 2D histogram of
+# every pair (for the triangle plot).
+#
+#   summary = PosteriorSummary.fromChunks(lambda: store.iterSamples(discard, thin), names)
+#   plotHistograms(summary)
+#   plotTriangle(summary, 'triangle.png')
+
+# the fine 1D histograms have this many bins per plotted bin
+_finefactor = 10
+
+class PosteriorSummary(object):
+
+    # lower and upper are the histogram range of each parameter; samples
+    # outside it are counted in the end bins
+    def __init__(self, names, lower, upper, bins=100, bins2d=40):
+
+        self.names = list(names)
+        self.ndim = len(self.names)
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        # a parameter that never changes still gets a histogram
+        flat = ~(self.upper > self.lower)
+        self.lower[flat] -= 0.5*np.maximum(np.abs(self.lower[flat]), 1e-12)
+        self.upper[flat] += 0.5*np.maximum(np.abs(self.upper[flat]), 1e-12)
+        self.bins = bins
+        self.bins2d = bins2d
+
+        self.count = 0
+        self.mean = np.zeros(self.ndim)
+        self._scatter = np.zeros((self.ndim, self.ndim))
+        self.hist = np.zeros((self.ndim, bins*_finefactor))
+        self.pairs = [(i, j) for i in range(self.ndim) for j in range(i)]
+        self.hist2d = np.zeros((len(self.pairs), bins2d, bins2d))
+
+    # Summarize the chunks yielded by makechunks(), which is called once for
+    # the histogram ranges (unless lower and upper are given) and once more to
+    # accumulate
+    @classmethod
+    def fromChunks(cls, makechunks, names, bins=100, bins2d=40, lower=None, upper=None):
+        if lower is None or upper is None:
+            lower = np.full(len(names), np.inf)
+            upper = np.full(len(names), -np.inf)
+            for samples in makechunks():
+                if len(samples) == 0: continue
+                lower = np.minimum(lower, np.min(samples, axis=0))
+                upper = np.maximum(upper, np.max(samples, axis=0))
+            lower[~np.isfinite(lower)] = 0.0
+            upper[~np.isfinite(upper)] = 0.0
+        summary = cls(names, lower, upper, bins=bins, bins2d=bins2d)
+        for samples in makechunks(): summary.add(samples)
+        return summary
+
+    def _binIndex(self, samples, nbins):
+        index = ((samples - self.lower)/(self.upper - self.lower)*nbins).astype(np.intp)
+        return np.clip(index, 0, nbins - 1)
+
+    # accumulate a (nsamples x ndim) chunk
+    def add(self, samples):
+        samples = np.asarray(samples, dtype=float).reshape((-1, self.ndim))
+        n = len(samples)
+        if n == 0: return
+
+        # merge the chunk's mean and scatter matrix into the running ones
+        mean = np.mean(samples, axis=0)
+        deviations = samples - mean
+        delta = mean - self.mean
+        total = self.count + n
+        self._scatter += deviations.T.dot(deviations) +\
+                         np.outer(delta, delta)*self.count*n/float(total)
+        self.mean += delta*n/float(total)
+        self.count = total
+
+        nfine = self.bins*_finefactor
+        fine = self._binIndex(samples, nfine)
+        for i in range(self.ndim):
+            self.hist[i] += np.bincount(fine[:, i], minlength=nfine)
+
+        coarse = self._binIndex(samples, self.bins2d)
+        for k, (i, j) in enumerate(self.pairs):
+            self.hist2d[k] += np.bincount(coarse[:, i]*self.bins2d + coarse[:, j],
+                                          minlength=self.bins2d**2).reshape((self.bins2d, self.bins2d))
+
+    # covariance of the samples
+    def cov(self):
+        return self._scatter/max(self.count - 1, 1)
+
+    # the bin edges of parameter i with nbins bins
+    def edges(self, i, nbins=None):
+        return np.linspace(self.lower[i], self.upper[i], (nbins or self.bins) + 1)
+
+    # (ndim x bins) histograms at the plotting resolution (or nbins, which must
+    # divide bins*10)
+    def histograms(self, nbins=None):
+        nbins = nbins or self.bins
+        return self.hist.reshape((self.ndim, nbins, -1)).sum(axis=2)
+
+    # the (bins2d x bins2d) histogram of parameter i (rows) against j (columns)
+    def histogram2d(self, i, j):
+        if i > j: return self.hist2d[self.pairs.index((i, j))]
+        return self.hist2d[self.pairs.index((j, i))].T
+
+    # approximate quantiles (percent) of each parameter, interpolated within the
+    # fine histogram bins; (len(q) x ndim)
+    def quantiles(self, q=(16, 50, 84)):
+        q = np.asarray(q, dtype=float)/100.0
+        result = np.empty((len(q), self.ndim))
+        for i in range(self.ndim):
+            cumulative = np.concatenate([[0.0], np.cumsum(self.hist[i])])/max(self.count, 1)
+            result[:, i] = np.interp(q, cumulative, self.edges(i, len(self.hist[i])))
+        return result
+
+# (chunksize x ndim) views of an in-memory array of samples, for fromChunks
+def iterArray(samples, chunksize=100000):
+    for start in range(0, len(samples), chunksize):
+        yield samples[start:start+chunksize]
+
+def _setupAxes(ax):
+    formatter = matplotlib.ticker.ScalarFormatter(useOffset=False)
+    ax.xaxis.set_major_formatter(formatter)
+
+# "Dimension{i}.png": the histogram of each parameter. Returns the filenames.
+def plotHistograms(summary, prefix='Dimension'):
+    counts = summary.histograms()
+    filenames = []
+    for i in range(summary.ndim):
+        edges = summary.edges(i)
+        plt.figure()
+        plt.hist(edges[:-1], bins=edges, weights=counts[i], color="k", histtype="step")
+        plt.title(summary.names[i])
+        filenames.append(prefix + "{0:d}".format(i) + '.png')
+        plt.savefig(filenames[-1])
+        plt.close()
+    return filenames
+
+# the levels of a 2D histogram that enclose the given fractions of the samples
+def _contourLevels(hist, fractions=(0.39346934, 0.86466472)):
+    values = np.sort(hist.ravel())[::-1]
+    cumulative = np.cumsum(values)/max(values.sum(), 1)
+    levels = [values[min(np.searchsorted(cumulative, f), len(values) - 1)] for f in fractions]
+    return np.unique(levels)
+
+# Triangle plot in the style of corner.corner, from the accumulated histograms:
+# each parameter's histogram (with its 16/50/84% quantiles) on the diagonal and
+# 2D histograms with 1 and 2 sigma contours below it
+def plotTriangle(summary, filename='triangle.png', size=2.0):
+    ndim = summary.ndim
+    fig, axes = plt.subplots(ndim, ndim, figsize=(size*ndim, size*ndim), squeeze=False)
+    counts = summary.histograms()
+    quantiles = summary.quantiles()
+    centers = [0.5*(summary.edges(i, summary.bins2d)[1:] + summary.edges(i, summary.bins2d)[:-1])
+               for i in range(ndim)]
+
+    for i in range(ndim):
+        for j in range(ndim):
+            ax = axes[i, j]
+            if j > i:
+                ax.set_axis_off()
+                continue
+            if i == j:
+                edges = summary.edges(i)
+                ax.hist(edges[:-1], bins=edges, weights=counts[i], color="k", histtype="step")
+                for value in quantiles[:, i]: ax.axvline(value, color="k", linestyle="dashed")
+                ax.set_yticks([])
+            else:
+                hist = summary.histogram2d(i, j)
+                ax.pcolormesh(summary.edges(j, summary.bins2d), summary.edges(i, summary.bins2d),
+                              hist, cmap='Greys')
+                levels = _contourLevels(hist)
+                if len(levels) > 0 and hist.max() > levels.min():
+                    ax.contour(centers[j], centers[i], hist, levels=np.sort(levels), colors='k',
+                               linewidths=0.8)
+                ax.set_ylim(summary.lower[i], summary.upper[i])
+                if j == 0: ax.set_ylabel(summary.names[i])
+                else: ax.set_yticklabels([])
+            ax.set_xlim(summary.lower[j], summary.upper[j])
+            if i == ndim - 1:
+                ax.set_xlabel(summary.names[j])
+                _setupAxes(ax)
+            else: ax.set_xticklabels([])
+            for label in ax.get_xticklabels(): label.set_rotation(45)
+
+    fig.subplots_adjust(wspace=0.05, hspace=0.05)
+    fig.savefig(filename)
+    plt.close(fig)
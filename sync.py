@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import socket
+import urllib2
+from multiprocessing.pool import ThreadPool
+from fileio import atomicWrite
+
+# the Google spreadsheet with the counts (first sheet) and locations (gid)
+baseurl = "https://docs.google.com/spreadsheet/ccc"
+key = "1uZ4_bSXdB188mBj8PVJL4fGErOeOyN1g5OR8_ZLdAlk"
+gid = "1919569404"
+
+# Incrementally refresh count.csv and location.csv from the spreadsheet. Both
+# sheets are requested concurrently; the ETag and Last-Modified of the last
+# download (kept in statefile) are sent back so that unchanged sheets are not
+# downloaded again. A sheet that did change is diffed row by row against the
+# local copy: new rows at the end are appended, any other change replaces the
+# file atomically, and either way its parsed cache (e.g. count.csv.npz) is
+# removed. Unchanged files are not touched.
+#
+# Point url at a local HTTP server to sync against a stand-in. Returns
+# {filename: {'changed', 'added', 'removed'}}, with the number of rows added to
+# and removed from the local copy (a changed row counts as both).
+def updateData(url=None, key=key, gid=gid, timeout=5, retries=3, statefile='sync.json'):
+
+    if url is None: url = baseurl
+    sheets = [('count.csv', url + "?key=" + key + "&output=csv"),
+              ('location.csv', url + "?key=" + key + "&gid=" + gid + "&output=csv")]
+
+    state = {}
+    if os.path.exists(statefile):
+        with open(statefile) as f:
+            state = json.load(f)
+
+    def sync(sheet):
+        filename, sheeturl = sheet
+        headers = state.get(filename, {}) if os.path.exists(filename) else {}
+        response = _fetch(sheeturl, headers, timeout, retries)
+        if response is None:
+            return filename, headers, {'changed':False, 'added':0, 'removed':0}
+        contents, headers = response
+        return filename, headers, _merge(filename, contents)
+
+    pool = ThreadPool(len(sheets))
+    try:
+        results = pool.map(sync, sheets)
+    finally:
+        pool.close()
+
+    summary = {}
+    for filename, headers, result in results:
+        state[filename] = headers
+        summary[filename] = result
+    atomicWrite(statefile, json.dumps(state))
+    return summary
+
+# GET url, sending the validators from a previous response. Returns None if the
+# server reports the data unchanged (304), else the body and new validators.
+def _fetch(url, validators, timeout, retries):
+    request = urllib2.Request(url)
+    if validators.get('etag'): request.add_header('If-None-Match', validators['etag'])
+    if validators.get('lastModified'):
+        request.add_header('If-Modified-Since', validators['lastModified'])
+
+    for attempt in range(retries + 1):
+        try:
+            response = urllib2.urlopen(request, timeout=timeout)
+            contents = response.read()
+            info = response.info()
+            return contents, {'etag':info.getheader('ETag'),
+                              'lastModified':info.getheader('Last-Modified')}
+        except urllib2.HTTPError as e:
+            if e.code == 304: return None
+            if e.code < 500 or attempt == retries: raise
+        except (urllib2.URLError, socket.timeout):
+            if attempt == retries: raise
+        # back off before retrying
+        time.sleep(2**attempt)
+
+# diff the downloaded rows against the local file and replace it if they differ
+def _merge(filename, contents):
+    rows = contents.splitlines()
+    oldrows = []
+    if os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            oldrows = f.read().splitlines()
+
+    if rows == oldrows:
+        return {'changed':False, 'added':0, 'removed':0}
+
+    # rows are compared as whole lines, keeping duplicates
+    counts = {}
+    for row in oldrows: counts[row] = counts.get(row, 0) + 1
+    added = 0
+    for row in rows:
+        if counts.get(row, 0) > 0: counts[row] -= 1
+        else: added += 1
+    removed = sum(counts.values())
+
+    if len(oldrows) > 0 and rows[:len(oldrows)] == oldrows:
+        # only new rows at the end; append them. If this is interrupted, the
+        # validators are not saved and the next sync rewrites the file.
+        with open(filename, 'ab') as f:
+            f.write('\n' + '\n'.join(rows[len(oldrows):]))
+            f.flush()
+            os.fsync(f.fileno())
+    else:
+        atomicWrite(filename, '\n'.join(rows))
+    if os.path.exists(filename + '.npz'): os.remove(filename + '.npz')
+    return {'changed':True, 'added':added, 'removed':removed}
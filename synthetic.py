@@ -0,0 +1,145 @@
+import csv
+import numpy as np
+from countdata import parseCounts
+from edgestore import EdgeStore
+from commuters import CommuterMatrix
+from animate import defaultbbox
+
+# Synthetic stand-ins for the inputs that otherwise come from the Google Sheet,
+# Weather Underground and the NYC shapefiles, for benchmarks and for checking
+# the fits against known parameters:
+#
+#   data = countTable(nlocations=50, nrows=20000)     # like readCounts('count.csv')
+#   writeCounts('count.csv', nlocations=50, nrows=20000)
+#   edgestore = edgeNetwork(100000)
+#   commuters = commuterMatrix(edgestore, minutes=7*1440, density=0.001)
+#
+# Everything is drawn from a RandomState(seed), so the same arguments always
+# give the same data.
+
+# the coefficients the counts are drawn with: bikers/minute =
+# zeropoint(location)*(temperature*ctemp + humidity*chumidity)
+truecoeffs = {'temperature':0.02, 'humidity':0.005}
+
+# The columns of a count.csv with nrows counts spread over nlocations, taken on
+# random days between 2013 and 2016 at 6am-8pm, with random weather and a
+# Poisson number of bikers over each interval (minutes) drawn with truecoeffs.
+# Returns the rows as lists of strings, the first being the header.
+def countRows(nlocations=20, nrows=5000, interval=30, seed=0):
+
+    random = np.random.RandomState(seed)
+    locations = ['Location %03d' % i for i in range(nlocations)]
+    zeropoints = random.uniform(0.5, 2.0, nlocations)
+
+    codes = random.randint(0, nlocations, nrows)
+    days = np.datetime64('2013-01-01') + random.randint(0, 4*365, nrows).astype('timedelta64[D]')
+    minutes = random.randint(6*60, 20*60, nrows)
+    temperature = np.round(random.uniform(20, 95, nrows), 1)
+    humidity = np.round(random.uniform(10, 100, nrows), 1)
+    precipitation = np.round(random.exponential(0.02, nrows)*(random.uniform(size=nrows) < 0.2), 2)
+
+    bikers = zeropoints[codes]*(truecoeffs['temperature']*temperature +
+                                truecoeffs['humidity']*humidity)
+    total = random.poisson(bikers*interval)
+    female = random.binomial(total, 0.3)
+
+    rows = [['Date', 'Time', 'Location', 'Interval', 'Female Bike', 'Male Bike', 'Total Bike',
+             'Temperature (BED)', 'Humidity (BED)', 'Precipitation (BED)']]
+    for i in range(nrows):
+        day = days[i].tolist()
+        rows.append(['%d/%d/%d' % (day.month, day.day, day.year),
+                     '%d:%02d' % (minutes[i]//60, minutes[i] % 60), locations[codes[i]],
+                     str(interval), str(female[i]), str(total[i] - female[i]), str(total[i]),
+                     '%g' % temperature[i], '%g' % humidity[i], '%g' % precipitation[i]])
+    return rows
+
+# write countRows to a count.csv file
+def writeCounts(csvname, nlocations=20, nrows=5000, interval=30, seed=0):
+    with open(csvname, 'wb') as f:
+        csv.writer(f).writerows(countRows(nlocations, nrows, interval, seed))
+
+# countRows parsed as readCounts would return them
+def countTable(nlocations=20, nrows=5000, interval=30, seed=0):
+    rows = countRows(nlocations, nrows, interval, seed)
+    return parseCounts([','.join(row) for row in rows])
+
+# A street network of nedges segments of up to length (degrees) inside bbox
+# (lon min, lat min, lon max, lat max), running east-west or north-south from
+# points on a grid like Manhattan's blocks, with one street name per row or
+# column of the grid
+def edgeNetwork(nedges, bbox=defaultbbox, length=0.002, seed=0):
+
+    random = np.random.RandomState(seed)
+    nx = int((bbox[2] - bbox[0])/length)
+    ny = int((bbox[3] - bbox[1])/length)
+    ix = random.randint(0, nx, nedges)
+    iy = random.randint(0, ny, nedges)
+    x1 = bbox[0] + ix*length
+    y1 = bbox[1] + iy*length
+    northsouth = random.uniform(size=nedges) < 0.5
+    x2 = np.where(northsouth, x1, x1 + length)
+    y2 = np.where(northsouth, y1 + length, y1)
+    names = np.where(northsouth, np.char.add('Avenue ', ix.astype(str)),
+                     np.char.add('Street ', iy.astype(str)))
+    edgeids = 1 + random.permutation(10*nedges)[:nedges]
+    return EdgeStore.fromColumns(edgeids, x1, y1, x2, y2, names)
+
+# The Strava columns (times as datetime64[m], edge IDs and commuters) of
+# commuters on the edges of edgestore over minutes from start: each edge has a
+# commuter in a given minute with probability density, peaking twice a day
+def commuterColumns(edgestore, minutes=1440, density=0.001, start='2015-07-13', seed=0):
+
+    random = np.random.RandomState(seed)
+    # rush hours at 8am and 6pm
+    hour = (np.arange(minutes) % 1440)/60.0
+    shape = 0.2 + np.exp(-0.5*((hour - 8)/1.5)**2) + np.exp(-0.5*((hour - 18)/1.5)**2)
+    perminute = random.poisson(density*edgestore.nedges*shape/shape.mean())
+
+    offsets = np.repeat(np.arange(minutes), perminute)
+    times = np.datetime64(start, 'm') + offsets.astype('timedelta64[m]')
+    edgeids = edgestore.edgeid[random.randint(0, edgestore.nedges, len(offsets))]
+    commuters = 1 + random.poisson(0.5, len(offsets))
+    return times, edgeids, commuters
+
+# commuterColumns as a CommuterMatrix
+def commuterMatrix(edgestore, minutes=1440, density=0.001, start='2015-07-13', seed=0):
+    times, edgeids, commuters = commuterColumns(edgestore, minutes, density, start, seed)
+    return CommuterMatrix.fromTimes(times, edgeids, commuters, edgestore, start=start,
+                                    end=np.datetime64(start, 'm') + np.timedelta64(minutes, 'm'))
+
+# An hourly METAR archive in the CSV layout of the IEM ASOS download (see
+# weatherstore.asosRows): nreports reports at 54 minutes past each hour from
+# start (UTC), with seasonal and daily temperature cycles, occasional missing
+# ('M') values and trace ('T') precipitation. Returns the rows as lists of
+# strings, the first being the header.
+def weatherRows(nreports=87600, station='BED', start='2007-01-01', seed=0):
+
+    random = np.random.RandomState(seed)
+    times = np.datetime64(start, 'm') + np.arange(nreports)*60 + 54
+    hours = np.arange(nreports)
+    temperature = (50 - 25*np.cos(2*np.pi*hours/8766.0) - 8*np.cos(2*np.pi*(hours - 3)/24.0) +
+                   random.normal(0, 4, nreports))
+    dewpoint = temperature - random.exponential(10, nreports)
+    humidity = 100*np.exp(17.625*(dewpoint - 32)/1.8/(243.04 + (dewpoint - 32)/1.8) -
+                          17.625*(temperature - 32)/1.8/(243.04 + (temperature - 32)/1.8))
+    wind = random.gamma(2, 4, nreports)
+    precipitation = random.exponential(0.05, nreports)*(random.uniform(size=nreports) < 0.08)
+    missing = random.uniform(size=(nreports, 4)) < 0.01
+
+    rows = [['station', 'valid', 'tmpf', 'dwpf', 'relh', 'drct', 'sknt', 'p01i', 'alti',
+             'vsby', 'gust']]
+    for i in range(nreports):
+        precip = '%.2f' % precipitation[i]
+        if precip == '0.00' and precipitation[i] > 0: precip = 'T'
+        row = [station, str(times[i]).replace('T', ' '), '%.1f' % temperature[i],
+               '%.1f' % dewpoint[i], '%.2f' % humidity[i], '%d' % (10*random.randint(0, 36)),
+               '%.0f' % wind[i], precip, '%.2f' % random.normal(30.0, 0.2), '10.00',
+               '%.0f' % (wind[i] + 10) if wind[i] > 15 else 'M']
+        for j in np.where(missing[i])[0]: row[2 + j] = 'M'
+        rows.append(row)
+    return rows
+
+# write weatherRows to a CSV archive
+def writeWeather(csvname, nreports=87600, station='BED', start='2007-01-01', seed=0):
+    with open(csvname, 'wb') as f:
+        csv.writer(f).writerows(weatherRows(nreports, station, start, seed))
@@ -0,0 +1,24 @@
+import numpy as np
+import synthetic
+from design import Design
+from bootstrap import NormalBlocks, resampleWeights
+
+# each resample against a dense weighted least-squares fit of the same design
+def test_normalBlocksMatchLstsq():
+    data = synthetic.countTable(6, 400, seed=3)
+    design = Design(data, 'temperature + humidity + weekday')
+    y = data['Total Bike']/data['Interval']
+    random = np.random.RandomState(0)
+    weights = resampleWeights(design.ndata, 5, random=random)
+    # a location left out of a resample
+    weights[-1, design.codes == 2] = 0.0
+
+    pars = NormalBlocks(design, y).solve(weights)
+    matrix = design.matrix().toarray()
+    for w, result in zip(weights, pars):
+        used = np.where(np.abs(matrix).T.dot(w) > 0)[0]
+        root = np.sqrt(w)
+        expected = np.linalg.lstsq(matrix[:, used]*root[:, np.newaxis], y*root, rcond=None)[0]
+        assert np.allclose(result[used], expected)
+        assert np.all(np.isnan(np.delete(result, used)))
+    assert np.isnan(pars[-1, design.ncoeffs + 2])
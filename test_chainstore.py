@@ -0,0 +1,60 @@
+import collections
+import numpy as np
+import emcee
+from chainstore import ChainStore
+from sampling import runMCMC
+
+State = collections.namedtuple('State', ['coords', 'log_prob', 'random_state'])
+
+def _states(nsteps, nwalkers=4, ndim=3):
+    random = np.random.RandomState(0)
+    return [State(random.standard_normal((nwalkers, ndim)), random.standard_normal(nwalkers), i)
+            for i in range(nsteps)]
+
+# steps saved after the last checkpoint are lost when a run is interrupted, and
+# saving them again from the reopened store gives the uninterrupted chain
+def test_resumeFromCheckpoint(tmpdir):
+    states = _states(30)
+    whole = ChainStore(str(tmpdir.join('whole')), 4, 3, thin=2, dtype=float, segment=4)
+    for state in states: whole.save(state)
+    whole.checkpoint(states[-1])
+
+    path = str(tmpdir.join('resumed'))
+    store = ChainStore(path, 4, 3, thin=2, dtype=float, segment=4)
+    for state in states[:13]: store.save(state)
+    store.checkpoint(states[12])
+    for state in states[13:17]: store.save(state)
+    del store
+
+    store = ChainStore.open(path)
+    assert store.iteration == 13
+    assert store.lastState()['random_state'] == 12
+    for state in states[13:]: store.save(state)
+    store.checkpoint(states[-1])
+
+    assert np.array_equal(store.getChain(), whole.getChain())
+    assert np.array_equal(store.getChain(), [state.coords for state in states[1::2]])
+    assert np.array_equal(ChainStore.open(path).getChain(discard=7, thin=4),
+                          whole.getChain(discard=7, thin=4))
+
+def _logprob(pars):
+    return -0.5*np.sum(pars**2, axis=-1)
+
+# a sampler restarted from the checkpoint continues the same chain
+def test_runMCMCResumes(tmpdir):
+    nwalkers, ndim = 8, 2
+    p0 = np.random.RandomState(1).standard_normal((nwalkers, ndim))
+    runs = {}
+    for name, stops in [('whole', [40]), ('resumed', [25, 40])]:
+        path = str(tmpdir.join(name))
+        store = ChainStore(path, nwalkers, ndim, thin=2, segment=5)
+        for maxsteps in stops:
+            if store.iteration > 0: store = ChainStore.open(path)
+            sampler = emcee.EnsembleSampler(nwalkers, ndim, _logprob, vectorize=True)
+            sampler.random_state = np.random.RandomState(2).get_state()
+            run = runMCMC(sampler, p0, maxsteps=maxsteps, checkevery=1000, store=store,
+                          checkpointevery=10)
+        assert run['nsteps'] == 40
+        runs[name] = store.getChain()
+    assert runs['whole'].shape == (20, nwalkers, ndim)
+    assert np.array_equal(runs['resumed'], runs['whole'])
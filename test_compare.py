@@ -0,0 +1,31 @@
+import numpy as np
+import synthetic
+from compare import compareModels
+from likelihood import BikeLike
+from mapfit import fitMAP
+
+formulas = ['temperature + humidity', 'temperature + humidity + precipitation',
+            'temperature + precipitation']
+
+# the synthetic counts are drawn with temperature and humidity only
+def test_recoversTrueCovariates():
+    for seed in range(3):
+        data = synthetic.countTable(20, 5000, seed=seed)
+        results = compareModels(data, formulas, nfolds=3, nsamples=200, nprocs=1, seed=seed)
+        assert all(result['errors'] == [] for result in results)
+        true, extra, missing = results
+        assert true['bic'] < extra['bic'] < missing['bic']
+        assert missing['waic'] > max(true['waic'], extra['waic'])
+        assert missing['cvloglike'] < min(true['cvloglike'], extra['cvloglike'])
+
+# the fits maximize the Poisson likelihood with its analytic derivatives
+def test_poissonDerivatives():
+    like = BikeLike(synthetic.countTable(6, 1500, seed=1), poisson=True)
+    pars = fitMAP(like)['pars']*1.01
+    step = 1e-6
+    steps = step*np.eye(like.ndim)
+    gradient = np.array([(like(pars + delta) - like(pars - delta))/(2*step) for delta in steps])
+    hessian = np.array([(like.gradient(pars + delta) - like.gradient(pars - delta))/(2*step)
+                        for delta in steps])
+    assert np.allclose(like.gradient(pars), gradient, rtol=1e-5, atol=1e-3)
+    assert np.allclose(like.hessian(pars), hessian, rtol=1e-5, atol=1e-3)
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+import synthetic
+from design import Design
+from likelihood import BikeLike
+from mapfit import fitMAP, laplaceSamples
+
+# the synthetic counts are all taken between 6am and 8pm
+def test_unobservedHoursGetNoCoefficient():
+    data = synthetic.countTable(4, 2000)
+    like = BikeLike(data, formula='temperature + humidity + hour')
+    assert 'hour=3' not in like.design.names
+    fit = fitMAP(like)
+    assert fit['converged']
+    assert fit['unidentified'] == []
+    assert np.all(np.isfinite(fit['cov']))
+
+# a categorical level with a coefficient but no observations behind it
+def test_unidentifiedLevelIsNamed():
+    data = synthetic.countTable(4, 2000)
+    design = Design(data, 'temperature + humidity + hour')
+    name, codes, levels = design.factors[0]
+    padded = Design.fromArrays(design.terms, design.locations, design.codes, design.columns,
+                               design.columnnames, [(name, codes, levels + [23])])
+    like = BikeLike.fromArrays(padded, data['Interval'], data['Total Bike']/data['Interval'])
+
+    with pytest.raises(ValueError) as error:
+        fitMAP(like)
+    assert 'hour=23' in str(error.value)
+
+    fit = fitMAP(like, singular='pinv')
+    assert fit['unidentified'] == ['hour=23']
+    samples = laplaceSamples(fit, 100, like=like, seed=0)
+    assert np.allclose(samples[:, padded.index('hour=23')], fit['pars'][padded.index('hour=23')])
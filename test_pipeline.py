@@ -0,0 +1,41 @@
+import os
+from pipeline import Pipeline
+
+def _pipeline(tmpdir, ran):
+    pipeline = Pipeline(str(tmpdir.join('cache')), verbose=False)
+
+    @pipeline.stage('fit', optional=True)
+    def fit():
+        ran.append('fit')
+        return 2
+
+    @pipeline.stage('figures', inputs=['fit'], outputs=lambda filenames: filenames)
+    def figures(nfigures):
+        ran.append('figures')
+        filenames = [str(tmpdir.join('figure%d.png' % i)) for i in range(nfigures)]
+        for filename in filenames: open(filename, 'w').close()
+        return filenames
+
+    @pipeline.stage('extra', optional=True)
+    def extra():
+        ran.append('extra')
+
+    return pipeline
+
+# an optional stage runs when a stage that is not optional reads it
+def test_optionalInputRuns(tmpdir):
+    ran = []
+    _pipeline(tmpdir, ran).run()
+    assert ran == ['fit', 'figures']
+
+# the files a stage reports writing are checked like declared outputs
+def test_resultOutputs(tmpdir):
+    ran = []
+    pipeline = _pipeline(tmpdir, ran)
+    pipeline.run()
+    del ran[:]
+    pipeline.run()
+    assert ran == []
+    os.remove(str(tmpdir.join('figure1.png')))
+    pipeline.run()
+    assert ran == ['figures']
@@ -0,0 +1,57 @@
+import struct
+import numpy as np
+import pytest
+from shapefile import dbfFields, readDBF, readDBFColumns
+
+fields = [('EDGE_ID', 'N', 10, 0), ('TRIPS', 'N', 8, 2), ('COUNT', 'N', 5, 0),
+          ('NAME', 'C', 12, 0), ('ACTIVE', 'L', 1, 0)]
+
+# (deleted, values) of each record, the values as they are padded into the file
+records = [(False, ['1001', '3.50', '7', 'Broadway', 'T']),
+           (True, ['1002', '1.25', '2', 'Deleted St', 'F']),
+           (False, ['1003', '', '', 'Main St', 'F']),
+           (False, ['1004', '0.75', '12', '', 'Y']),
+           (False, ['1005', '12.00', '0', 'Canal St', '?'])]
+
+# a dBase III file of the records above
+def _writeDBF(filename):
+    recordlength = 1 + sum(field[2] for field in fields)
+    headerlength = 32 + 32*len(fields) + 1
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<BBBBIHH20x', 3, 116, 1, 1, len(records), headerlength, recordlength))
+        for name, fieldtype, length, decimals in fields:
+            f.write(struct.pack('<11sc4xBB14x', name.encode('ascii'), fieldtype.encode('ascii'),
+                                length, decimals))
+        f.write(b'\r')
+        for deleted, values in records:
+            f.write(b'*' if deleted else b' ')
+            for (name, fieldtype, length, decimals), value in zip(fields, values):
+                # numbers are right-aligned, everything else left-aligned
+                value = value.rjust(length) if fieldtype == 'N' else value.ljust(length)
+                f.write(value.encode('ascii'))
+        f.write(b'\x1a')
+
+def test_readDBF(tmpdir):
+    filename = str(tmpdir.join('edges.dbf'))
+    _writeDBF(filename)
+    assert dbfFields(filename) == fields
+
+    chunks = list(readDBF(filename, chunksize=2))
+    assert [len(chunk['EDGE_ID']) for chunk in chunks] == [1, 2, 1]
+
+    columns = readDBFColumns(filename, chunksize=2)
+    assert columns['EDGE_ID'].dtype == np.int64
+    assert columns['EDGE_ID'].tolist() == [1001, 1003, 1004, 1005]
+    assert np.allclose(columns['TRIPS'], [3.5, np.nan, 0.75, 12.0], equal_nan=True)
+    # a blank integer field makes the column float
+    assert np.allclose(columns['COUNT'], [7, np.nan, 12, 0], equal_nan=True)
+    assert columns['NAME'].tolist() == [b'Broadway', b'Main St', b'', b'Canal St']
+    assert columns['ACTIVE'].tolist() == [True, False, True, False]
+
+def test_readDBFColumns(tmpdir):
+    filename = str(tmpdir.join('edges.dbf'))
+    _writeDBF(filename)
+    columns = readDBFColumns(filename, columns=['NAME', 'EDGE_ID'])
+    assert sorted(columns) == ['EDGE_ID', 'NAME']
+    with pytest.raises(KeyError):
+        readDBFColumns(filename, columns=['EDGE_ID', 'LENGTH'])
@@ -0,0 +1,36 @@
+import numpy as np
+from spatial import EdgeIndex, getMinDist
+
+# short random segments around Manhattan, and points among them and well away
+def _network(seed=0, nsegments=300, npoints=40):
+    random = np.random.RandomState(seed)
+    x1 = random.uniform(-74.02, -73.93, nsegments)
+    y1 = random.uniform(40.70, 40.80, nsegments)
+    x2 = x1 + random.normal(0, 0.002, nsegments)
+    y2 = y1 + random.normal(0, 0.002, nsegments)
+    lon = np.append(random.uniform(-74.03, -73.92, npoints), [-73.5, -75.0])
+    lat = np.append(random.uniform(40.69, 40.81, npoints), [40.75, 41.5])
+    return (x1, y1, x2, y2), lon, lat
+
+# the distance from each point to every segment, one at a time
+def _bruteForce(segments, lon, lat):
+    return np.array([[getMinDist(x1, y1, x2, y2, x0, y0) for x1, y1, x2, y2 in zip(*segments)]
+                     for x0, y0 in zip(lon, lat)])
+
+def test_nearestMatchesGetMinDist():
+    segments, lon, lat = _network()
+    distances = _bruteForce(segments, lon, lat)
+    index = EdgeIndex(*segments)
+    for k in [1, 3]:
+        for (rows, dist), expected in zip(index.nearest(lon, lat, k=k), distances):
+            order = np.argsort(expected)[:k]
+            assert rows.tolist() == order.tolist()
+            assert np.allclose(dist, expected[order])
+
+def test_radiusMatchesGetMinDist():
+    segments, lon, lat = _network(seed=1)
+    distances = _bruteForce(segments, lon, lat)
+    index = EdgeIndex(*segments, cellsize=0.002)
+    for (rows, dist), expected in zip(index.radius(lon, lat, 250.0), distances):
+        assert sorted(rows.tolist()) == np.where(expected <= 250.0)[0].tolist()
+        assert np.allclose(dist, expected[rows])
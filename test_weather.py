@@ -0,0 +1,38 @@
+import numpy as np
+from weather import intervalMean, intervalSum
+
+# reports at random minutes of a day, with intervals that start before the
+# first report, end after the last and are sometimes empty
+def _reports(seed):
+    random = np.random.RandomState(seed)
+    minutes = np.sort(random.choice(np.arange(60, 1380), 30, replace=False))
+    values = random.uniform(0, 1, len(minutes))
+    values[random.uniform(size=len(minutes)) < 0.1] = np.nan
+    starts = random.randint(0, 1440, 200)
+    ends = starts + random.randint(0, 120, 200)
+    day = np.datetime64('2015-07-13T00:00', 'm')
+    return minutes, values, starts, ends, day
+
+def test_intervalMean():
+    for seed in range(5):
+        minutes, values, starts, ends, day = _reports(seed)
+        good = np.isfinite(values)
+        t, v = minutes[good], values[good]
+        # the report holding at each minute of the day
+        held = v[np.clip(np.searchsorted(t, np.arange(1600), side='right') - 1, 0, len(t) - 1)]
+        expected = [held[start:end].mean() if end > start else held[start]
+                    for start, end in zip(starts, ends)]
+        result = intervalMean(day + minutes, values, day + starts, day + ends)
+        assert np.allclose(result, expected)
+
+def test_intervalSum():
+    for seed in range(5):
+        minutes, values, starts, ends, day = _reports(seed)
+        # each amount spread over the minutes since the previous report
+        perminute = np.zeros(1600)
+        for i in range(1, len(minutes)):
+            if np.isfinite(values[i]):
+                perminute[minutes[i-1]:minutes[i]] = values[i]/(minutes[i] - minutes[i-1])
+        expected = [perminute[start:end].sum() for start, end in zip(starts, ends)]
+        result = intervalSum(day + minutes, values, day + starts, day + ends)
+        assert np.allclose(result, expected)
@@ -0,0 +1,24 @@
+import numpy as np
+from weatherstore import _routineReports, _sinceLastReport
+
+def _minutes(*times):
+    return np.array([np.datetime64('2015-06-01T' + time, 'm').astype(np.int64) for time in times])
+
+# routine reports at :54 with specials on either side of the one at 10:54,
+# whose running total covers the special at 10:15
+def test_specialsAroundRoutineReport():
+    times = _minutes('09:54', '10:15', '10:54', '10:58', '11:20', '11:54')
+    totals = np.array([0.0, 0.05, 0.10, 0.02, 0.04, 0.06])
+    assert _routineReports(times).tolist() == [True, False, True, False, False, True]
+    amounts = _sinceLastReport(times, totals)
+    assert np.allclose(amounts, [0.0, 0.05, 0.05, 0.02, 0.02, 0.02])
+    assert np.isclose(amounts.sum(), 0.16)
+
+# a missing total is skipped, and the next report differences against the one
+# before it in the period
+def test_missingTotal():
+    times = _minutes('09:54', '10:15', '10:30', '10:54')
+    totals = np.array([0.01, 0.03, np.nan, 0.08])
+    amounts = _sinceLastReport(times, totals)
+    assert np.isnan(amounts[2])
+    assert np.allclose(amounts[[0, 1, 3]], [0.01, 0.03, 0.05])
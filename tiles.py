@@ -0,0 +1,239 @@
+import os
+import json
+import hashlib
+import threading
+import collections
+import BaseHTTPServer
+import SocketServer
+import numpy as np
+import scipy.sparse
+import matplotlib
+matplotlib.use('Agg') # Workaround for Tkinter import error
+import matplotlib.pyplot as plt
+from fileio import atomicWrite, replace
+from spatial import _expandRanges
+
+# Heatmap of commuters per edge as a slippy-map tile pyramid (Web Mercator,
+# 256 pixel tiles laid out as tiledir/layer/z/x/y.png) and a small server for
+# it. Each edge is drawn with its total and overlapping edges add up. Every
+# tile's inputs (its edges, their values and the style) are hashed into
+# tiledir/layer/manifest.json, so a re-run only redraws the tiles that changed:
+#
+#   buildTiles(commuters, 'tiles', zooms=range(10, 16), hourly=True)
+#   serveTiles('tiles', port=8000)   # then browse to http://localhost:8000/
+
+tilesize = 256
+
+# pixel coordinates of lon/lat (degrees) in the whole map at zoom
+def mercatorPixels(lon, lat, zoom):
+    scale = tilesize*2.0**zoom
+    lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+    x = (np.asarray(lon, dtype=float) + 180.0)/360.0*scale
+    y = (1.0 - np.arcsinh(np.tan(lat))/np.pi)/2.0*scale
+    return x, y
+
+# Sample the segments about once per pixel at zoom. Returns the pixel (x, y)
+# and the segment each sample belongs to.
+def _samplePixels(x1, y1, x2, y2, zoom):
+    px1, py1 = mercatorPixels(x1, y1, zoom)
+    px2, py2 = mercatorPixels(x2, y2, zoom)
+    nsamples = np.ceil(np.maximum(np.abs(px2 - px1), np.abs(py2 - py1))).astype(int) + 1
+    step, owner = _expandRanges(np.zeros(len(nsamples), dtype=int), nsamples)
+    t = step/np.maximum(nsamples[owner] - 1, 1).astype(float)
+    x = np.floor(px1[owner] + t*(px2[owner] - px1[owner])).astype(np.int64)
+    y = np.floor(py1[owner] + t*(py2[owner] - py1[owner])).astype(np.int64)
+    return x, y, owner
+
+# colour a tile of summed values, transparent where there are none
+def _colorTile(grid, vmax, cmap):
+    level = np.clip(np.log1p(grid)/np.log1p(vmax), 0.0, 1.0)
+    rgba = cmap(level)
+    rgba[..., 3] = np.where(grid > 0, 0.3 + 0.7*level, 0.0)
+    return rgba
+
+def _writePNG(filename, rgba):
+    directory = os.path.dirname(filename)
+    if not os.path.exists(directory): os.makedirs(directory)
+    with open(filename + '.tmp', 'wb') as f:
+        plt.imsave(f, rgba, format='png')
+    replace(filename + '.tmp', filename)
+
+# Render one layer of the pyramid from values, one per edgestore row (edges
+# with no value are not drawn), into tiledir/layer. Colours run on a log scale
+# up to vmax (the largest value by default). Tiles whose inputs did not change
+# since the last run are kept, and tiles that no longer have any edges are
+# removed. Returns the number of tiles rendered, kept and removed.
+def renderLayer(values, edgestore, tiledir, layer='total', zooms=range(10, 16), bbox=None,
+                vmax=None, cmap='hot'):
+
+    values = np.asarray(values, dtype=float)
+    rows = np.where(values > 0)[0]
+    if bbox is not None:
+        rows = np.intersect1d(rows, edgestore.index().bbox(*bbox)[0])
+    if vmax is None: vmax = values[rows].max() if len(rows) > 0 else 1.0
+    style = json.dumps([vmax, cmap])
+    colormap = plt.get_cmap(cmap)
+
+    layerdir = os.path.join(tiledir, layer)
+    manifestfile = os.path.join(layerdir, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifestfile):
+        with open(manifestfile) as f:
+            manifest = json.load(f)
+    newmanifest = {}
+    stats = {'rendered':0, 'kept':0, 'removed':0}
+
+    for zoom in zooms:
+        x, y, owner = _samplePixels(edgestore.x1[rows], edgestore.y1[rows],
+                                    edgestore.x2[rows], edgestore.y2[rows], zoom)
+        ntiles = 2**zoom
+        keys = (x//tilesize)*ntiles + y//tilesize
+        order = np.argsort(keys, kind='mergesort')
+        keys, owner = keys[order], owner[order]
+        pixels = (y[order] % tilesize)*tilesize + x[order] % tilesize
+        tilekeys, starts = np.unique(keys, return_index=True)
+        stops = np.append(starts[1:], len(keys))
+
+        for key, start, stop in zip(tilekeys, starts, stops):
+            name = '%d/%d/%d' % (zoom, key//ntiles, key % ntiles)
+            tilerows = rows[np.unique(owner[start:stop])]
+            digest = hashlib.sha1(style.encode('utf-8'))
+            digest.update(np.ascontiguousarray(edgestore.edgeid[tilerows]).tobytes())
+            digest.update(np.ascontiguousarray(values[tilerows]).tobytes())
+            newmanifest[name] = digest.hexdigest()
+
+            filename = os.path.join(layerdir, name + '.png')
+            if manifest.get(name) == newmanifest[name] and os.path.exists(filename):
+                stats['kept'] += 1
+                continue
+            grid = np.bincount(pixels[start:stop], weights=values[rows[owner[start:stop]]],
+                               minlength=tilesize*tilesize).reshape((tilesize, tilesize))
+            _writePNG(filename, _colorTile(grid, vmax, colormap))
+            stats['rendered'] += 1
+
+    for name in set(manifest) - set(newmanifest):
+        filename = os.path.join(layerdir, name + '.png')
+        if os.path.exists(filename): os.remove(filename)
+        stats['removed'] += 1
+
+    if not os.path.exists(layerdir): os.makedirs(layerdir)
+    atomicWrite(manifestfile, json.dumps(newmanifest, sort_keys=True))
+    return stats
+
+# (24 x nedges) commuters summed by hour of the day
+def hourOfDayTotals(commuters):
+    hourly = commuters.resample(60)
+    hours = commuters.times(60).astype('datetime64[h]').astype(np.int64) % 24
+    binning = scipy.sparse.csr_matrix((np.ones(len(hours)), (hours, np.arange(len(hours)))),
+                                      shape=(24, len(hours)))
+    return (binning*hourly).tocsr()
+
+# Render the total commuters on each edge into the layer 'total' and, if
+# hourly, the totals by hour of the day into 'hour00' to 'hour23' (sharing one
+# colour scale). Returns {layer: renderLayer stats}.
+def buildTiles(commuters, tiledir, zooms=range(10, 16), hourly=False, bbox=None, cmap='hot'):
+    edgestore = commuters.edgestore
+    stats = {'total':renderLayer(commuters.edgeTotals(), edgestore, tiledir, 'total',
+                                 zooms=zooms, bbox=bbox, cmap=cmap)}
+    if hourly:
+        byhour = hourOfDayTotals(commuters)
+        vmax = max(byhour.max(), 1.0)
+        for hour in range(24):
+            layer = 'hour%02d' % hour
+            stats[layer] = renderLayer(byhour[hour].toarray().ravel(), edgestore, tiledir, layer,
+                                       zooms=zooms, bbox=bbox, vmax=vmax, cmap=cmap)
+    return stats
+
+# Least-recently-used cache of tile contents, keyed by path and modification
+# time so re-rendered tiles are picked up
+class TileCache(object):
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.tiles = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filename):
+        try:
+            key = (filename, os.stat(filename).st_mtime)
+        except OSError:
+            return None
+        with self.lock:
+            if key in self.tiles:
+                contents = self.tiles.pop(key)
+                self.tiles[key] = contents
+                self.hits += 1
+                return contents
+        with open(filename, 'rb') as f:
+            contents = f.read()
+        with self.lock:
+            self.misses += 1
+            self.tiles[key] = contents
+            while len(self.tiles) > self.maxsize: self.tiles.popitem(last=False)
+        return contents
+
+# a Leaflet map of a layer over OpenStreetMap, served at /
+_viewer = '''<!DOCTYPE html>
+<html><head><title>Commuters</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.0.3/dist/leaflet.css"/>
+<script src="https://unpkg.com/leaflet@1.0.3/dist/leaflet.js"></script>
+<style>html, body, #map {height: 100%%; margin: 0}</style></head>
+<body><div id="map"></div><script>
+var map = L.map('map').setView([40.75, -73.97], 12);
+L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png',
+            {attribution: '&copy; OpenStreetMap contributors'}).addTo(map);
+L.tileLayer('/%s/{z}/{x}/{y}.png').addTo(map);
+</script></body></html>
+'''
+
+class _TileHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = self.path.split('?')[0].strip('/')
+        if path == '' or path == 'index.html':
+            layer = self.path.split('layer=')[1].split('&')[0] if 'layer=' in self.path else 'total'
+            if not layer.isalnum(): layer = 'total'
+            return self._send(200, 'text/html', _viewer % layer)
+
+        parts = path.split('/')
+        if len(parts) != 4 or not parts[3].endswith('.png') or\
+           not all(part.isdigit() for part in parts[1:3] + [parts[3][:-4]]) or\
+           parts[0] in ('', '.', '..'):
+            return self._send(404, 'text/plain', 'not found')
+        contents = self.server.cache.get(os.path.join(self.server.tiledir, *parts))
+        if contents is None: return self._send(404, 'text/plain', 'not found')
+        self._send(200, 'image/png', contents, cache=True)
+
+    def _send(self, code, contenttype, contents, cache=False):
+        self.send_response(code)
+        self.send_header('Content-Type', contenttype)
+        self.send_header('Content-Length', str(len(contents)))
+        if cache: self.send_header('Cache-Control', 'max-age=60')
+        self.end_headers()
+        self.wfile.write(contents)
+
+    def log_message(self, format, *args):
+        pass
+
+class TileServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, tiledir, port=8000, host='localhost', cachesize=4096):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), _TileHandler)
+        self.tiledir = tiledir
+        self.cache = TileCache(cachesize)
+
+# Serve tiledir/layer/z/x/y.png over HTTP until interrupted, keeping the most
+# recently used cachesize tiles in memory. / shows the 'total' layer on a map
+# (/?layer=hour08 for another).
+def serveTiles(tiledir, port=8000, host='localhost', cachesize=4096):
+    server = TileServer(tiledir, port=port, host=host, cachesize=cachesize)
+    print 'serving ' + tiledir + ' at http://' + host + ':' + str(port) + '/'
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
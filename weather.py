@@ -0,0 +1,233 @@
+import os
+import time
+import socket
+import datetime
+import urllib2
+import numpy as np
+from multiprocessing.pool import ThreadPool
+from fileio import atomicWrite
+
+# daily history, e.g.
+# https://www.wunderground.com/history/airport/BOS/2015/10/8/DailyHistory.html?&format=1
+baseurl = 'https://www.wunderground.com/history/airport/'
+
+def _weatherURL(date, airport, url):
+    return url + airport + '/' +\
+           str(date.year) + '/' + str(date.month) + '/' + str(date.day) +\
+           '/DailyHistory.html?&format=1'
+
+# download url, retrying with backoff; None if it cannot be read
+def _download(url, retries=0, timeout=30):
+    for attempt in range(retries + 1):
+        try:
+            return urllib2.urlopen(urllib2.Request(url), timeout=timeout).read()
+        except urllib2.HTTPError as e:
+            if e.code < 500: break
+        except (urllib2.URLError, socket.timeout):
+            pass
+        if attempt < retries: time.sleep(2**attempt)
+    print 'could not open ' + url
+    return None
+
+# parse a daily history into lists of strings, with times shifted to local time
+def parseWeather(text, timezone=5):
+
+    data = text.split('<br />\n')
+
+    # is it stable? is it uniform for all airports/times?
+    # TODO: read with CSV reader (?), check that required keys are present
+    weather = {'time':[],'temperature':[],'dewPoint':[],'humidity':[],'pressure':[],'visibility':[],
+                'windDir':[],'windSpeed':[],'windGust':[],'precipitation':[],'events':[],'conditions':[]}
+    for values in data[1:]:
+        valarr = values.split(',')
+        if len(valarr) == 14:
+            weather['time'].append(datetime.datetime.strptime(valarr[13],'%Y-%m-%d %H:%M:%S') -
+                                   datetime.timedelta(hours=timezone))
+            weather['temperature'].append(valarr[1])
+            weather['dewPoint'].append(valarr[2])
+            weather['humidity'].append(valarr[3])
+            weather['pressure'].append(valarr[4])
+            weather['visibility'].append(valarr[5])
+            weather['windDir'].append(valarr[12])
+            weather['windSpeed'].append(valarr[7])
+            weather['windGust'].append(valarr[8])
+            weather['precipitation'].append(valarr[9])
+            weather['events'].append(valarr[10])
+            weather['conditions'].append(valarr[11])
+    return weather
+
+# get the weather for a given day by airport code (is it international?)
+def getWeather(date, airport='BED', timezone=5, url=baseurl):
+    text = _download(_weatherURL(date, airport, url))
+    if text is None: return -1
+    return parseWeather(text, timezone=timezone)
+
+# Get the weather for every day from start to end (inclusive) at an airport, as
+# one getWeather-style dict in time order. Each day's history is cached in
+# cachedir/airport/YYYY-MM-DD.txt once the day is over, so a historical day is
+# only downloaded once. Days missing from the cache are downloaded concurrently
+# by nthreads threads, each retried up to retries times; days that still fail
+# are left out. Set url to point at a local stand-in server.
+def getWeatherRange(airport, start, end, timezone=5, cachedir='weathercache',
+                    nthreads=8, retries=3, url=baseurl):
+
+    if isinstance(start, datetime.datetime): start = start.date()
+    if isinstance(end, datetime.datetime): end = end.date()
+    days = [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+
+    airportdir = os.path.join(cachedir, airport)
+    if not os.path.exists(airportdir): os.makedirs(airportdir)
+
+    def cachename(day):
+        return os.path.join(airportdir, day.strftime('%Y-%m-%d') + '.txt')
+
+    def fetch(day):
+        filename = cachename(day)
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                return f.read()
+        text = _download(_weatherURL(day, airport, url), retries=retries)
+        # today (and the future) may still change; only keep finished days
+        if text is not None and day < datetime.date.today():
+            atomicWrite(filename, text)
+        return text
+
+    missing = [day for day in days if not os.path.exists(cachename(day))]
+    if len(missing) > 0:
+        pool = ThreadPool(min(nthreads, len(missing)))
+        try:
+            texts = dict(zip(missing, pool.map(fetch, missing)))
+        finally:
+            pool.close()
+    else: texts = {}
+
+    weather = None
+    for day in days:
+        text = texts[day] if day in texts else fetch(day)
+        if text is None: continue
+        dayweather = parseWeather(text, timezone=timezone)
+        if weather is None: weather = dayweather
+        else:
+            for key in weather.keys(): weather[key].extend(dayweather[key])
+
+    if weather is None: weather = parseWeather('', timezone=timezone)
+    return weather
+
+# fields of a getWeather dict that are numeric; 'Calm' winds are 0 and any other
+# non-numeric entry ('N/A', '-', '') is NaN
+numericfields = ['temperature', 'dewPoint', 'humidity', 'pressure', 'visibility',
+                 'windSpeed', 'windGust', 'precipitation']
+
+# convert a getWeather dict into time-sorted NumPy columns, with 'time' as
+# datetime64[m]
+def weatherColumns(weather):
+
+    columns = {}
+    for field in numericfields:
+        values = np.empty(len(weather[field]))
+        for i, value in enumerate(weather[field]):
+            try:
+                values[i] = float(value)
+            except ValueError:
+                values[i] = 0.0 if value == 'Calm' else np.nan
+        columns[field] = values
+    return mergeReports(np.array(weather['time'], dtype='datetime64[m]'), columns)
+
+# Sort reports (times and a dict of float columns) by time and merge those at
+# the same minute (precipitation summed, otherwise the last report kept).
+# Returns the columns with 'time' added.
+def mergeReports(times, columns):
+
+    times = np.asarray(times, dtype='datetime64[m]')
+    order = np.argsort(times, kind='mergesort')
+    times = times[order]
+    unique, first = np.unique(times, return_index=True)
+    last = np.append(first[1:], len(times)) - 1
+
+    merged = {'time':unique}
+    for field, values in columns.items():
+        values = np.asarray(values, dtype=float)[order]
+        if field == 'precipitation':
+            values = np.add.reduceat(np.nan_to_num(values), first) if len(first) > 0 else values
+        else:
+            values = values[last]
+        merged[field] = values
+    return merged
+
+def _minutes(times):
+    return np.asarray(times, dtype='datetime64[m]').astype(np.int64).astype(float)
+
+# Mean of a quantity reported at times (each report holding until the next one)
+# over [start, end), from prefix sums of value*duration. Before the first or
+# after the last report the nearest report is used; empty intervals give the
+# value at start. NaN reports are skipped.
+def intervalMean(times, values, start, end):
+
+    good = np.isfinite(values)
+    t = _minutes(times)[good]
+    v = np.asarray(values, dtype=float)[good]
+    start = _minutes(start)
+    end = _minutes(end)
+    if len(t) == 0: return np.full(len(start), np.nan)
+
+    # integral of the step function at each report
+    integral = np.concatenate([[0.0], np.cumsum(v[:-1]*np.diff(t))])
+
+    def integrate(x):
+        k = np.clip(np.searchsorted(t, x, side='right') - 1, 0, len(t) - 1)
+        return integral[k] + v[k]*(x - t[k]), k
+
+    a, ka = integrate(start)
+    b, kb = integrate(end)
+    duration = end - start
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(duration > 0, (b - a)/duration, v[ka])
+
+# Total of an accumulated quantity (e.g. precipitation) over [start, end). Each
+# report is the amount since the previous report, spread evenly over that
+# period, so partial overlaps are prorated. The amount before the first report
+# is unknown and ignored.
+def intervalSum(times, amounts, start, end):
+
+    t = _minutes(times)
+    p = np.nan_to_num(np.asarray(amounts, dtype=float))
+    start = _minutes(start)
+    end = _minutes(end)
+    if len(t) < 2: return np.zeros(len(start))
+
+    # cumulative amount at each report and the rate leading up to it
+    cumulative = np.concatenate([[0.0], np.cumsum(p[1:])])
+    rate = np.concatenate([[0.0], p[1:]/np.diff(t)])
+
+    def accumulate(x):
+        k = np.clip(np.searchsorted(t, x, side='right'), 1, len(t) - 1)
+        return np.clip(cumulative[k-1] + rate[k]*(x - t[k-1]),
+                       cumulative[k-1], cumulative[k])
+
+    return accumulate(end) - accumulate(start)
+
+# weather fields filled into the count table, as '<label> (<airport>)'
+joinfields = {'temperature':'Temperature', 'humidity':'Humidity',
+              'windSpeed':'Wind Speed', 'precipitation':'Precipitation'}
+
+# Fill the weather covariates of the count table (readCounts) from a getWeather
+# dict for airport: each count is given the mean temperature, humidity and wind
+# speed, and the total precipitation, over its Interval minutes from datetime.
+def joinWeather(data, weather, airport='BED', fields=joinfields):
+    return joinColumns(data, weatherColumns(weather), airport, fields)
+
+# joinWeather from columns already in the layout of weatherColumns (e.g.
+# weatherstore.openStation)
+def joinColumns(data, columns, airport='BED', fields=joinfields):
+
+    start = data['datetime'].astype('datetime64[m]')
+    end = start + np.round(np.nan_to_num(data['Interval'])).astype('timedelta64[m]')
+
+    for field, label in fields.items():
+        if field == 'precipitation':
+            values = intervalSum(columns['time'], columns[field], start, end)
+        else:
+            values = intervalMean(columns['time'], columns[field], start, end)
+        values[np.isnat(start)] = np.nan
+        data[label + ' (' + airport + ')'] = values
+    return data
@@ -0,0 +1,309 @@
+import os
+import csv
+import json
+import shutil
+import argparse
+import itertools
+import numpy as np
+from fileio import atomicWrite, replace
+from weather import numericfields, mergeReports
+
+# Offline weather history from station observation archives on local disk, in
+# place of scraping Weather Underground one day at a time. Archives are read in
+# chunks of rows straight into typed NumPy columns and written as one
+# directory per station of time-sorted .npy files that are memory-mapped on
+# load:
+#
+#   importArchives(['bed-2007-2016.csv'], 'weatherstore', archive='asos')
+#   columns = openStation('weatherstore', 'BED')    # like weather.weatherColumns
+#   weather.joinColumns(data, columns, airport='BED')
+#
+# The columns are those of weather.weatherColumns, in the same units as
+# getWeather (F, %, inHg, miles, mph, inches), with windDir (degrees) as well;
+# missing values are NaN.
+
+fields = numericfields + ['windDir']
+
+# Registry of archive formats, by name. Each converts the header and a chunk of
+# rows (lists of strings) into (stations, times as datetime64[m] UTC, {field:
+# float column}), with precipitation as the amount since the previous report,
+# the convention of weather.intervalSum. Formats registered with runningtotals
+# give METAR's running total since the last routine report instead, which
+# becomes the amount since the previous report once a station's reports are
+# sorted (see _sinceLastReport).
+archives = {}
+runningtotals = set()
+
+def archive(name, totals=False):
+    def register(func):
+        archives[name] = func
+        if totals: runningtotals.add(name)
+        return func
+    return register
+
+# Parse strings into floats: entries in missing (and empty ones) become NaN, as
+# does anything else that is not a number
+def toFloat(values, missing=('M', 'N/A', '-', '')):
+    values = np.char.strip(np.asarray(values, dtype=str))
+    values = np.where(np.isin(values, list(missing)), 'nan', values)
+    try:
+        return values.astype(float)
+    except ValueError:
+        result = np.empty(len(values))
+        for i, value in enumerate(values):
+            try:
+                result[i] = float(value)
+            except ValueError:
+                result[i] = np.nan
+        return result
+
+def _column(header, rows, name):
+    if name not in header: return np.full(len(rows), '', dtype=str)
+    i = header.index(name)
+    return np.array([row[i] if i < len(row) else '' for row in rows], dtype=str)
+
+# datetime64[m] from 'YYYY-MM-DD HH:MM' or 'YYYY-MM-DDTHH:MM:SS'; NaT if malformed
+def _times(values):
+    values = np.char.replace(np.char.strip(np.asarray(values, dtype=str)), ' ', 'T')
+    try:
+        return values.astype('datetime64[m]')
+    except ValueError:
+        times = np.empty(len(values), dtype='datetime64[m]')
+        for i, value in enumerate(values):
+            try:
+                times[i] = np.datetime64(value, 'm')
+            except ValueError:
+                times[i] = np.datetime64('NaT')
+        return times
+
+# relative humidity (%) from temperature and dew point (C), Magnus formula
+def _humidity(temperature, dewpoint):
+    return 100.0*np.exp(17.625*dewpoint/(243.04 + dewpoint) -
+                        17.625*temperature/(243.04 + temperature))
+
+# METAR reports as CSV from the Iowa Environmental Mesonet ASOS download
+# (station, valid, tmpf, dwpf, relh, drct, sknt, p01i, alti, vsby, gust, ...),
+# with 'M' for missing and 'T' for a trace of precipitation. p01i is the
+# precipitation since the last routine (hourly) report, which is taken a few
+# minutes before the hour.
+@archive('asos', totals=True)
+def asosRows(header, rows):
+    column = lambda name: _column(header, rows, name)
+    knots = 1.150779
+    precipitation = column('p01i')
+    columns = {'temperature':toFloat(column('tmpf')),
+               'dewPoint':toFloat(column('dwpf')),
+               'humidity':toFloat(column('relh')),
+               'pressure':toFloat(column('alti')),
+               'visibility':toFloat(column('vsby')),
+               'windSpeed':toFloat(column('sknt'))*knots,
+               'windGust':toFloat(column('gust'))*knots,
+               'windDir':toFloat(column('drct')),
+               'precipitation':toFloat(np.where(precipitation == 'T', '0', precipitation))}
+    return column('station'), _times(column('valid')), columns
+
+# value,quality,... fields of the NOAA Integrated Surface Database: one part
+# (the value by default) scaled by scale, with the missing sentinel as NaN
+def _isdValue(values, missing, scale=1.0, part=0):
+    parts = [value.split(',') for value in values]
+    values = np.array([split[part] if part < len(split) else '' for split in parts], dtype=str)
+    result = toFloat(np.where(np.char.strip(values) == missing, '', values))
+    return result*scale
+
+# NOAA Integrated Surface Database "global-hourly" CSV (STATION, DATE, TMP,
+# DEW, SLP, WND, VIS, AA1, ...) with temperatures in tenths of C, pressure in
+# tenths of hPa, wind in tenths of m/s, visibility in m and precipitation in
+# tenths of mm, converted to getWeather's units; humidity is computed from the
+# temperature and dew point. Only 1-hour precipitation (from AA1 to AA4, AA1
+# first) is used; longer accumulation periods would overlap the hourly ones, as
+# would those of the special reports (REPORT_TYPE FM-16) within the hour.
+@archive('isd')
+def isdRows(header, rows):
+    column = lambda name: _column(header, rows, name)
+    temperature = _isdValue(column('TMP'), '+9999', 0.1)
+    dewpoint = _isdValue(column('DEW'), '+9999', 0.1)
+    mph = 2.236936
+    columns = {'temperature':temperature*1.8 + 32.0,
+               'dewPoint':dewpoint*1.8 + 32.0,
+               'humidity':_humidity(temperature, dewpoint),
+               'pressure':_isdValue(column('SLP'), '99999', 0.1/33.863886),
+               'visibility':_isdValue(column('VIS'), '999999', 1.0/1609.344),
+               'windSpeed':_isdValue(column('WND'), '9999', 0.1*mph, part=3),
+               'windGust':_isdValue(column('OC1'), '9999', 0.1*mph),
+               'windDir':_isdValue(column('WND'), '999'),
+               'precipitation':_isdHourly(column)}
+    special = np.char.strip(column('REPORT_TYPE')) == 'FM-16'
+    columns['precipitation'][special] = np.nan
+    return column('STATION'), _times(column('DATE')), columns
+
+# the depth of the first of the AA1-AA4 liquid precipitation fields whose
+# period is 1 hour; NaN where there is none
+def _isdHourly(column):
+    precipitation = None
+    for name in ['AA4', 'AA3', 'AA2', 'AA1']:
+        period = _isdValue(column(name), '99')
+        depth = _isdValue(column(name), '9999', 0.1/25.4, part=1)
+        if precipitation is None: precipitation = np.full(len(depth), np.nan)
+        precipitation = np.where(period == 1, depth, precipitation)
+    return precipitation
+
+def _stationDir(outdir, station):
+    return os.path.join(outdir, station)
+
+# append the rows of one station to its spill files
+def _spill(spilldir, station, times, columns):
+    stationdir = os.path.join(spilldir, station)
+    if not os.path.exists(stationdir): os.makedirs(stationdir)
+    with open(os.path.join(stationdir, 'time.bin'), 'ab') as f:
+        times.astype(np.int64).tofile(f)
+    for field in fields:
+        with open(os.path.join(stationdir, field + '.bin'), 'ab') as f:
+            columns[field].astype(float).tofile(f)
+
+# Whether each report at sorted times (minutes) is a routine one: those at the
+# minute past the hour most reports of their (UTC) day are taken at, e.g. :54.
+# Special reports come at any minute, and the routine minute of a station can
+# change over the years.
+def _routineReports(times):
+    if len(times) == 0: return np.zeros(0, dtype=bool)
+    days = times//1440
+    keys, inverse, counts = np.unique(days*60 + times % 60, return_inverse=True,
+                                      return_counts=True)
+    # the most common minute of each day, the earliest of any tie
+    keydays = keys//60
+    order = np.lexsort((-counts, keydays))
+    first = order[np.concatenate([[True], keydays[order][1:] != keydays[order][:-1]])]
+    routine = np.zeros(len(keys), dtype=bool)
+    routine[first] = True
+    return routine[inverse]
+
+# Precipitation since the previous report from METAR's running totals at sorted
+# times (minutes). A total accumulates from just after one routine report up to
+# and including the next, so within such a period each report adds its
+# increase over the previous one, and the first report of a period its whole
+# total. Special reports are then not counted again by the routine report that
+# follows them, and each period adds up to the total of its routine report.
+# Missing totals are skipped.
+def _sinceLastReport(times, totals):
+    routine = _routineReports(times)
+    # routine reports end their period
+    periods = np.cumsum(routine) - routine
+    amounts = np.full(len(totals), np.nan)
+    good = np.where(np.isfinite(totals))[0]
+    periods = periods[good]
+    values = totals[good]
+    sameperiod = np.concatenate([[False], periods[1:] == periods[:-1]])
+    previous = np.concatenate([[0.0], values[:-1]])
+    amounts[good] = np.where(sameperiod, np.maximum(values - previous, 0.0), values)
+    return amounts
+
+# sort a station's spilled rows by time, merging reports at the same minute as
+# weather.weatherColumns does, and write them as .npy files. With totals, the
+# precipitation is METAR's running totals.
+def _writeStation(spilldir, outdir, station, timezone, sources, totals):
+    spill = os.path.join(spilldir, station)
+    times = np.fromfile(os.path.join(spill, 'time.bin'), dtype=np.int64)
+    order = np.argsort(times, kind='mergesort')
+    times = times[order]
+    columns = dict((field, np.fromfile(os.path.join(spill, field + '.bin'))[order])
+                   for field in fields)
+    if totals: columns['precipitation'] = _sinceLastReport(times, columns['precipitation'])
+    # UTC to local standard time
+    times -= int(round(60*timezone))
+    columns = mergeReports(times.astype('datetime64[m]'), columns)
+
+    stationdir = _stationDir(outdir, station)
+    tmpdir = stationdir + '.tmp'
+    if os.path.exists(tmpdir): shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+    for field in ['time'] + fields:
+        np.save(os.path.join(tmpdir, field + '.npy'), columns[field])
+    times = columns['time']
+    meta = {'station':station, 'nreports':len(times), 'timezone':timezone,
+            'start':str(times[0]) if len(times) else None,
+            'end':str(times[-1]) if len(times) else None, 'sources':sources}
+    atomicWrite(os.path.join(tmpdir, 'meta.json'), json.dumps(meta, indent=1))
+
+    if os.path.exists(stationdir): shutil.rmtree(stationdir)
+    replace(tmpdir, stationdir)
+    return meta
+
+# Import archive files (all in one format of archives) into outdir, replacing
+# the stations they contain. Times are shifted from UTC to local standard time
+# by timezone hours (as getWeather does). stations maps archive station IDs to
+# the names to store them under (e.g. {'72509014702':'BED'}); with it, other
+# stations are skipped. Rows are read chunksize at a time and spilled to disk
+# per station, so only the final sort of one station is held in memory.
+# Returns the metadata of each station written.
+def importArchives(filenames, outdir, archive='asos', timezone=5, stations=None,
+                   chunksize=200000):
+
+    parse = archives[archive]
+    spilldir = os.path.join(outdir, '.import')
+    if os.path.exists(spilldir): shutil.rmtree(spilldir)
+    os.makedirs(spilldir)
+    seen = set()
+    try:
+        for filename in filenames:
+            with open(filename, 'rb') as f:
+                # skip the comment lines IEM puts before the header
+                reader = csv.reader(line for line in f if not line.startswith('#'))
+                header = [name.strip() for name in next(reader)]
+                while True:
+                    rows = list(itertools.islice(reader, chunksize))
+                    if len(rows) == 0: break
+                    ids, times, columns = parse(header, rows)
+                    ids = np.char.strip(ids)
+                    good = ~np.isnat(times)
+                    for station in np.unique(ids[good]):
+                        name = str(station) if stations is None else stations.get(station)
+                        if name is None: continue
+                        match = good & (ids == station)
+                        _spill(spilldir, name, times[match],
+                               dict((field, columns[field][match]) for field in fields))
+                        seen.add(name)
+        sources = [os.path.basename(filename) for filename in filenames]
+        return [_writeStation(spilldir, outdir, station, timezone, sources,
+                              archive in runningtotals)
+                for station in sorted(seen)]
+    finally:
+        shutil.rmtree(spilldir, ignore_errors=True)
+
+# the stations in a store
+def listStations(outdir):
+    return sorted(name for name in os.listdir(outdir)
+                  if os.path.exists(os.path.join(outdir, name, 'meta.json')))
+
+# A station's columns, memory-mapped, in the layout of weather.weatherColumns;
+# with start and/or end (datetimes), only the reports in [start, end)
+def openStation(outdir, station, start=None, end=None, mmap_mode='r'):
+    stationdir = _stationDir(outdir, station)
+    if not os.path.exists(os.path.join(stationdir, 'meta.json')):
+        raise KeyError("No station " + station + " in " + outdir)
+    columns = {'time':np.load(os.path.join(stationdir, 'time.npy'), mmap_mode=mmap_mode)}
+    for field in fields:
+        columns[field] = np.load(os.path.join(stationdir, field + '.npy'), mmap_mode=mmap_mode)
+    if start is None and end is None: return columns
+    first = 0 if start is None else np.searchsorted(columns['time'], np.datetime64(start, 'm'))
+    last = len(columns['time']) if end is None else\
+           np.searchsorted(columns['time'], np.datetime64(end, 'm'))
+    return dict((key, values[first:last]) for key, values in columns.items())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import weather observation archives into a store")
+    parser.add_argument('filenames', nargs='+', help="archive CSV files")
+    parser.add_argument('--archive', choices=sorted(archives), default='asos', help="archive format")
+    parser.add_argument('-o', '--outdir', default='weatherstore', help="store directory")
+    parser.add_argument('--timezone', type=float, default=5,
+                        help="hours local standard time is behind UTC")
+    parser.add_argument('--station', nargs=2, action='append', metavar=('ID', 'NAME'),
+                        help="store archive station ID as NAME (repeatable); other stations are skipped")
+    args = parser.parse_args(argv)
+
+    stations = dict(args.station) if args.station else None
+    for meta in importArchives(args.filenames, args.outdir, args.archive, args.timezone, stations):
+        print "%-12s %8d reports  %s to %s" % (meta['station'], meta['nreports'],
+                                               meta['start'], meta['end'])
+
+if __name__ == '__main__':
+    main()